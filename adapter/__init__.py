@@ -1,3 +1,3 @@
-from .session import Session, SessionManager
+from .session import Session, SessionManager, get_session_manager
 
-__all__ = ['Session', 'SessionManager'] 
\ No newline at end of file
+__all__ = ['Session', 'SessionManager', 'get_session_manager'] 
\ No newline at end of file
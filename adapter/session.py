@@ -1,77 +1,338 @@
+"""
+会话管理
+
+按用户保存会话状态，支持多线程访问：
+1. 会话记录使用 __slots__，不为每个会话分配 __dict__
+2. 按用户ID分段加锁，不同分段的访问互不阻塞
+3. 每个分段维护按过期时间排序的堆，清理过期会话只处理到期的条目
+4. 会话总数有上限，超出时淘汰最久未访问的会话
+5. 后台线程定期清理过期会话
+6. 会话保存Dify返回的对话ID，超时前的消息延续同一个Dify对话
+7. 配置状态存储时会话变更写后落盘，重启后首次访问时恢复
+8. 由回复缓存回答的一轮问答记录在会话上，下一条消息按追问处理并把该轮作为上下文发给Dify
+"""
+
 import time
 import uuid
-from typing import Dict, Any, Optional
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from config.settings import settings
 from utils.logger import app_logger
+from utils.state_store import StateStore, get_state_store
+
+# 会话在状态存储中的命名空间
+SESSION_NAMESPACE = "session"
+
 
 class Session:
-    def __init__(self, user_id: str, conversation_id: Optional[str] = None):
+    __slots__ = ('user_id', 'conversation_id', 'last_activity', 'expires_at', 'card_instance_id',
+                 'dify_conversation_id', 'cached_turn')
+
+    def __init__(self, user_id: str, conversation_id: Optional[str] = None, timeout: float = 1800):
         self.user_id = user_id
         self.conversation_id = conversation_id or str(uuid.uuid4())
-        self.last_activity = int(time.time())
+        self.last_activity = time.time()
+        self.expires_at = self.last_activity + timeout
         self.card_instance_id = None
-    
-    def update_activity(self):
-        """更新最后活动时间"""
-        self.last_activity = int(time.time())
-    
+        # Dify首次回复时分配的对话ID
+        self.dify_conversation_id: Optional[str] = None
+        # 最近一轮由回复缓存回答的问答 {"query", "answer"}，Dify对话中没有这一轮的记录
+        self.cached_turn: Optional[Dict[str, str]] = None
+
+    def update_activity(self, timeout: float = 1800):
+        """更新最后活动时间，并顺延过期时间"""
+        self.last_activity = time.time()
+        self.expires_at = self.last_activity + timeout
+
     def set_card_instance_id(self, card_instance_id: str):
         """设置卡片实例ID"""
         self.card_instance_id = card_instance_id
-    
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], timeout: float = 1800) -> "Session":
+        """从 to_dict 的结果恢复会话"""
+        session = cls(data["user_id"], data.get("conversation_id"), timeout)
+        session.last_activity = data.get("last_activity", session.last_activity)
+        session.expires_at = session.last_activity + timeout
+        session.card_instance_id = data.get("card_instance_id")
+        session.dify_conversation_id = data.get("dify_conversation_id")
+        session.cached_turn = data.get("cached_turn")
+        return session
+
     def to_dict(self) -> Dict[str, Any]:
         """将会话转换为字典"""
         return {
             "user_id": self.user_id,
             "conversation_id": self.conversation_id,
-            "last_activity": self.last_activity,
-            "card_instance_id": self.card_instance_id
+            "last_activity": int(self.last_activity),
+            "card_instance_id": self.card_instance_id,
+            "dify_conversation_id": self.dify_conversation_id,
+            "cached_turn": self.cached_turn
         }
 
+
+class _Stripe:
+    """一个加锁分段：LRU顺序的会话表和过期堆"""
+
+    __slots__ = ('lock', 'sessions', 'heap', 'seq')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # (过期时间, 序号, 会话)；访问只顺延会话上的过期时间，堆条目在到期时按需重新入堆
+        self.heap: List[Tuple[float, int, Session]] = []
+        self.seq = 0
+
+    def push(self, session: Session):
+        """调用方须持有分段锁"""
+        self.seq += 1
+        heapq.heappush(self.heap, (session.expires_at, self.seq, session))
+
+    def rebuild_heap(self):
+        """丢弃已淘汰会话的堆条目，调用方须持有分段锁"""
+        self.heap = []
+        for session in self.sessions.values():
+            self.seq += 1
+            self.heap.append((session.expires_at, self.seq, session))
+        heapq.heapify(self.heap)
+
+
 class SessionManager:
-    def __init__(self, session_timeout: int = 1800):  # 默认30分钟超时
-        self.sessions: Dict[str, Session] = {}
+    def __init__(self, session_timeout: int = 1800, max_sessions: int = 10000,
+                 stripes: int = 16, sweep_interval: float = 60,
+                 store: Optional[StateStore] = None):  # 默认30分钟超时
+        """
+        初始化会话管理器
+
+        Args:
+            session_timeout: 会话无活动后的过期时间(秒)
+            max_sessions: 会话总数上限，各分段平均分配
+            stripes: 加锁分段数
+            sweep_interval: 后台清理过期会话的间隔(秒)
+            store: 状态存储，为None时会话只保存在内存中
+        """
         self.session_timeout = session_timeout
-        app_logger.info(f"会话管理器初始化，超时时间: {session_timeout}秒")
-    
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.store = store or StateStore()
+        self._stripes = [_Stripe() for _ in range(max(1, stripes))]
+        self._stripe_capacity = max(1, -(-max_sessions // len(self._stripes)))
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'created': 0,
+            'restored': 0,
+            'expired': 0,
+            'evictions': 0,
+            'dify_started': 0,
+            'dify_reused': 0,
+            'dify_rotated': 0
+        }
+        self._stop_event = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        app_logger.info(f"会话管理器初始化，超时时间: {session_timeout}秒，会话上限: {max_sessions}")
+
+    def _stripe(self, user_id: str) -> _Stripe:
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def _persist(self, session: Session):
+        """写入状态存储的待写表，由存储的后台线程落盘"""
+        self.store.put(SESSION_NAMESPACE, session.user_id, session.to_dict(), session.expires_at)
+
     def get_session(self, user_id: str) -> Session:
         """获取用户会话，如果不存在或已过期则创建新会话"""
-        current_time = int(time.time())
-        
-        if user_id in self.sessions:
-            session = self.sessions[user_id]
-            if current_time - session.last_activity <= self.session_timeout:
-                app_logger.debug(f"用户 {user_id} 使用现有会话 {session.conversation_id}")
-                session.update_activity()
-                return session
-            else:
+        stripe = self._stripe(user_id)
+        now = time.time()
+        evicted = 0
+
+        with stripe.lock:
+            session = stripe.sessions.get(user_id)
+            if session is not None:
+                if session.expires_at > now:
+                    stripe.sessions.move_to_end(user_id)
+                    session.update_activity(self.session_timeout)
+                    self._persist(session)
+                    self._count('hits')
+                    app_logger.debug(f"用户 {user_id} 使用现有会话 {session.conversation_id}")
+                    return session
+                del stripe.sessions[user_id]
+                self._count('expired')
                 app_logger.info(f"用户 {user_id} 的会话已过期，创建新会话")
-        else:
-            app_logger.info(f"用户 {user_id} 的会话不存在，创建新会话")
-        
-        # 创建新会话
-        session = Session(user_id)
-        self.sessions[user_id] = session
-        app_logger.debug(f"为用户 {user_id} 创建新会话 {session.conversation_id}")
+                session = None
+            else:
+                # 重启前或被淘汰的会话从状态存储中恢复
+                record = self.store.get(SESSION_NAMESPACE, user_id)
+                if record is not None:
+                    session = Session.from_dict(record, self.session_timeout)
+                    self._count('restored')
+                    app_logger.info(f"从状态存储恢复用户 {user_id} 的会话 {session.conversation_id}")
+                else:
+                    app_logger.info(f"用户 {user_id} 的会话不存在，创建新会话")
+
+            if session is None:
+                # 创建新会话
+                session = Session(user_id, timeout=self.session_timeout)
+                self._count('created')
+            else:
+                session.update_activity(self.session_timeout)
+            self._persist(session)
+            stripe.sessions[user_id] = session
+            stripe.push(session)
+            while len(stripe.sessions) > self._stripe_capacity:
+                stripe.sessions.popitem(last=False)
+                evicted += 1
+            # 被淘汰会话的堆条目在到期时丢弃；堆明显大于会话表时重建
+            if len(stripe.heap) > 2 * len(stripe.sessions) + 64:
+                stripe.rebuild_heap()
+
+        with self._stats_lock:
+            self._stats['misses'] += 1
+            self._stats['evictions'] += evicted
         return session
-    
-    def clear_expired_sessions(self):
-        """清理过期会话"""
-        current_time = int(time.time())
-        expired_users = []
-        
-        for user_id, session in self.sessions.items():
-            if current_time - session.last_activity > self.session_timeout:
-                expired_users.append(user_id)
-        
-        for user_id in expired_users:
-            app_logger.info(f"清理用户 {user_id} 的过期会话 {self.sessions[user_id].conversation_id}")
-            del self.sessions[user_id]
-        
-        app_logger.debug(f"清理了 {len(expired_users)} 个过期会话，当前会话数量: {len(self.sessions)}")
-    
+
+    @staticmethod
+    def session_key(conversation_id: str, sender_id: str) -> str:
+        """钉钉会话与发送者组成的会话键，群聊中每个成员各自延续对话"""
+        return f"{conversation_id}:{sender_id}"
+
+    def record_dify_request(self, session: Session):
+        """记录一次Dify请求是延续已有对话还是开始新对话"""
+        self._count('dify_reused' if session.dify_conversation_id else 'dify_started')
+
+    def bind_dify_conversation(self, session: Session, sent_id: Optional[str], returned_id: Optional[str]):
+        """
+        保存Dify返回的对话ID
+
+        Args:
+            session: 发起请求的会话
+            sent_id: 请求中携带的对话ID
+            returned_id: Dify响应中的对话ID
+        """
+        if not returned_id:
+            return
+        if sent_id and returned_id != sent_id:
+            self._count('dify_rotated')
+            app_logger.info(f"会话 {session.user_id} 的Dify对话已更换: {sent_id} -> {returned_id}")
+        if session.dify_conversation_id != returned_id:
+            session.dify_conversation_id = returned_id
+            self._persist(session)
+
+    def record_cached_answer(self, session: Session, query: str, answer: str):
+        """记录由回复缓存回答的一轮问答，下一条消息可能是针对它的追问"""
+        session.cached_turn = {"query": query, "answer": answer}
+        self._persist(session)
+
+    def take_cached_turn(self, session: Session) -> Optional[Dict[str, str]]:
+        """取出并清除缓存回答的问答，由调用方作为上下文随下一次Dify请求发送"""
+        turn = session.cached_turn
+        if turn is not None:
+            session.cached_turn = None
+            self._persist(session)
+        return turn
+
+    def reset_dify_conversation(self, session: Session):
+        """Dify拒绝已保存的对话ID（如对话已被删除）时丢弃，下次请求开始新对话"""
+        if session.dify_conversation_id:
+            self._count('dify_rotated')
+            app_logger.info(f"会话 {session.user_id} 的Dify对话 {session.dify_conversation_id} 已失效")
+            session.dify_conversation_id = None
+            self._persist(session)
+
+    def remove_session(self, user_id: str) -> bool:
+        """移除用户会话，堆中的条目在到期时丢弃"""
+        stripe = self._stripe(user_id)
+        self.store.delete(SESSION_NAMESPACE, user_id)
+        with stripe.lock:
+            return stripe.sessions.pop(user_id, None) is not None
+
+    def clear_expired_sessions(self) -> int:
+        """清理过期会话，只处理堆顶已到期的条目，返回清理数量"""
+        now = time.time()
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                heap = stripe.heap
+                while heap and heap[0][0] <= now:
+                    _, _, session = heapq.heappop(heap)
+                    if stripe.sessions.get(session.user_id) is not session:
+                        # 已被淘汰、移除或替换
+                        continue
+                    if session.expires_at > now:
+                        # 到期前有过访问，按新的过期时间重新入堆
+                        stripe.push(session)
+                        continue
+                    del stripe.sessions[session.user_id]
+                    removed += 1
+                    app_logger.debug(f"清理用户 {session.user_id} 的过期会话 {session.conversation_id}")
+
+        if removed:
+            self._count('expired', removed)
+            app_logger.debug(f"清理了 {removed} 个过期会话，当前会话数量: {len(self)}")
+        return removed
+
+    def start(self):
+        """启动后台清理线程"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.wait(self.sweep_interval):
+                try:
+                    self.clear_expired_sessions()
+                except Exception as e:
+                    app_logger.error(f"清理过期会话失败: {str(e)}")
+
+        self._sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        """停止后台清理线程"""
+        self._stop_event.set()
+
+    def __len__(self) -> int:
+        return sum(len(stripe.sessions) for stripe in self._stripes)
+
     def get_all_sessions(self) -> Dict[str, Dict[str, Any]]:
         """获取所有会话信息"""
-        return {
-            user_id: session.to_dict() 
-            for user_id, session in self.sessions.items()
-        } 
\ No newline at end of file
+        sessions = {}
+        for stripe in self._stripes:
+            with stripe.lock:
+                sessions.update((user_id, session.to_dict()) for user_id, session in stripe.sessions.items())
+        return sessions
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取命中、未命中、淘汰和Dify对话复用统计"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['sessions'] = len(self)
+        stats['heap_entries'] = sum(len(stripe.heap) for stripe in self._stripes)
+        return stats
+
+
+_manager: Optional[SessionManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """获取进程内共享的会话管理器，首次获取时启动后台清理线程"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = SessionManager(
+                    session_timeout=settings.SESSION_TIMEOUT,
+                    max_sessions=settings.SESSION_MAX_ENTRIES,
+                    stripes=settings.SESSION_LOCK_STRIPES,
+                    sweep_interval=settings.SESSION_SWEEP_INTERVAL,
+                    store=get_state_store()
+                )
+                _manager.start()
+    return _manager
@@ -13,6 +13,7 @@ import sys
 import asyncio
 import argparse
 import logging
+import signal
 import threading
 import time
 from typing import Dict, Any
@@ -53,8 +54,22 @@ import dingtalk_stream
 from dingtalk_stream import DingTalkStreamClient, Credential, AckMessage, ChatbotHandler, CallbackHandler
 
 # 导入自定义模块
-from dify.client import DifyClient
+from dify.async_client import AsyncDifyClient
+from dify.answer_cache import get_answer_cache
+from config.settings import settings
 from utils.logger import app_logger
+from utils.task_registry import BackgroundTaskRegistry
+from utils.conversation_scheduler import ConversationScheduler
+from utils.dedup import MessageDeduplicator
+from utils.http_transport import get_transport
+from utils.content_index import get_content_index
+from utils.state_store import get_state_store
+from dingtalk.token_manager import get_token_manager, get_token_stats
+from dingtalk.user_directory import get_user_directory, get_user_directories
+from dingtalk.drive_cache import get_drive_cache
+from handlers.card_stream import CardFlushScheduler, CardStreamWriter, CardUpdatePump
+from handlers.dify_conversation import chat_in_conversation, session_key_of, stream_in_conversation
+from adapter.session import get_session_manager
 
 # 导入处理器模块
 try:
@@ -77,7 +92,7 @@ def define_options():
     # Dify配置
     parser.add_argument('--dify_api_base', help='Dify API基础URL')
     parser.add_argument('--dify_api_key', help='Dify API密钥')
-    parser.add_argument('--dify_app_type', choices=['chat', 'completion'], default='chat', help='Dify应用类型')
+    parser.add_argument('--dify_app_type', choices=['chat', 'completion', 'agent', 'workflow'], default='chat', help='Dify应用类型')
     
     # 服务器配置
     parser.add_argument('--port', type=int, default=9000, help='服务器端口')
@@ -86,6 +101,7 @@ def define_options():
     # 功能开关
     parser.add_argument('--use-modular-handlers', action='store_true', help='使用模块化处理器')
     parser.add_argument('--use-builtin-handlers', action='store_true', help='使用内置处理器')
+    parser.add_argument('--fast-ack', action='store_true', help='解析消息后立即应答，在后台任务中处理')
     
     return parser
 
@@ -101,7 +117,22 @@ def load_config_from_env() -> Dict[str, Any]:
         'dify_app_type': os.getenv('DIFY_APP_TYPE', 'chat'),
         'port': int(os.getenv('SERVER_PORT', '9000')),
         'host': os.getenv('SERVER_HOST', '0.0.0.0'),
-        'use_workflow': os.environ.get('DIFY_USE_WORKFLOW', 'false').lower() == 'true'
+        'use_workflow': os.environ.get('DIFY_USE_WORKFLOW', 'false').lower() == 'true',
+        'dify_pool_size': int(os.getenv('DIFY_POOL_SIZE', '100')),
+        'dify_pool_size_per_host': int(os.getenv('DIFY_POOL_SIZE_PER_HOST', '50')),
+        'dify_request_timeout': float(os.getenv('DIFY_REQUEST_TIMEOUT', '120')),
+        'dify_stream_read_timeout': float(os.getenv('DIFY_STREAM_READ_TIMEOUT', '60')),
+        'fast_ack': os.getenv('FAST_ACK', 'false').lower() == 'true',
+        'background_max_concurrency': int(os.getenv('BACKGROUND_MAX_CONCURRENCY', '100')),
+        'background_task_timeout': float(os.getenv('BACKGROUND_TASK_TIMEOUT', '300')),
+        'conversation_serial': os.getenv('CONVERSATION_SERIAL', 'true').lower() == 'true',
+        'conversation_max_workers': int(os.getenv('CONVERSATION_MAX_WORKERS', '50')),
+        'conversation_max_pending': int(os.getenv('CONVERSATION_MAX_PENDING', '20')),
+        'conversation_stats_shards': int(os.getenv('CONVERSATION_STATS_SHARDS', '16')),
+        'shutdown_drain_timeout': float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30')),
+        'message_dedup': os.getenv('MESSAGE_DEDUP', 'true').lower() == 'true',
+        'dedup_ttl': float(os.getenv('DEDUP_TTL', '600')),
+        'dedup_max_entries': int(os.getenv('DEDUP_MAX_ENTRIES', '100000'))
     }
     
     # 验证必需配置
@@ -117,10 +148,9 @@ def load_config_from_env() -> Dict[str, Any]:
 def test_dify_api_connection(api_base: str) -> bool:
     """测试Dify API连接"""
     try:
-        import requests
         # 使用SSL工具确保SSL配置正确
         SSLUtils.apply_ssl_fixes()
-        response = requests.get(f"{api_base}/health", timeout=10, verify=False)
+        response = get_transport().get(f"{api_base}/health", timeout=10)
         return response.status_code == 200
     except Exception as e:
         app_logger.error(f"Dify API连接测试失败: {str(e)}")
@@ -130,13 +160,23 @@ def test_dify_api_connection(api_base: str) -> bool:
 class UnifiedCardBotHandler(ChatbotHandler):
     """统一的卡片机器人处理器，支持模块化和内置处理器"""
     
-    def __init__(self, dify_client: DifyClient, card_template_id: str, 
-                 use_modular_handlers: bool = False, logger: logging.Logger = app_logger):
+    def __init__(self, dify_client: AsyncDifyClient, card_template_id: str, 
+                 use_modular_handlers: bool = False, logger: logging.Logger = app_logger,
+                 task_registry: BackgroundTaskRegistry = None,
+                 deduplicator: MessageDeduplicator = None,
+                 scheduler: ConversationScheduler = None, fast_ack: bool = False):
         super().__init__()
         self.dify_client = dify_client
         self.card_template_id = card_template_id
         self.use_modular_handlers = use_modular_handlers
         self.logger = logger
+        # 提供任务注册表时启用快速ACK模式
+        self.task_registry = task_registry
+        # 按msgId丢弃钉钉重复投递的回调
+        self.deduplicator = deduplicator
+        # 提供调度器时同一会话的消息按到达顺序逐条处理
+        self.scheduler = scheduler
+        self.fast_ack = fast_ack or task_registry is not None
         
         # 初始化处理器
         if use_modular_handlers and MODULAR_HANDLERS_AVAILABLE:
@@ -161,16 +201,112 @@ class UnifiedCardBotHandler(ChatbotHandler):
             from dingtalk_stream import ChatbotMessage
             incoming_message = ChatbotMessage.from_dict(callback.data)
             self.logger.info(f"成功解析ChatbotMessage：{incoming_message}")
+            
+            error = self._validate_message(incoming_message)
+            if error:
+                self.logger.warning(f"消息校验失败: {error}")
+                return AckMessage.STATUS_BAD_REQUEST, error
+            
+            # 重复投递直接应答成功，避免钉钉继续重试
+            if self.deduplicator and self.deduplicator.is_duplicate(incoming_message.message_id):
+                return AckMessage.STATUS_OK, "duplicate"
 
-            # 使用模块化处理器或内置处理器
-            if self.use_modular_handlers and MODULAR_HANDLERS_AVAILABLE:
-                return await self._process_with_modular_handlers(incoming_message)
-            else:
-                return await self._process_with_builtin_handlers(incoming_message)
+            # 按会话串行处理：同一会话的消息排队，不同会话并行
+            if self.scheduler is not None:
+                future = self.scheduler.submit(
+                    incoming_message.conversation_id,
+                    f"message-{incoming_message.message_id}",
+                    lambda: self._handle_message(incoming_message)
+                )
+                if future is None:
+                    self._forget_message(incoming_message)
+                    return AckMessage.STATUS_SYSTEM_EXCEPTION, "会话消息排队已满或服务正在关闭"
+                # 快速ACK模式：入队后立即应答
+                if self.fast_ack:
+                    return AckMessage.STATUS_OK, "OK"
+                result = await future
+                if result is None:
+                    self._forget_message(incoming_message)
+                    return AckMessage.STATUS_SYSTEM_EXCEPTION, "消息处理失败"
+                return result
+            
+            # 快速ACK模式：立即应答，实际处理交给后台任务
+            if self.task_registry is not None:
+                task = self.task_registry.spawn(
+                    f"message-{incoming_message.message_id}",
+                    lambda: self._handle_message(incoming_message)
+                )
+                if task is None:
+                    self._forget_message(incoming_message)
+                    return AckMessage.STATUS_SYSTEM_EXCEPTION, "服务正在关闭"
+                return AckMessage.STATUS_OK, "OK"
+
+            return await self._handle_message(incoming_message)
         except Exception as e:
             self.logger.error(f"消息处理异常: {str(e)}")
             return AckMessage.STATUS_SYSTEM_EXCEPTION, str(e)
     
+    def _forget_message(self, incoming_message):
+        """从去重索引中移除消息"""
+        if self.deduplicator:
+            self.deduplicator.forget(incoming_message.message_id)
+    
+    def _validate_message(self, incoming_message) -> str:
+        """校验消息是否可处理，返回错误描述，校验通过时返回空字符串"""
+        if not incoming_message.message_id:
+            return "消息缺少msgId"
+        if not incoming_message.conversation_id:
+            return "消息缺少conversationId"
+        if not incoming_message.message_type:
+            return "消息缺少msgtype"
+        return ""
+    
+    async def _handle_message(self, incoming_message):
+        """处理消息，失败时允许钉钉重投的消息再次处理"""
+        status, message = await self._dispatch(incoming_message)
+        if status != AckMessage.STATUS_OK:
+            self._forget_message(incoming_message)
+        return status, message
+    
+    async def _dispatch(self, incoming_message):
+        """使用模块化处理器或内置处理器处理消息"""
+        if self.use_modular_handlers and MODULAR_HANDLERS_AVAILABLE:
+            return await self._process_with_modular_handlers(incoming_message)
+        else:
+            return await self._process_with_builtin_handlers(incoming_message)
+    
+    async def shutdown(self, drain_timeout: float = 30):
+        """关闭处理器：等待后台任务完成并释放连接池"""
+        if self.scheduler is not None:
+            await self.scheduler.drain(drain_timeout)
+            self.logger.info(f"会话调度统计: {self.scheduler.get_stats()}")
+        if self.task_registry is not None:
+            await self.task_registry.drain(drain_timeout)
+            self.logger.info(f"后台任务统计: {self.task_registry.get_stats()}")
+        if self.deduplicator is not None:
+            self.logger.info(f"消息去重统计: {self.deduplicator.get_stats()}")
+        sessions = get_session_manager()
+        sessions.stop()
+        self.logger.info(f"会话统计: {sessions.get_stats()}")
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            self.logger.info(f"回复缓存统计: {answer_cache.get_stats()}")
+        store = get_state_store()
+        store.close()
+        self.logger.info(f"状态存储统计: {store.get_stats()}")
+        await self.dify_client.close()
+        self.logger.info(f"访问令牌统计: {get_token_stats()}")
+        for directory in get_user_directories():
+            directory.stop()
+            self.logger.info(f"用户目录统计: {directory.get_stats()}")
+            directory.save_snapshot()
+        self.logger.info(f"云盘元数据缓存统计: {get_drive_cache().get_stats()}")
+        self.logger.info(f"内容索引统计: {get_content_index().get_stats()}")
+        transport = get_transport()
+        self.logger.info(f"HTTP连接池统计: {transport.get_stats()}")
+        await transport.close_async()
+        transport.close()
+    
     async def _process_with_modular_handlers(self, incoming_message):
         """使用模块化处理器处理消息"""
         try:
@@ -243,8 +379,26 @@ class UnifiedCardBotHandler(ChatbotHandler):
             card_instance = AICardReplier(self.dingtalk_client, incoming_message)
             card_instance_id = None
             
+            # 卡片写入器：追加模式下只发送新增文本，结束或更新失败后全量同步
+            # 卡片实例ID在卡片投放完成后才会设置，此前的增量先缓存在写入器中
+            writer = CardStreamWriter(
+                card_instance,
+                None,
+                content_key=content_key,
+                append_mode=settings.CARD_APPEND_MODE,
+                logger=self.logger
+            )
+            # 按时间和字节数合并增量，并根据卡片接口延迟自适应调整更新节奏
+            pump = CardUpdatePump(writer, CardFlushScheduler.from_settings(self.logger), self.logger)
+            
+            # 投放卡片与调用Dify并发进行，卡片创建耗时不再计入首字延迟
+            dify_task = asyncio.get_running_loop().create_task(
+                self._call_dify_with_stream(incoming_message.text.content, pump, user_id,
+                                            session_key_of(incoming_message))
+            )
+            
             try:
-                # 1. 先投放卡片 - 使用官方推荐的方式
+                # 1. 投放卡片 - 使用官方推荐的方式
                 self.logger.info(f"开始创建AI卡片，模板ID: {self.card_template_id}")
                 
                 # 根据官方文档，使用async_create_and_deliver_card方法
@@ -259,60 +413,31 @@ class UnifiedCardBotHandler(ChatbotHandler):
                 
                 if not card_instance_id:
                     self.logger.error("创建AI卡片失败")
-                    # 如果卡片创建失败，回退到普通文本消息
+                    # 如果卡片创建失败，取消进行中的Dify请求，回退到普通文本消息
+                    await self._cancel_task(dify_task)
                     self.reply_text("思考中...", incoming_message)
                     return False
                 
                 self.logger.info(f"成功创建AI卡片，实例ID: {card_instance_id}")
                 
-                # 2. 定义回调函数，用于流式更新卡片
-                async def update_card_callback(content_value: str):
-                    """更新卡片的回调函数，基于官方文档"""
-                    if card_instance_id:
-                        try:
-                            # 使用官方推荐的async_streaming方法
-                            return await card_instance.async_streaming(
-                                card_instance_id,
-                                content_key=content_key,
-                                content_value=content_value,
-                                append=False,  # 不追加，替换内容
-                                finished=False,  # 未完成
-                                failed=False,    # 未失败
-                            )
-                        except Exception as e:
-                            self.logger.error(f"更新卡片失败: {str(e)}")
-                            # 如果卡片更新失败，回退到普通文本消息
-                            self.reply_text(content_value, incoming_message)
-                    else:
-                        # 如果没有卡片ID，直接发送文本消息
-                        self.reply_text(content_value, incoming_message)
+                # 2. 卡片就绪后启动卡片更新任务，先推送已缓存的内容
+                writer.card_instance_id = card_instance_id
+                pump.start()
                 
-                # 3. 调用Dify API并处理流式响应
-                full_content = await self._call_dify_with_stream(
-                    incoming_message.text.content, 
-                    update_card_callback,
-                    user_id  # 传递用户ID
-                )
+                # 3. 等待Dify流式响应结束
+                try:
+                    full_content = await dify_task
+                finally:
+                    # 生产者结束后停止卡片更新任务，剩余内容由 writer.finish 全量同步
+                    await pump.close()
+                self.logger.info(f"卡片更新统计: {pump.get_stats()}")
                 
-                # 4. 最终更新，标记完成 - 使用官方推荐的方式
-                if card_instance_id:
-                    try:
-                        # 最终更新，标记为完成状态
-                        await card_instance.async_streaming(
-                            card_instance_id,
-                            content_key=content_key,
-                            content_value=full_content,
-                            append=False,  # 不追加，替换内容
-                            finished=True,  # 已完成
-                            failed=False,   # 未失败
-                        )
-                        self.logger.info(f"完成流式响应，总长度: {len(full_content)}")
-                    except Exception as e:
-                        self.logger.error(f"最终更新卡片失败: {str(e)}")
-                        # 回退到普通文本消息
-                        self.reply_text(full_content, incoming_message)
+                # 4. 最终更新，全量同步内容并标记完成
+                if await writer.finish():
+                    self.logger.info(f"完成流式响应，总长度: {len(full_content)}, 写入统计: {writer.get_stats()}")
                 else:
-                    # 如果没有卡片ID，发送最终文本消息
+                    self.logger.error("最终更新卡片失败")
+                    # 回退到普通文本消息
                     self.reply_text(full_content, incoming_message)
                 
                 return True
@@ -321,103 +446,84 @@ class UnifiedCardBotHandler(ChatbotHandler):
                 self.logger.exception(f"处理消息异常: {str(e)}")
                 
                 # 如果出现异常，尝试更新卡片为错误状态
+                error_content = f"处理消息时发生错误: {str(e)}"
                 if card_instance_id:
-                    try:
-                        # 使用官方推荐的方式标记失败状态
-                        await card_instance.async_streaming(
-                            card_instance_id,
-                            content_key=content_key,
-                            content_value=f"处理消息时发生错误: {str(e)}",
-                            append=False,  # 不追加，替换内容
-                            finished=False,  # 未完成
-                            failed=True,     # 标记为失败
-                        )
-                    except Exception as update_error:
-                        self.logger.error(f"更新错误状态失败: {str(update_error)}")
+                    writer.card_instance_id = card_instance_id
+                    if not await writer.fail(error_content):
                         # 回退到普通文本消息
-                        self.reply_text(f"处理消息时发生错误: {str(e)}", incoming_message)
+                        self.reply_text(error_content, incoming_message)
                 else:
                     # 如果没有卡片ID，发送错误文本消息
-                    self.reply_text(f"处理消息时发生错误: {str(e)}", incoming_message)
+                    self.reply_text(error_content, incoming_message)
                 
                 return False
+            
+            finally:
+                # 处理被取消或异常退出时，不遗留Dify请求
+                await self._cancel_task(dify_task)
                 
         except Exception as e:
             self.logger.error(f"AI卡片处理异常: {str(e)}")
             # 回退到普通文本消息
             await self._fallback_to_text(incoming_message)
     
-    async def _call_dify_with_stream(self, request_content: str, callback, user_id: str):
-        """调用Dify API并处理流式响应，基于钉钉官方文档"""
+    @staticmethod
+    async def _cancel_task(task: asyncio.Task):
+        """取消任务并等待其结束，关闭底层的Dify连接"""
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    
+    async def _call_dify_with_stream(self, request_content: str, pump: CardUpdatePump, user_id: str,
+                                     session_key: str):
+        """调用Dify API并处理流式响应，增量交给卡片更新任务，基于钉钉官方文档"""
+        writer = pump.writer
+        chunk_count = 0
+        
         try:
-            # 调用Dify API，确保传递user参数
-            response = self.dify_client.chat_completion(
-                query=request_content,
-                user=user_id,  # 确保传递用户ID
-                stream=True
+            # 各应用类型的流式事件归一化为同一组事件：文本增量直接追加，工具和节点进度整体渲染
+            # 数据块到达即处理，只写入缓冲区并唤醒卡片更新任务，不等待卡片接口
+            # 聊天类应用延续会话对应的Dify对话
+            progress = await stream_in_conversation(
+                self.dify_client,
+                session_key,
+                request_content,
+                user_id,
+                pump,
+                app_type="workflow" if settings.DIFY_USE_WORKFLOW else None,
+                logger=self.logger
             )
+            chunk_count = progress.event_count
+            if progress.status == 'failed':
+                raise Exception(progress.error or "Dify流式响应返回错误")
             
-            self.logger.info(f"Dify API响应格式: {type(response)}")
-            self.logger.info(f"Dify API响应键: {list(response.keys()) if isinstance(response, dict) else 'Not a dict'}")
-            
-            full_content = ""
-            length = 0
-            update_threshold = 20  # 每20个字符更新一次，符合官方文档建议
-            
-            # 处理流式响应 - 使用正确的Dify API响应格式
-            event_stream = response.get("event_stream", [])
-            self.logger.info(f"事件流长度: {len(event_stream)}")
-            
-            for i, chunk in enumerate(event_stream):
-                self.logger.debug(f"处理第 {i+1} 个数据块: {chunk}")
-                
-                # 检查是否有answer字段
-                if "answer" in chunk:
-                    answer_chunk = chunk.get("answer", "")
-                    full_content += answer_chunk
-                    self.logger.debug(f"累积内容: {full_content}")
-                    
-                    # 当累积内容长度超过阈值时更新卡片
-                    # 这实现了官方文档中提到的"打字机效果"
-                    full_content_length = len(full_content)
-                    if full_content_length - length > update_threshold:
-                        await callback(full_content)
-                        self.logger.info(
-                            f"调用流式更新接口更新内容：current_length: {length}, next_length: {full_content_length}"
-                        )
-                        length = full_content_length
-                else:
-                    self.logger.debug(f"数据块中没有answer字段: {chunk}")
+            self.logger.info(f"事件流长度: {chunk_count}")
             
-            # 最终回调 - 确保完整内容被发送
+            full_content = writer.text
             if full_content:
-                await callback(full_content)
                 self.logger.info(
                     f"Request Content: {request_content}\nFull response: {full_content}\nFull response length: {len(full_content)}"
                 )
             else:
                 self.logger.warning("未获取到有效内容")
-                await callback("抱歉，暂时无法生成回复，请稍后再试。")
+                full_content = "抱歉，暂时无法生成回复，请稍后再试。"
+                writer.reset(full_content)
             
             return full_content
             
         except Exception as e:
             self.logger.error(f"调用Dify API异常: {str(e)}")
-            # 发生异常时，尝试发送错误信息
-            try:
-                await callback("抱歉，处理您的请求时出现了错误，请稍后再试。")
-            except Exception as callback_error:
-                self.logger.error(f"发送错误信息失败: {str(callback_error)}")
             raise
     
     async def _fallback_to_text(self, incoming_message):
         """回退到普通文本消息"""
         try:
             # 调用Dify API（非流式）
-            response = self.dify_client.chat_completion(
-                query=incoming_message.text.content,
-                user="user",
-                stream=False
+            response = await chat_in_conversation(
+                self.dify_client,
+                session_key_of(incoming_message),
+                incoming_message.text.content,
+                incoming_message.sender_staff_id
             )
             
             # 获取回复内容
@@ -462,6 +568,33 @@ class UnifiedCardBotHandler(ChatbotHandler):
             self.reply_text("文件处理时发生错误，请重试", incoming_message)
 
 
+async def run_stream_client(client: DingTalkStreamClient, handler: UnifiedCardBotHandler,
+                            drain_timeout: float = 30):
+    """运行钉钉流式客户端，收到退出信号后停止接收消息并等待处理中的消息完成"""
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows不支持add_signal_handler，仍由KeyboardInterrupt退出
+            pass
+    
+    client_task = asyncio.create_task(client.start())
+    stop_task = asyncio.create_task(stop_event.wait())
+    await asyncio.wait({client_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+    app_logger.info("收到退出信号，停止接收新消息...")
+    
+    # SDK在连接循环中会吞掉一次CancelledError并进入重连等待，需要重复取消直至退出
+    while not client_task.done():
+        client_task.cancel()
+        await asyncio.wait({client_task}, timeout=0.1)
+    stop_task.cancel()
+    
+    await handler.shutdown(drain_timeout)
+    app_logger.info("适配器已关闭")
+
+
 def main():
     """主函数"""
     global start_time
@@ -497,6 +630,8 @@ def main():
             config['port'] = args.port
         if args.host:
             config['host'] = args.host
+        if args.fast_ack:
+            config['fast_ack'] = True
         
         # 确定处理器类型
         use_modular_handlers = args.use_modular_handlers or (not args.use_builtin_handlers and MODULAR_HANDLERS_AVAILABLE)
@@ -505,11 +640,15 @@ def main():
         if not test_dify_api_connection(config['dify_api_base']):
             app_logger.warning("Dify API连接测试失败，但继续启动...")
         
-        # 创建Dify客户端
-        dify_client = DifyClient(
+        # 创建异步Dify客户端，所有会话共享同一个长连接池
+        dify_client = AsyncDifyClient(
             api_base=config['dify_api_base'],
             api_key=config['dify_api_key'],
-            app_type=config['dify_app_type']
+            app_type=config['dify_app_type'],
+            pool_size=config['dify_pool_size'],
+            pool_size_per_host=config['dify_pool_size_per_host'],
+            request_timeout=config['dify_request_timeout'],
+            stream_read_timeout=config['dify_stream_read_timeout']
         )
         
         # 创建钉钉客户端凭证
@@ -521,12 +660,55 @@ def main():
         # 创建钉钉流式客户端
         client = DingTalkStreamClient(credential)
         
+        # 启动访问令牌定时刷新，处理消息时无需等待获取令牌
+        get_token_manager(config['client_id'], config['client_secret']).start()
+        
+        # 预加载部门用户，文件消息的身份查询直接命中内存
+        if settings.USER_DIRECTORY_PRELOAD_DEPTS:
+            get_user_directory(config['client_id'], config['client_secret']).start_preload(
+                settings.USER_DIRECTORY_PRELOAD_DEPTS,
+                interval=settings.USER_DIRECTORY_PRELOAD_INTERVAL
+            )
+        
+        # 按会话分片调度：会话内严格FIFO，会话间由有界工作协程池并行处理
+        scheduler = None
+        if config['conversation_serial']:
+            scheduler = ConversationScheduler(
+                max_workers=config['conversation_max_workers'],
+                max_pending_per_conversation=config['conversation_max_pending'],
+                task_timeout=config['background_task_timeout'],
+                shard_count=config['conversation_stats_shards'],
+                logger=app_logger
+            )
+        
+        # 快速ACK模式下由后台任务注册表执行实际处理；启用会话调度时由调度器执行
+        task_registry = None
+        if config['fast_ack'] and scheduler is None:
+            task_registry = BackgroundTaskRegistry(
+                max_concurrency=config['background_max_concurrency'],
+                task_timeout=config['background_task_timeout'],
+                logger=app_logger
+            )
+        
+        # 按msgId去重，丢弃重复投递的回调
+        deduplicator = None
+        if config['message_dedup']:
+            deduplicator = MessageDeduplicator(
+                ttl=config['dedup_ttl'],
+                max_entries=config['dedup_max_entries'],
+                logger=app_logger
+            )
+        
         # 创建统一的机器人处理器
         handler = UnifiedCardBotHandler(
             dify_client=dify_client,
             card_template_id=config['card_template_id'],
             use_modular_handlers=use_modular_handlers,
-            logger=app_logger
+            logger=app_logger,
+            task_registry=task_registry,
+            deduplicator=deduplicator,
+            scheduler=scheduler,
+            fast_ack=config['fast_ack']
         )
         
         # 设置handler的dingtalk_client
@@ -547,8 +729,10 @@ def main():
         app_logger.info(f"Dify API: {config['dify_api_base']}")
         app_logger.info(f"处理器类型: {'模块化' if use_modular_handlers else '内置'}")
         app_logger.info(f"支持的消息类型: 文本、图片、语音、文件")
+        app_logger.info(f"快速ACK模式: {'开启' if config['fast_ack'] else '关闭'}")
+        app_logger.info(f"会话串行调度: {'开启' if config['conversation_serial'] else '关闭'}")
         
-        client.start_forever()
+        asyncio.run(run_stream_client(client, handler, config['shutdown_drain_timeout']))
         
     except KeyboardInterrupt:
         app_logger.info("收到中断信号，正在关闭...")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+相似问题索引基准
+
+在问题语料上评估 dify.query_similarity.SimilarityIndex：
+1. 每组的第一个问题作为已缓存的问题加入索引，每隔若干组留出一组作为未缓存的问题
+2. 其余问题逐个查询：命中同组为正确命中，命中其他组为误命中
+   近似干扰问题（分组以 ! 开头，与某个已缓存问题只差一个关键词）命中任何问题都是误命中，单独统计
+3. 另加入随机生成的问题填充索引，测量不同索引规模下的查询耗时，并与逐条比较的线性扫描对比
+
+用法:
+    python benchmarks/similarity_cache_bench.py                          # 使用内置语料 benchmarks/data/faq_queries.tsv
+    python benchmarks/similarity_cache_bench.py --file queries.tsv       # 使用录制的问题语料
+    python benchmarks/similarity_cache_bench.py --threshold 0.5 --threshold 0.7 --index-size 100000
+
+语料格式: 每行 "问题分组<TAB>问题"，# 开头的行为注释；"!分组<TAB>问题" 为该分组的近似干扰问题
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dify.query_similarity import SimilarityIndex, jaccard, shingles, similarity_text  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'faq_queries.tsv')
+SCOPE = "bench"
+# 近似干扰问题的分组前缀
+NEAR_MISS = "!"
+
+
+def load_corpus(path: str) -> Dict[str, List[str]]:
+    """读取语料，返回 分组 -> 问题列表"""
+    groups: Dict[str, List[str]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            label, query = line.split('\t', 1)
+            groups.setdefault(label, []).append(query)
+    return groups
+
+
+def filler_queries(groups: Dict[str, List[str]], count: int, seed: int = 7) -> List[str]:
+    """用语料中的字符随机组成填充问题，长度分布与语料相近"""
+    rng = random.Random(seed)
+    queries = [q for qs in groups.values() for q in qs]
+    chars = sorted({c for q in queries for c in similarity_text(q)})
+    lengths = [len(q) for q in queries]
+    return [''.join(rng.choice(chars) for _ in range(rng.choice(lengths))) for _ in range(count)]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def evaluate(groups: Dict[str, List[str]], threshold: float, num_perm: int, bands: int, fillers: List[str],
+             holdout_every: int, repeat: int, content_guard: bool = True) -> Dict[str, float]:
+    """建立索引并逐个查询，返回召回率、误命中率和查询耗时"""
+    index = SimilarityIndex(threshold=threshold, num_perm=num_perm, bands=bands,
+                            max_entries=len(fillers) + len(groups) + 1, content_guard=content_guard)
+    for i, query in enumerate(fillers):
+        index.add(f"filler-{i}", SCOPE, query)
+
+    labels = sorted(label for label in groups if not label.startswith(NEAR_MISS))
+    near_misses = [q for label, qs in groups.items() if label.startswith(NEAR_MISS) for q in qs]
+    # 近似干扰问题对应的分组总是加入索引，否则无从误命中
+    targets = {label[len(NEAR_MISS):] for label in groups if label.startswith(NEAR_MISS)}
+    cached = {label for i, label in enumerate(labels)
+              if holdout_every <= 0 or i % holdout_every != holdout_every - 1 or label in targets}
+    owner: Dict[str, str] = {}
+    for label in cached:
+        key = f"{label}-0"
+        owner[key] = label
+        index.add(key, SCOPE, groups[label][0])
+
+    probes: List[Tuple[str, str]] = []
+    for label in labels:
+        queries = groups[label][1:] if label in cached else groups[label]
+        probes.extend((label, q) for q in queries)
+
+    latencies = []
+
+    def lookup(query: str):
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = index.query(SCOPE, query)
+            latencies.append(time.perf_counter() - start)
+        return result
+
+    correct = wrong = expected = 0
+    for label, query in probes:
+        expected += label in cached
+        result = lookup(query)
+        if result is None:
+            continue
+        if owner.get(result[0]) == label:
+            correct += 1
+        else:
+            wrong += 1
+    near_wrong = sum(lookup(query) is not None for query in near_misses)
+
+    return {
+        'recall': correct / expected if expected else 0.0,
+        'false_positive': wrong / len(probes) if probes else 0.0,
+        'near_miss_positive': near_wrong / len(near_misses) if near_misses else 0.0,
+        'p50_us': percentile(latencies, 0.5) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'candidates': index.get_stats()['candidates'] / max(1, index.get_stats()['lookups']),
+        'probes': len(probes),
+        'indexed': len(index),
+        'near_misses': len(near_misses)
+    }
+
+
+def linear_scan_us(groups: Dict[str, List[str]], fillers: List[str], samples: int = 20) -> float:
+    """逐条计算Jaccard相似度的平均查询耗时(微秒)"""
+    entries = [shingles(similarity_text(q)) for q in fillers] + \
+              [shingles(similarity_text(qs[0])) for label, qs in groups.items() if not label.startswith(NEAR_MISS)]
+    probes = [q for qs in groups.values() for q in qs[1:]][:samples]
+    start = time.perf_counter()
+    for query in probes:
+        items = shingles(similarity_text(query))
+        max(jaccard(items, entry) for entry in entries)
+    return (time.perf_counter() - start) / len(probes) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="相似问题索引基准")
+    parser.add_argument('--file', default=DEFAULT_CORPUS, help='问题语料，每行 "分组<TAB>问题"')
+    parser.add_argument('--threshold', type=float, action='append', help='相似度阈值，可指定多次')
+    parser.add_argument('--num-perm', type=int, default=48, help='MinHash签名长度')
+    parser.add_argument('--bands', type=int, default=16, help='签名分段数，须整除签名长度')
+    parser.add_argument('--index-size', type=int, action='append', help='填充问题数量，可指定多次')
+    parser.add_argument('--holdout-every', type=int, default=4, help='每隔多少组留出一组不加入索引，0表示不留出')
+    parser.add_argument('--repeat', type=int, default=3, help='每个问题的查询次数')
+    parser.add_argument('--no-guard', action='store_true', help='不检查实义字是否一致，用于对比误命中率')
+    args = parser.parse_args()
+
+    groups = load_corpus(args.file)
+    thresholds = args.threshold or [0.3, 0.4, 0.5, 0.6]
+    sizes = args.index_size or [0, 10000]
+    near = sum(len(q) for label, q in groups.items() if label.startswith(NEAR_MISS))
+    regular = sum(not label.startswith(NEAR_MISS) for label in groups)
+    print(f"语料: {os.path.basename(args.file)}，{regular} 组，{sum(len(q) for q in groups.values()) - near} 个问题，"
+          f"近似干扰问题 {near} 个{'，不检查实义字' if args.no_guard else ''}")
+    print(f"{'threshold':>10}{'index':>8}{'probes':>8}{'recall':>9}{'false+':>9}{'near+':>9}{'cand':>7}"
+          f"{'p50(us)':>10}{'p99(us)':>10}{'scan(us)':>10}")
+    for size in sizes:
+        fillers = filler_queries(groups, size)
+        scan = linear_scan_us(groups, fillers)
+        for threshold in thresholds:
+            result = evaluate(groups, threshold, args.num_perm, args.bands, fillers, args.holdout_every, args.repeat,
+                              content_guard=not args.no_guard)
+            print(f"{threshold:>10.2f}{result['indexed']:>8}{result['probes']:>8}{result['recall']:>9.1%}"
+                  f"{result['false_positive']:>9.1%}{result['near_miss_positive']:>9.1%}"
+                  f"{result['candidates']:>7.1f}{result['p50_us']:>10.1f}"
+                  f"{result['p99_us']:>10.1f}{scan:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SSE解析微基准
+
+比较 Dify 流式响应的两种处理方式：
+1. 原实现：sseclient.SSEClient 逐行拼接 + json.loads + 合并全部字段并保留事件列表
+2. 新实现：dify.sse 增量解析器 + StreamAccumulator
+
+用法:
+    python benchmarks/sse_parser_bench.py                      # 使用内置的Dify格式样例流
+    python benchmarks/sse_parser_bench.py --file chat.sse ...  # 使用录制的原始响应体
+    python benchmarks/sse_parser_bench.py --chunk-size 128     # 模拟 requests 默认的128字节读取
+
+原实现需要安装 sseclient-py（pip install sseclient-py）
+
+录制方式: curl -N -X POST .../chat-messages -d '{..., "response_mode": "streaming"}' > chat.sse
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dify.sse import JSON_BACKEND, SSEParser, StreamAccumulator, iter_sse_events  # noqa: E402
+
+
+def _sse(payload: dict) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def sample_chat_stream(tokens: int = 2000, ping_every: int = 50) -> bytes:
+    """chat应用的流式响应：逐字 message 事件、周期性 ping、message_end"""
+    base = {
+        "event": "message",
+        "task_id": "5ad4cb98-f0c7-4085-b384-88c403be6290",
+        "message_id": "5ad4cb98-f0c7-4085-b384-88c403be6290",
+        "conversation_id": "45701982-8118-4bc5-8e9b-64562b4555f2",
+        "created_at": 1705395332
+    }
+    parts = []
+    for i in range(tokens):
+        if i % ping_every == 0:
+            parts.append(b"event: ping\n\n")
+        parts.append(_sse(dict(base, id=base["message_id"], answer="钉钉机器人的流式回复" [i % 10])))
+    parts.append(_sse(dict(base, event="message_end", metadata={"usage": {
+        "prompt_tokens": 1033, "completion_tokens": tokens, "total_tokens": 1033 + tokens,
+        "latency": 12.5, "currency": "USD"
+    }})))
+    return b"".join(parts)
+
+
+def sample_workflow_stream(nodes: int = 20, chunks_per_node: int = 100) -> bytes:
+    """workflow应用的流式响应：节点事件、text_chunk 和较大的 outputs"""
+    run = {"task_id": "b5e6d7a0", "workflow_run_id": "2d8f8a6c-07f8-4c0b-9e35-3a1d4c9e1f11"}
+    parts = [_sse(dict(run, event="workflow_started", data={"id": run["workflow_run_id"], "created_at": 1705395332}))]
+    for n in range(nodes):
+        node = {"id": f"exec-{n}", "node_id": f"node-{n}", "node_type": "llm", "title": f"节点{n}", "index": n}
+        parts.append(_sse(dict(run, event="node_started", data=dict(node, inputs={"query": "分析文件" * 20}))))
+        for i in range(chunks_per_node):
+            parts.append(_sse(dict(run, event="text_chunk", data={"text": "分析结果片段",
+                                                                    "from_variable_selector": [f"node-{n}", "text"]})))
+        parts.append(b"event: ping\n\n")
+        parts.append(_sse(dict(run, event="node_finished", data=dict(
+            node, status="succeeded", elapsed_time=1.25, outputs={"text": "分析结果片段" * chunks_per_node}
+        ))))
+    parts.append(_sse(dict(run, event="workflow_finished", data={
+        "id": run["workflow_run_id"], "status": "succeeded", "elapsed_time": 25.0,
+        "total_tokens": 8000, "outputs": {"text": "分析结果片段" * chunks_per_node * nodes}
+    })))
+    return b"".join(parts)
+
+
+def split_chunks(body: bytes, size: int) -> List[bytes]:
+    """按网络读取的块大小切分响应体"""
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def legacy_path(chunks: List[bytes]) -> Tuple[int, int]:
+    """原实现：sseclient + json.loads + 保留事件列表并逐字段合并"""
+    import sseclient
+
+    accumulated_data = {"answer": ""}
+    event_stream = []
+    for event in sseclient.SSEClient(iter(chunks)).events():
+        if not event.data.strip():
+            continue
+        try:
+            chunk = json.loads(event.data)
+        except json.JSONDecodeError:
+            continue
+        event_stream.append(chunk)
+        for key, value in chunk.items():
+            if key not in accumulated_data:
+                accumulated_data[key] = value
+            elif key == "answer":
+                accumulated_data[key] += value
+    return len(event_stream), len(accumulated_data["answer"])
+
+
+def parser_path(chunks: List[bytes]) -> Tuple[int, int]:
+    """新实现：增量解析器 + StreamAccumulator"""
+    accumulator = StreamAccumulator()
+    for chunk in iter_sse_events(chunks, SSEParser()):
+        accumulator.add(chunk)
+    result = accumulator.result()
+    return result["chunk_count"], len(result["accumulated_data"]["answer"])
+
+
+def bench(func: Callable[[List[bytes]], Tuple[int, int]], chunks: List[bytes], repeat: int) -> Tuple[float, Tuple[int, int]]:
+    """返回最短耗时(秒)和处理结果"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dify SSE解析微基准")
+    parser.add_argument('--file', action='append', help='录制的原始SSE响应体，可指定多次')
+    parser.add_argument('--chunk-size', type=int, action='append', help='网络读取块大小(字节)，可指定多次')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数，取最短耗时')
+    args = parser.parse_args()
+
+    if args.file:
+        streams: Dict[str, bytes] = {}
+        for path in args.file:
+            with open(path, 'rb') as f:
+                streams[os.path.basename(path)] = f.read()
+    else:
+        streams = {'chat': sample_chat_stream(), 'workflow': sample_workflow_stream()}
+    chunk_sizes = args.chunk_size or [128, 4096]
+
+    print(f"JSON解码器: {JSON_BACKEND}")
+    print(f"{'stream':<12}{'size':>10}{'chunk':>8}{'events':>8}{'sseclient(ms)':>15}{'parser(ms)':>12}{'speedup':>9}")
+    for name, body in streams.items():
+        for size in chunk_sizes:
+            chunks = split_chunks(body, size)
+            legacy_time, legacy_result = bench(legacy_path, chunks, args.repeat)
+            parser_time, parser_result = bench(parser_path, chunks, args.repeat)
+            if legacy_result != parser_result:
+                print(f"结果不一致: {name} 原实现={legacy_result} 新实现={parser_result}")
+            print(f"{name:<12}{len(body):>10}{size:>8}{parser_result[0]:>8}"
+                  f"{legacy_time * 1000:>15.2f}{parser_time * 1000:>12.2f}{legacy_time / parser_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,21 @@ class Settings:
         self.DINGTALK_CLIENT_ID = os.getenv('DINGTALK_CLIENT_ID')
         self.DINGTALK_CLIENT_SECRET = os.getenv('DINGTALK_CLIENT_SECRET')
         self.DINGTALK_AI_CARD_TEMPLATE_ID = os.getenv('DINGTALK_AI_CARD_TEMPLATE_ID')
+        self.DINGTALK_TOKEN_REFRESH_AHEAD = float(os.getenv('DINGTALK_TOKEN_REFRESH_AHEAD', '300'))
+        
+        # 用户目录缓存配置
+        self.USER_DIRECTORY_TTL = float(os.getenv('USER_DIRECTORY_TTL', '86400'))
+        self.USER_DIRECTORY_MAX_ENTRIES = int(os.getenv('USER_DIRECTORY_MAX_ENTRIES', '10000'))
+        self.USER_DIRECTORY_SNAPSHOT = os.getenv('USER_DIRECTORY_SNAPSHOT', '')
+        self.USER_DIRECTORY_PRELOAD_DEPTS = [
+            int(dept_id) for dept_id in os.getenv('USER_DIRECTORY_PRELOAD_DEPTS', '').split(',') if dept_id.strip()
+        ]
+        self.USER_DIRECTORY_PRELOAD_INTERVAL = float(os.getenv('USER_DIRECTORY_PRELOAD_INTERVAL', '0'))
+        
+        # 云盘元数据缓存配置
+        self.DRIVE_SPACE_CACHE_TTL = float(os.getenv('DRIVE_SPACE_CACHE_TTL', '86400'))
+        self.DRIVE_INDEX_CACHE_TTL = float(os.getenv('DRIVE_INDEX_CACHE_TTL', '600'))
+        self.DRIVE_URL_CACHE_TTL = float(os.getenv('DRIVE_URL_CACHE_TTL', '900'))
         
         # Dify配置
         self.DIFY_API_BASE = os.getenv('DIFY_API_BASE', 'https://api.dify.ai/v1')
@@ -35,12 +50,62 @@ class Settings:
         self.DIFY_USE_WORKFLOW = os.getenv('DIFY_USE_WORKFLOW', 'false').lower() == 'true'
         self.DIFY_WORKFLOW_ID = os.getenv('DIFY_WORKFLOW_ID', '')
         
+        # Dify连接池配置
+        self.DIFY_POOL_SIZE = int(os.getenv('DIFY_POOL_SIZE', '100'))
+        self.DIFY_POOL_SIZE_PER_HOST = int(os.getenv('DIFY_POOL_SIZE_PER_HOST', '50'))
+        self.DIFY_REQUEST_TIMEOUT = float(os.getenv('DIFY_REQUEST_TIMEOUT', '120'))
+        self.DIFY_STREAM_READ_TIMEOUT = float(os.getenv('DIFY_STREAM_READ_TIMEOUT', '60'))
+        
         # 服务器配置
         self.SERVER_PORT = int(os.getenv('SERVER_PORT', '9000'))
         self.SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
         self.SESSION_TIMEOUT = int(os.getenv('SESSION_TIMEOUT', '1800'))
+        self.SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+        self.SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '60'))
+        self.SESSION_LOCK_STRIPES = int(os.getenv('SESSION_LOCK_STRIPES', '16'))
+        
+        # 状态持久化配置
+        self.STATE_STORE_PATH = os.getenv('STATE_STORE_PATH', '')
+        self.STATE_STORE_FLUSH_INTERVAL = float(os.getenv('STATE_STORE_FLUSH_INTERVAL', '1'))
+        self.STATE_STORE_BATCH_SIZE = int(os.getenv('STATE_STORE_BATCH_SIZE', '500'))
+        self.STATE_STORE_COMPACT_INTERVAL = float(os.getenv('STATE_STORE_COMPACT_INTERVAL', '3600'))
+        
+        # 回复缓存配置
+        self.ANSWER_CACHE = os.getenv('ANSWER_CACHE', 'false').lower() == 'true'
+        self.ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+        self.ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+        self.ANSWER_CACHE_MAX_QUERY_LENGTH = int(os.getenv('ANSWER_CACHE_MAX_QUERY_LENGTH', '200'))
+        self.ANSWER_CACHE_REPLAY_INTERVAL = float(os.getenv('ANSWER_CACHE_REPLAY_INTERVAL', '0.03'))
+        # 相似问题匹配的Jaccard相似度阈值，0表示只做精确匹配
+        self.ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', '0'))
         self.STREAM_MODE = os.getenv('STREAM_MODE', 'ai_card')
         
+        # AI卡片流式更新节奏配置
+        self.CARD_UPDATE_MAX_QPS = float(os.getenv('CARD_UPDATE_MAX_QPS', '5'))
+        self.CARD_UPDATE_INTERVAL = float(os.getenv('CARD_UPDATE_INTERVAL', '0.5'))
+        self.CARD_UPDATE_MIN_INTERVAL = float(os.getenv('CARD_UPDATE_MIN_INTERVAL', '0.2'))
+        self.CARD_UPDATE_MAX_INTERVAL = float(os.getenv('CARD_UPDATE_MAX_INTERVAL', '3'))
+        self.CARD_UPDATE_MAX_BYTES = int(os.getenv('CARD_UPDATE_MAX_BYTES', '512'))
+        self.CARD_UPDATE_TARGET_LATENCY = float(os.getenv('CARD_UPDATE_TARGET_LATENCY', '0.5'))
+        self.CARD_APPEND_MODE = os.getenv('CARD_APPEND_MODE', 'true').lower() == 'true'
+        
+        # 快速ACK与后台任务配置
+        self.FAST_ACK = os.getenv('FAST_ACK', 'false').lower() == 'true'
+        self.BACKGROUND_MAX_CONCURRENCY = int(os.getenv('BACKGROUND_MAX_CONCURRENCY', '100'))
+        self.BACKGROUND_TASK_TIMEOUT = float(os.getenv('BACKGROUND_TASK_TIMEOUT', '300'))
+        self.SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+        
+        # 会话调度配置：会话内按到达顺序处理，会话间并行
+        self.CONVERSATION_SERIAL = os.getenv('CONVERSATION_SERIAL', 'true').lower() == 'true'
+        self.CONVERSATION_MAX_WORKERS = int(os.getenv('CONVERSATION_MAX_WORKERS', '50'))
+        self.CONVERSATION_MAX_PENDING = int(os.getenv('CONVERSATION_MAX_PENDING', '20'))
+        self.CONVERSATION_STATS_SHARDS = int(os.getenv('CONVERSATION_STATS_SHARDS', '16'))
+        
+        # 消息去重配置
+        self.MESSAGE_DEDUP = os.getenv('MESSAGE_DEDUP', 'true').lower() == 'true'
+        self.DEDUP_TTL = float(os.getenv('DEDUP_TTL', '600'))
+        self.DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', '100000'))
+        
         # 日志配置
         self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
         self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text 或 json
@@ -51,16 +116,29 @@ class Settings:
         self.TEMP_FILE_DIR = os.getenv('TEMP_FILE_DIR', '/tmp')
         self.UPLOAD_TO_DIFY = os.getenv('UPLOAD_TO_DIFY', 'false').lower() == 'true'
         self.ENABLE_DINGTALK_DRIVE = os.getenv('ENABLE_DINGTALK_DRIVE', 'true').lower() == 'true'
+        self.MEDIA_STREAM_CHUNK_KB = int(os.getenv('MEDIA_STREAM_CHUNK_KB', '64'))
+        self.MEDIA_STREAM_BUFFER_CHUNKS = int(os.getenv('MEDIA_STREAM_BUFFER_CHUNKS', '4'))
+        self.CONTENT_INDEX_TTL = float(os.getenv('CONTENT_INDEX_TTL', '604800'))
+        self.CONTENT_INDEX_MAX_ENTRIES = int(os.getenv('CONTENT_INDEX_MAX_ENTRIES', '10000'))
+        # 单个文件消息的处理上限(秒)，包括转发和AI分析
+        self.FILE_PROCESS_TIMEOUT = float(os.getenv('FILE_PROCESS_TIMEOUT', '600'))
         
         # 钉钉云盘配置
         self.DINGTALK_DRIVE_SPACE_TYPE = os.getenv('DINGTALK_DRIVE_SPACE_TYPE', 'org')
         self.DINGTALK_DRIVE_STORAGE_DRIVER = os.getenv('DINGTALK_DRIVE_STORAGE_DRIVER', 'DINGTALK')
         self.DINGTALK_DRIVE_CONFLICT_STRATEGY = os.getenv('DINGTALK_DRIVE_CONFLICT_STRATEGY', 'OVERWRITE')
         self.DINGTALK_DRIVE_CONVERT_TO_ONLINE_DOC = os.getenv('DINGTALK_DRIVE_CONVERT_TO_ONLINE_DOC', 'false').lower() == 'true'
+        self.DINGTALK_DRIVE_MULTIPART_THRESHOLD_MB = int(os.getenv('DINGTALK_DRIVE_MULTIPART_THRESHOLD_MB', '20'))
+        self.DINGTALK_DRIVE_PART_SIZE_MB = int(os.getenv('DINGTALK_DRIVE_PART_SIZE_MB', '5'))
+        self.DINGTALK_DRIVE_PART_CONCURRENCY = int(os.getenv('DINGTALK_DRIVE_PART_CONCURRENCY', '3'))
         
         # 网络配置
         self.REQUESTS_TIMEOUT = int(os.getenv('REQUESTS_TIMEOUT', '30'))
         self.MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
+        self.HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '20'))
+        self.HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+        self.HTTP_ASYNC_POOL_SIZE = int(os.getenv('HTTP_ASYNC_POOL_SIZE', '100'))
+        self.HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
         
         # SSL配置
         self.SSL_VERIFY = os.getenv('SSL_VERIFY', 'false').lower() == 'true'
@@ -100,8 +178,8 @@ class Settings:
         if not self.DINGTALK_AI_CARD_TEMPLATE_ID:
             warnings.append("未设置AI卡片模板ID，AI卡片功能可能不可用")
         
-        if self.DIFY_APP_TYPE not in ['chat', 'completion']:
-            errors.append("DIFY_APP_TYPE必须是 'chat' 或 'completion'")
+        if self.DIFY_APP_TYPE not in ['chat', 'completion', 'agent', 'workflow']:
+            errors.append("DIFY_APP_TYPE必须是 'chat'、'completion'、'agent' 或 'workflow'")
         
         if self.STREAM_MODE not in ['ai_card', 'text']:
             errors.append("STREAM_MODE必须是 'ai_card' 或 'text'")
@@ -131,20 +209,74 @@ class Settings:
             'dingtalk': {
                 'client_id': self.DINGTALK_CLIENT_ID,
                 'client_secret': self.DINGTALK_CLIENT_SECRET,
-                'ai_card_template_id': self.DINGTALK_AI_CARD_TEMPLATE_ID
+                'ai_card_template_id': self.DINGTALK_AI_CARD_TEMPLATE_ID,
+                'token_refresh_ahead': self.DINGTALK_TOKEN_REFRESH_AHEAD
+            },
+            'user_directory': {
+                'ttl': self.USER_DIRECTORY_TTL,
+                'max_entries': self.USER_DIRECTORY_MAX_ENTRIES,
+                'snapshot': self.USER_DIRECTORY_SNAPSHOT,
+                'preload_depts': self.USER_DIRECTORY_PRELOAD_DEPTS,
+                'preload_interval': self.USER_DIRECTORY_PRELOAD_INTERVAL
+            },
+            'drive_cache': {
+                'space_ttl': self.DRIVE_SPACE_CACHE_TTL,
+                'index_ttl': self.DRIVE_INDEX_CACHE_TTL,
+                'url_ttl': self.DRIVE_URL_CACHE_TTL
             },
             'dify': {
                 'api_base': self.DIFY_API_BASE,
                 'api_key': self.DIFY_API_KEY,
                 'app_type': self.DIFY_APP_TYPE,
                 'use_workflow': self.DIFY_USE_WORKFLOW,
-                'workflow_id': self.DIFY_WORKFLOW_ID
+                'workflow_id': self.DIFY_WORKFLOW_ID,
+                'pool_size': self.DIFY_POOL_SIZE,
+                'pool_size_per_host': self.DIFY_POOL_SIZE_PER_HOST,
+                'request_timeout': self.DIFY_REQUEST_TIMEOUT,
+                'stream_read_timeout': self.DIFY_STREAM_READ_TIMEOUT
             },
             'server': {
                 'port': self.SERVER_PORT,
                 'host': self.SERVER_HOST,
                 'session_timeout': self.SESSION_TIMEOUT,
-                'stream_mode': self.STREAM_MODE
+                'session_max_entries': self.SESSION_MAX_ENTRIES,
+                'session_sweep_interval': self.SESSION_SWEEP_INTERVAL,
+                'session_lock_stripes': self.SESSION_LOCK_STRIPES,
+                'stream_mode': self.STREAM_MODE,
+                'fast_ack': self.FAST_ACK,
+                'background_max_concurrency': self.BACKGROUND_MAX_CONCURRENCY,
+                'background_task_timeout': self.BACKGROUND_TASK_TIMEOUT,
+                'shutdown_drain_timeout': self.SHUTDOWN_DRAIN_TIMEOUT,
+                'conversation_serial': self.CONVERSATION_SERIAL,
+                'conversation_max_workers': self.CONVERSATION_MAX_WORKERS,
+                'conversation_max_pending': self.CONVERSATION_MAX_PENDING,
+                'conversation_stats_shards': self.CONVERSATION_STATS_SHARDS,
+                'message_dedup': self.MESSAGE_DEDUP,
+                'dedup_ttl': self.DEDUP_TTL,
+                'dedup_max_entries': self.DEDUP_MAX_ENTRIES
+            },
+            'state_store': {
+                'path': self.STATE_STORE_PATH,
+                'flush_interval': self.STATE_STORE_FLUSH_INTERVAL,
+                'batch_size': self.STATE_STORE_BATCH_SIZE,
+                'compact_interval': self.STATE_STORE_COMPACT_INTERVAL
+            },
+            'answer_cache': {
+                'enabled': self.ANSWER_CACHE,
+                'ttl': self.ANSWER_CACHE_TTL,
+                'max_entries': self.ANSWER_CACHE_MAX_ENTRIES,
+                'max_query_length': self.ANSWER_CACHE_MAX_QUERY_LENGTH,
+                'replay_interval': self.ANSWER_CACHE_REPLAY_INTERVAL,
+                'similarity_threshold': self.ANSWER_CACHE_SIMILARITY_THRESHOLD
+            },
+            'card_update': {
+                'max_qps': self.CARD_UPDATE_MAX_QPS,
+                'interval': self.CARD_UPDATE_INTERVAL,
+                'min_interval': self.CARD_UPDATE_MIN_INTERVAL,
+                'max_interval': self.CARD_UPDATE_MAX_INTERVAL,
+                'max_bytes': self.CARD_UPDATE_MAX_BYTES,
+                'target_latency': self.CARD_UPDATE_TARGET_LATENCY,
+                'append_mode': self.CARD_APPEND_MODE
             },
             'logging': {
                 'level': self.LOG_LEVEL,
@@ -155,17 +287,29 @@ class Settings:
                 'max_download_size_mb': self.MAX_DOWNLOAD_SIZE_MB,
                 'temp_file_dir': self.TEMP_FILE_DIR,
                 'upload_to_dify': self.UPLOAD_TO_DIFY,
-                'enable_dingtalk_drive': self.ENABLE_DINGTALK_DRIVE
+                'enable_dingtalk_drive': self.ENABLE_DINGTALK_DRIVE,
+                'media_stream_chunk_kb': self.MEDIA_STREAM_CHUNK_KB,
+                'media_stream_buffer_chunks': self.MEDIA_STREAM_BUFFER_CHUNKS,
+                'content_index_ttl': self.CONTENT_INDEX_TTL,
+                'content_index_max_entries': self.CONTENT_INDEX_MAX_ENTRIES,
+                'file_process_timeout': self.FILE_PROCESS_TIMEOUT
             },
             'dingtalk_drive': {
                 'space_type': self.DINGTALK_DRIVE_SPACE_TYPE,
                 'storage_driver': self.DINGTALK_DRIVE_STORAGE_DRIVER,
                 'conflict_strategy': self.DINGTALK_DRIVE_CONFLICT_STRATEGY,
-                'convert_to_online_doc': self.DINGTALK_DRIVE_CONVERT_TO_ONLINE_DOC
+                'convert_to_online_doc': self.DINGTALK_DRIVE_CONVERT_TO_ONLINE_DOC,
+                'multipart_threshold_mb': self.DINGTALK_DRIVE_MULTIPART_THRESHOLD_MB,
+                'part_size_mb': self.DINGTALK_DRIVE_PART_SIZE_MB,
+                'part_concurrency': self.DINGTALK_DRIVE_PART_CONCURRENCY
             },
             'network': {
                 'requests_timeout': self.REQUESTS_TIMEOUT,
-                'max_retries': self.MAX_RETRIES
+                'max_retries': self.MAX_RETRIES,
+                'pool_maxsize': self.HTTP_POOL_MAXSIZE,
+                'connect_timeout': self.HTTP_CONNECT_TIMEOUT,
+                'async_pool_size': self.HTTP_ASYNC_POOL_SIZE,
+                'keepalive_timeout': self.HTTP_KEEPALIVE_TIMEOUT
             },
             'ssl': {
                 'verify': self.SSL_VERIFY,
@@ -1,3 +1,16 @@
-from .client import DifyClient
+from .client import DifyClient, iterate_in_executor
+from .async_client import AsyncDifyClient
+from .events import (
+    StreamEvent, DeltaEvent, ReplaceEvent, ProgressEvent, UsageEvent, EndEvent, ErrorEvent,
+    normalize_event, normalize_stream
+)
+from .sse import SSEParser, StreamAccumulator
+from .query_similarity import SimilarityIndex, MinHasher, normalize_query
+from .answer_cache import AnswerCache, get_answer_cache
 
-__all__ = ['DifyClient'] 
\ No newline at end of file
+__all__ = [
+    'DifyClient', 'AsyncDifyClient', 'iterate_in_executor',
+    'StreamEvent', 'DeltaEvent', 'ReplaceEvent', 'ProgressEvent', 'UsageEvent', 'EndEvent', 'ErrorEvent',
+    'normalize_event', 'normalize_stream', 'SSEParser', 'StreamAccumulator',
+    'AnswerCache', 'get_answer_cache', 'normalize_query', 'SimilarityIndex', 'MinHasher'
+]
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Dify回复缓存
+
+常见问题（如请假流程、VPN地址）的回复直接从缓存返回，不再经过Dify生成：
+1. 按Dify应用、规范化后的问题文本和输入变量精确匹配
+2. 内存LRU层 + 状态存储磁盘层，每条回复有独立的有效期，重启后磁盘层仍可命中
+3. 追问、携带文件或过长的问题不使用缓存，只缓存新Dify对话中成功且未调用工具的回复
+4. 命中的回复按增量事件重放，经过与Dify回复相同的卡片更新流程
+5. 支持按问题或整体失效，统计内存/磁盘命中率
+6. 可选的相似问题层：精确匹配未命中时，在MinHash LSH索引中查找换了说法的已缓存问题
+"""
+
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from config.settings import settings
+from utils.logger import dify_logger
+from utils.state_store import StateStore, get_state_store
+from .events import DeltaEvent, EndEvent, StreamEvent
+from .query_similarity import SimilarityIndex, normalize_query
+
+# 回复在状态存储中的命名空间
+ANSWER_NAMESPACE = "answer"
+# 指代上文的追问，进行中的对话里出现时不使用缓存
+FOLLOW_UP_MARKERS = (
+    '继续', '还有', '然后呢', '为什么', '怎么说', '上面', '上述', '刚才', '之前', '前面',
+    '这个', '那个', '它', '他们', '详细', '展开', '换个', '不对', '再说', '举例', '下一步', '上一步'
+)
+# 承接上文的开头，如"那第二步呢"、"所以要多久"
+FOLLOW_UP_PREFIXES = ('那', '所以', '另外', '而且', '并且', '再', '那么')
+# 指代上文列出的某一项，如"第二步"、"第3条"
+_ORDINAL_REFERENCE = re.compile(r'第[一二三四五六七八九十\d]+[步条点项个]')
+# 进行中的对话里过短的消息（如"好的"、"嗯"）依赖上下文
+_MIN_STANDALONE_LENGTH = 4
+
+
+class AnswerCache:
+    """按问题精确匹配的两级回复缓存"""
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 1000, max_query_length: int = 200,
+                 replay_chunk_size: int = 32, replay_interval: float = 0.03,
+                 similarity_threshold: float = 0, store: Optional[StateStore] = None,
+                 logger: logging.Logger = dify_logger):
+        """
+        初始化回复缓存
+
+        Args:
+            ttl: 回复默认有效期(秒)
+            max_entries: 内存层条目数上限，超出时淘汰最久未使用的条目
+            max_query_length: 超过该长度的问题不使用缓存
+            replay_chunk_size: 重放时每个增量的字符数
+            replay_interval: 重放时两个增量之间的间隔(秒)，为0时一次推送
+            similarity_threshold: 相似问题层的Jaccard相似度阈值，为0时只做精确匹配
+            store: 磁盘层使用的状态存储，为None时只使用内存层
+            logger: 日志记录器
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_query_length = max_query_length
+        self.replay_chunk_size = max(1, replay_chunk_size)
+        self.replay_interval = replay_interval
+        self.store = store or StateStore()
+        self.logger = logger
+        # 相似问题索引只保存在内存中，重启后随回复的写入和磁盘层命中重新建立
+        self.similar = SimilarityIndex(similarity_threshold, max_entries=max_entries) if similarity_threshold > 0 else None
+
+        # 缓存键 -> (过期时间, 回复)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'similar_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'stored': 0,
+            'invalidated': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def app_key(dify_client, app_type: Optional[str] = None) -> str:
+        """Dify应用标识，由API地址、密钥和应用类型散列得到，不保存密钥本身"""
+        raw = f"{dify_client.api_base}|{dify_client.api_key}|{app_type or dify_client.app_type}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+    def make_key(self, app_key: str, query: str, inputs: Optional[Dict[str, Any]] = None) -> str:
+        """缓存键：应用标识 + 规范化问题 + 输入变量"""
+        raw = json.dumps([app_key, normalize_query(query), inputs or {}], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def bypass_reason(self, query: str, in_conversation: bool = False, files: Optional[list] = None) -> str:
+        """
+        判断问题是否不使用缓存
+
+        Args:
+            query: 用户输入
+            in_conversation: 是否在延续已有的Dify对话
+            files: 随问题发送的文件
+
+        Returns:
+            str: 不使用缓存的原因，可以使用缓存时返回空字符串
+        """
+        text = normalize_query(query)
+        if not text:
+            return "空问题"
+        if files:
+            return "携带文件"
+        if len(text) > self.max_query_length:
+            return "问题过长"
+        if in_conversation:
+            if len(text) < _MIN_STANDALONE_LENGTH:
+                return "对话中的短消息"
+            if (any(marker in text for marker in FOLLOW_UP_MARKERS) or text.startswith(FOLLOW_UP_PREFIXES)
+                    or _ORDINAL_REFERENCE.search(text)):
+                return "追问"
+        return ""
+
+    def bypass(self, reason: str):
+        """记录一次跳过缓存"""
+        with self._lock:
+            self._stats['bypassed'] += 1
+        self.logger.debug(f"回复缓存跳过: {reason}")
+
+    @staticmethod
+    def scope(app_key: str, inputs: Optional[Dict[str, Any]] = None) -> str:
+        """相似问题的比较范围：同一应用、相同输入变量"""
+        if not inputs:
+            return app_key
+        return f"{app_key}:{json.dumps(inputs, ensure_ascii=False, sort_keys=True)}"
+
+    def lookup(self, app_key: str, query: str, inputs: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """按问题查询回复：先精确匹配，未命中且启用相似问题层时查找相似的已缓存问题"""
+        key = self.make_key(app_key, query, inputs)
+        answer, record = self._fetch(key)
+        if answer is not None:
+            if record is not None and self.similar is not None:
+                self.similar.add(key, self.scope(app_key, inputs), record.get('query') or query)
+            return answer
+
+        if self.similar is not None:
+            match = self.similar.query(self.scope(app_key, inputs), query)
+            if match is not None:
+                similar_key, similarity = match
+                answer = self._fetch(similar_key, count=False)[0]
+                if answer is not None:
+                    with self._lock:
+                        self._stats['similar_hits'] += 1
+                    self.logger.info(f"回复缓存相似问题命中: 相似度={similarity:.2f}")
+                    return answer
+                # 回复已过期或被淘汰
+                self.similar.remove(similar_key)
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def store_answer(self, app_key: str, query: str, answer: str, inputs: Optional[Dict[str, Any]] = None,
+                     ttl: Optional[float] = None):
+        """按问题保存回复，同时加入相似问题索引"""
+        if not answer:
+            return
+        key = self.make_key(app_key, query, inputs)
+        self.put(key, answer, query, ttl)
+        if self.similar is not None:
+            self.similar.add(key, self.scope(app_key, inputs), query)
+
+    def get(self, key: str) -> Optional[str]:
+        """按缓存键查询回复，内存层未命中时查询磁盘层并放入内存层"""
+        answer = self._fetch(key)[0]
+        if answer is None:
+            with self._lock:
+                self._stats['misses'] += 1
+        return answer
+
+    def _fetch(self, key: str, count: bool = True) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        依次查询内存层和磁盘层
+
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: (回复, 磁盘层命中时的记录)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    if count:
+                        self._stats['memory_hits'] += 1
+                    return entry[1], None
+                del self._entries[key]
+
+        record = self.store.get(ANSWER_NAMESPACE, key)
+        if record is None:
+            return None, None
+        with self._lock:
+            if count:
+                self._stats['disk_hits'] += 1
+            self._remember(key, record['expires_at'], record['answer'])
+        return record['answer'], record
+
+    def put(self, key: str, answer: str, query: str = "", ttl: Optional[float] = None):
+        """保存回复，ttl 为None时使用默认有效期"""
+        if not answer:
+            return
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._remember(key, expires_at, answer)
+            self._stats['stored'] += 1
+        self.store.put(ANSWER_NAMESPACE, key, {
+            'answer': answer,
+            'query': query,
+            'expires_at': expires_at
+        }, expires_at)
+
+    def _remember(self, key: str, expires_at: float, answer: str):
+        """写入内存层，调用方须持有锁"""
+        self._entries[key] = (expires_at, answer)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, key: str):
+        """使一条回复失效"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._stats['invalidated'] += 1
+        self.store.delete(ANSWER_NAMESPACE, key)
+        if self.similar is not None:
+            self.similar.remove(key)
+
+    def invalidate_query(self, app_key: str, query: str, inputs: Optional[Dict[str, Any]] = None):
+        """使某个问题的回复失效，如知识库中的答案已更新"""
+        self.invalidate(self.make_key(app_key, query, inputs))
+
+    def clear(self) -> int:
+        """清空内存层和磁盘层，返回清除的条目数"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._stats['invalidated'] += count
+        if self.similar is not None:
+            self.similar.clear()
+        return max(count, self.store.clear_namespace(ANSWER_NAMESPACE))
+
+    async def replay(self, answer: str) -> AsyncIterator[StreamEvent]:
+        """把缓存的回复重放为增量事件，与Dify流式回复经过相同的卡片更新流程"""
+        size = self.replay_chunk_size
+        for start in range(0, len(answer), size):
+            if start and self.replay_interval > 0:
+                await asyncio.sleep(self.replay_interval)
+            yield DeltaEvent(answer[start:start + size])
+        yield EndEvent('message')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息，命中率不计入跳过缓存的请求"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        hits = stats['memory_hits'] + stats['disk_hits'] + stats['similar_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        if self.similar is not None:
+            stats['similarity_index'] = self.similar.get_stats()
+        return stats
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """获取进程内共享的回复缓存，未启用 ANSWER_CACHE 时返回None"""
+    global _cache
+    if not settings.ANSWER_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(
+                    ttl=settings.ANSWER_CACHE_TTL,
+                    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+                    max_query_length=settings.ANSWER_CACHE_MAX_QUERY_LENGTH,
+                    replay_interval=settings.ANSWER_CACHE_REPLAY_INTERVAL,
+                    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                    store=get_state_store()
+                )
+    return _cache
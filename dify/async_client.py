@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+异步Dify客户端
+
+基于aiohttp实现，与DifyClient保持相同的调用接口：
+1. 使用共享传输层中有界的长连接池，多个会话复用TCP/TLS连接
+2. 每个请求独立的超时设置
+3. 协程取消时立即释放底层连接，不阻塞事件循环
+"""
+
+import os
+import time
+import asyncio
+import aiohttp
+from typing import Dict, Any, AsyncIterator, Optional
+from utils.logger import dify_logger
+from utils.http_transport import get_transport
+from .events import StreamEvent, normalize_stream
+from .sse import SSEParser, StreamAccumulator, aiter_sse_events
+
+
+class AsyncDifyClient:
+    """异步Dify API客户端"""
+
+    def __init__(self, api_base: str, api_key: str, app_type: str = "completion",
+                 pool_size: int = 100, pool_size_per_host: int = 50,
+                 request_timeout: float = 120, connect_timeout: float = 10,
+                 stream_read_timeout: float = 60, keepalive_timeout: float = 30):
+        """
+        初始化异步Dify客户端
+
+        Args:
+            api_base: Dify API基础URL
+            api_key: Dify API密钥
+            app_type: Dify应用类型
+            pool_size: 连接池总连接数上限
+            pool_size_per_host: 单个主机连接数上限
+            request_timeout: 非流式请求总超时(秒)
+            connect_timeout: 建立连接超时(秒)
+            stream_read_timeout: 流式请求两个数据块之间的最大间隔(秒)
+            keepalive_timeout: 空闲连接保活时间(秒)
+        """
+        self.api_base = api_base
+        self.api_key = api_key
+        self.app_type = app_type
+        # 连接池由多个客户端共享，鉴权头随请求发送；Content-Type由json/multipart请求体各自生成
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = aiohttp.ClientTimeout(total=request_timeout, connect=connect_timeout)
+        # 流式请求不限制总时长，只限制连接时间和数据块间隔
+        self.stream_timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout,
+                                                    sock_read=stream_read_timeout)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享传输层中的Dify连接池，在当前事件循环中按需创建"""
+        return get_transport().async_session(
+            "dify",
+            limit=self.pool_size,
+            limit_per_host=self.pool_size_per_host,
+            keepalive_timeout=self.keepalive_timeout
+        )
+
+    async def close(self):
+        """关闭连接池"""
+        await get_transport().close_async("dify")
+
+    async def chat_completion(self, query: str, user: str, stream: bool = False, files: list = None,
+                              timeout: Optional[float] = None, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """聊天完成API，conversation_id 为空时Dify创建新对话"""
+        try:
+            data = self._build_payload(user, stream, files, query=query, conversation_id=conversation_id)
+            dify_logger.info(f"发送聊天请求到 {self.api_base}/chat-messages: 用户={user}, 流式输出={stream}, 文件数量={len(files) if files else 0}, 对话={conversation_id or '新对话'}")
+
+            if stream:
+                return await self._send_stream_request("/chat-messages", data)
+            else:
+                return await self._send_request("/chat-messages", data, timeout)
+
+        except Exception as e:
+            dify_logger.error(f"Dify API请求失败: {str(e)}")
+            raise
+
+    async def completion(self, prompt: str, user: str, stream: bool = False, files: list = None,
+                         timeout: Optional[float] = None) -> Dict[str, Any]:
+        """文本完成API"""
+        try:
+            data = self._build_payload(user, stream, files, query=prompt)
+            dify_logger.info(f"发送完成请求到 {self.api_base}/completion-messages: 用户={user}, 流式输出={stream}, 文件数量={len(files) if files else 0}")
+
+            if stream:
+                return await self._send_stream_request("/completion-messages", data)
+            else:
+                return await self._send_request("/completion-messages", data, timeout)
+
+        except Exception as e:
+            dify_logger.error(f"Dify API请求失败: {str(e)}")
+            raise
+
+    async def workflow_run(self, inputs: dict, user: str, files: list = None, stream: bool = False,
+                           timeout: Optional[float] = None) -> Dict[str, Any]:
+        """工作流执行API"""
+        try:
+            data = self._build_payload(user, stream, files, inputs=inputs)
+            dify_logger.info(f"发送工作流请求到 {self.api_base}/workflows/run: 用户={user}, 流式输出={stream}, 文件数量={len(files) if files else 0}")
+
+            if stream:
+                return await self._send_stream_request("/workflows/run", data)
+            else:
+                return await self._send_request("/workflows/run", data, timeout)
+
+        except Exception as e:
+            dify_logger.error(f"Dify工作流API请求失败: {str(e)}")
+            raise
+
+    def stream_chat_completion(self, query: str, user: str, files: list = None,
+                               conversation_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """流式聊天API，每收到一个数据块立即产出"""
+        data = self._build_payload(user, True, files, query=query, conversation_id=conversation_id)
+        dify_logger.info(f"发送流式聊天请求到 {self.api_base}/chat-messages: 用户={user}, 文件数量={len(files) if files else 0}")
+        return self._iter_stream_request("/chat-messages", data)
+
+    def stream_completion(self, prompt: str, user: str, files: list = None) -> AsyncIterator[Dict[str, Any]]:
+        """流式文本完成API，每收到一个数据块立即产出"""
+        data = self._build_payload(user, True, files, query=prompt)
+        dify_logger.info(f"发送流式完成请求到 {self.api_base}/completion-messages: 用户={user}, 文件数量={len(files) if files else 0}")
+        return self._iter_stream_request("/completion-messages", data)
+
+    def stream_workflow_run(self, inputs: dict, user: str, files: list = None) -> AsyncIterator[Dict[str, Any]]:
+        """流式工作流执行API，每收到一个事件立即产出"""
+        data = self._build_payload(user, True, files, inputs=inputs)
+        dify_logger.info(f"发送流式工作流请求到 {self.api_base}/workflows/run: 用户={user}, 文件数量={len(files) if files else 0}")
+        return self._iter_stream_request("/workflows/run", data)
+
+    def stream_events(self, query: str, user: str, files: list = None, inputs: Optional[dict] = None,
+                      app_type: Optional[str] = None, conversation_id: Optional[str] = None) -> AsyncIterator[StreamEvent]:
+        """
+        按应用类型调用对应的流式API，产出归一化的类型化事件
+
+        Args:
+            query: 用户输入；workflow 应用作为 inputs.query 传入
+            user: 用户标识
+            files: 文件列表
+            inputs: 应用输入变量
+            app_type: 应用类型，默认使用客户端的 app_type
+            conversation_id: 延续的Dify对话ID，只用于聊天类应用
+        """
+        app_type = app_type or self.app_type
+        if app_type == 'workflow':
+            inputs = dict(inputs or {})
+            inputs.setdefault('query', query)
+            chunks = self.stream_workflow_run(inputs, user, files)
+        elif app_type == 'completion':
+            data = self._build_payload(user, True, files, query=query, inputs=inputs)
+            dify_logger.info(f"发送流式完成请求到 {self.api_base}/completion-messages: 用户={user}, 文件数量={len(files) if files else 0}")
+            chunks = self._iter_stream_request("/completion-messages", data)
+        else:
+            # chat、agent 与 advanced-chat 应用共用聊天接口
+            data = self._build_payload(user, True, files, query=query, inputs=inputs, conversation_id=conversation_id)
+            dify_logger.info(f"发送流式聊天请求到 {self.api_base}/chat-messages: 用户={user}, 应用类型={app_type}, 文件数量={len(files) if files else 0}, 对话={conversation_id or '新对话'}")
+            chunks = self._iter_stream_request("/chat-messages", data)
+        return normalize_stream(chunks)
+
+    async def upload_file(self, file_path: str, file_name: str = None) -> Optional[str]:
+        """上传文件到Dify"""
+        try:
+            if not file_name:
+                file_name = os.path.basename(file_path)
+
+            upload_url = f"{self.api_base}/files/upload"
+
+            with open(file_path, 'rb') as f:
+                form = aiohttp.FormData()
+                form.add_field('file', f, filename=file_name, content_type='application/octet-stream')
+                dify_logger.info(f"上传文件到Dify: {file_name}")
+
+                async with self._get_session().post(upload_url, data=form, headers=self.headers,
+                                                    timeout=aiohttp.ClientTimeout(total=60)) as response:
+                    response.raise_for_status()
+                    result = await response.json(content_type=None)
+
+            file_id = result.get('id')
+            if file_id:
+                dify_logger.info(f"文件上传成功，ID: {file_id}")
+                return file_id
+            else:
+                dify_logger.error(f"文件上传失败，响应: {result}")
+                return None
+
+        except Exception as e:
+            dify_logger.error(f"上传文件到Dify失败: {str(e)}")
+            return None
+
+    async def upload_stream(self, chunks: AsyncIterator[bytes], file_name: str, user: str,
+                            content_type: str = 'application/octet-stream') -> Optional[str]:
+        """
+        以流式multipart上传文件到Dify，文件内容边读边发送，不在内存中拼接
+
+        Args:
+            chunks: 文件内容的异步字节流
+            file_name: 文件名
+            user: 用户标识，需与后续调用一致
+            content_type: 文件的MIME类型
+
+        Returns:
+            Optional[str]: Dify文件ID，失败时为None
+        """
+        try:
+            upload_url = f"{self.api_base}/files/upload"
+
+            with aiohttp.MultipartWriter('form-data') as form:
+                file_part = form.append(chunks, {'Content-Type': content_type})
+                file_part.set_content_disposition('form-data', name='file', filename=file_name)
+                user_part = form.append(user)
+                user_part.set_content_disposition('form-data', name='user')
+
+            dify_logger.info(f"流式上传文件到Dify: {file_name}")
+            start_time = time.time()
+            async with self._get_session().post(upload_url, data=form, headers=self.headers,
+                                                timeout=self.stream_timeout) as response:
+                if response.status not in (200, 201):
+                    dify_logger.error(f"文件上传失败，响应: {await response.text()}")
+                    return None
+                result = await response.json(content_type=None)
+
+            file_id = result.get('id')
+            if file_id:
+                dify_logger.info(f"文件上传成功，ID: {file_id}, 耗时: {time.time() - start_time:.3f}秒")
+                return file_id
+            else:
+                dify_logger.error(f"文件上传失败，响应: {result}")
+                return None
+
+        except Exception as e:
+            dify_logger.error(f"流式上传文件到Dify失败: {str(e)}")
+            return None
+
+    async def file_exists(self, file_id: str) -> bool:
+        """确认已上传的文件在Dify中仍然可用，只检查状态码，不读取文件内容"""
+        try:
+            url = f"{self.api_base}/files/{file_id}/preview"
+            async with self._get_session().get(url, headers=self.headers, timeout=self.request_timeout) as response:
+                return response.status == 200
+        except Exception as e:
+            dify_logger.warning(f"检查Dify文件失败: {file_id}, {str(e)}")
+            return False
+
+    def _build_payload(self, user: str, stream: bool, files: list = None,
+                       query: Optional[str] = None, inputs: Optional[dict] = None,
+                       conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """构建请求数据"""
+        data = {
+            "inputs": inputs if inputs is not None else {},
+            "user": user,
+            "response_mode": "streaming" if stream else "blocking"
+        }
+        if query is not None:
+            data["query"] = query
+        # 添加文件参数
+        if files:
+            data["files"] = files
+        # 延续已有对话，Dify按对话保留上下文
+        if conversation_id:
+            data["conversation_id"] = conversation_id
+        return data
+
+    async def _send_request(self, endpoint: str, data: dict, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """发送非流式请求"""
+        try:
+            url = f"{self.api_base}{endpoint}"
+            dify_logger.info(f"发送请求到: {url}")
+
+            request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else self.request_timeout
+            start_time = time.time()
+            async with self._get_session().post(url, json=data, headers=self.headers, timeout=request_timeout) as response:
+                if response.status != 200:
+                    error_msg = f"Dify API请求失败: {await response.text()}"
+                    dify_logger.error(error_msg)
+                    raise Exception(error_msg)
+                result = await response.json(content_type=None)
+
+            elapsed_time = time.time() - start_time
+            dify_logger.info(f"请求耗时: {elapsed_time:.3f}秒")
+            dify_logger.info("成功接收响应")
+            return result
+
+        except asyncio.TimeoutError:
+            dify_logger.error(f"发送请求超时: {endpoint}")
+            raise
+        except Exception as e:
+            dify_logger.error(f"发送请求失败: {str(e)}")
+            raise
+
+    async def _iter_stream_request(self, endpoint: str, data: dict) -> AsyncIterator[Dict[str, Any]]:
+        """发送流式请求，按到达顺序逐块产出解析后的事件"""
+        url = f"{self.api_base}{endpoint}"
+        dify_logger.info(f"发送流式请求到: {url}")
+
+        start_time = time.time()
+        async with self._get_session().post(url, json=data, headers=self.headers, timeout=self.stream_timeout) as response:
+            elapsed_time = time.time() - start_time
+            dify_logger.info(f"请求耗时: {elapsed_time:.3f}秒")
+
+            if response.status != 200:
+                error_msg = f"Dify API请求失败: {await response.text()}"
+                dify_logger.error(error_msg)
+                raise Exception(error_msg)
+
+            dify_logger.info("开始接收流式响应")
+            async for chunk in self._iter_stream_events(response):
+                yield chunk
+
+    async def _iter_stream_events(self, response: aiohttp.ClientResponse) -> AsyncIterator[Dict[str, Any]]:
+        """增量解析SSE事件并立即产出，直接处理到达的字节块"""
+        parser = SSEParser(dify_logger)
+
+        async for event in aiter_sse_events(response.content.iter_any(), parser):
+            # 每10个块记录一次，避免日志过多
+            if parser.event_count % 10 == 0:
+                dify_logger.debug(f"接收流式响应块 #{parser.event_count}")
+            yield event
+
+        dify_logger.info(f"流式响应完成，共 {parser.event_count} 个数据块，解析统计: {parser.get_stats()}")
+
+    async def _send_stream_request(self, endpoint: str, data: dict) -> Dict[str, Any]:
+        """发送流式请求并汇总为与DifyClient相同的字典格式"""
+        try:
+            accumulator = StreamAccumulator()
+            async for chunk in self._iter_stream_request(endpoint, data):
+                accumulator.add(chunk)
+            return accumulator.result()
+        except Exception as e:
+            dify_logger.error(f"发送流式请求失败: {str(e)}")
+            raise
@@ -1,10 +1,35 @@
-import json
-import requests
-import sseclient
+import asyncio
 import time
 import os
-from typing import Dict, Any, Generator, Optional
+from typing import Dict, Any, AsyncIterator, Generator, Iterator, Optional
+from config.settings import settings
 from utils.logger import dify_logger, log_request, log_response
+from utils.http_transport import get_transport
+from .events import StreamEvent, normalize_stream_sync
+from .sse import SSEParser, StreamAccumulator, iter_sse_events
+
+
+_STREAM_END = object()
+
+
+async def iterate_in_executor(iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """在线程池中逐个驱动同步迭代器，把每个元素按到达顺序交给事件循环
+
+    用于在异步处理器中消费 DifyClient 的同步流式生成器，
+    避免阻塞事件循环的同时保持逐块输出。
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, next, iterator, _STREAM_END)
+            if item is _STREAM_END:
+                break
+            yield item
+    finally:
+        # 提前退出（如协程被取消）时关闭生成器，释放底层HTTP连接
+        close = getattr(iterator, "close", None)
+        if close:
+            await loop.run_in_executor(None, close)
 
 class DifyClient:
     def __init__(self, api_base: str, api_key: str, app_type: str = "completion"):
@@ -16,8 +41,9 @@ class DifyClient:
             "Content-Type": "application/json"
         }
     
-    def chat_completion(self, query: str, user: str, stream: bool = False, files: list = None) -> Dict[str, Any]:
-        """聊天完成API"""
+    def chat_completion(self, query: str, user: str, stream: bool = False, files: list = None,
+                        conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """聊天完成API，conversation_id 为空时Dify创建新对话"""
         try:
             # 构建请求数据
             data = {
@@ -30,8 +56,10 @@ class DifyClient:
             # 添加文件参数
             if files:
                 data["files"] = files
+            if conversation_id:
+                data["conversation_id"] = conversation_id
             
-            dify_logger.info(f"发送聊天请求到 {self.api_base}/chat-messages: 用户={user}, 流式输出={stream}, 文件数量={len(files) if files else 0}")
+            dify_logger.info(f"发送聊天请求到 {self.api_base}/chat-messages: 用户={user}, 流式输出={stream}, 文件数量={len(files) if files else 0}, 对话={conversation_id or '新对话'}")
             
             if stream:
                 return self._send_stream_request("/chat-messages", data)
@@ -93,6 +121,73 @@ class DifyClient:
             dify_logger.error(f"Dify工作流API请求失败: {str(e)}")
             raise
 
+    def stream_chat_completion(self, query: str, user: str, files: list = None,
+                               conversation_id: Optional[str] = None) -> Generator[Dict[str, Any], None, None]:
+        """流式聊天API，每收到一个数据块立即产出"""
+        data = {
+            "inputs": {},
+            "query": query,
+            "user": user,
+            "response_mode": "streaming"
+        }
+        if files:
+            data["files"] = files
+        if conversation_id:
+            data["conversation_id"] = conversation_id
+        
+        dify_logger.info(f"发送流式聊天请求到 {self.api_base}/chat-messages: 用户={user}, 文件数量={len(files) if files else 0}")
+        return self._iter_stream_request("/chat-messages", data)
+
+    def stream_completion(self, prompt: str, user: str, files: list = None) -> Generator[Dict[str, Any], None, None]:
+        """流式文本完成API，每收到一个数据块立即产出"""
+        data = {
+            "inputs": {},
+            "query": prompt,
+            "user": user,
+            "response_mode": "streaming"
+        }
+        if files:
+            data["files"] = files
+        
+        dify_logger.info(f"发送流式完成请求到 {self.api_base}/completion-messages: 用户={user}, 文件数量={len(files) if files else 0}")
+        return self._iter_stream_request("/completion-messages", data)
+
+    def stream_workflow_run(self, inputs: dict, user: str, files: list = None) -> Generator[Dict[str, Any], None, None]:
+        """流式工作流执行API，每收到一个事件立即产出"""
+        data = {
+            "inputs": inputs,
+            "user": user,
+            "response_mode": "streaming"
+        }
+        if files:
+            data["files"] = files
+        
+        dify_logger.info(f"发送流式工作流请求到 {self.api_base}/workflows/run: 用户={user}, 文件数量={len(files) if files else 0}")
+        return self._iter_stream_request("/workflows/run", data)
+
+    def stream_events(self, query: str, user: str, files: list = None, inputs: Optional[dict] = None,
+                      app_type: Optional[str] = None, conversation_id: Optional[str] = None) -> Iterator[StreamEvent]:
+        """按应用类型调用对应的流式API，产出归一化的类型化事件；conversation_id 只用于聊天类应用"""
+        app_type = app_type or self.app_type
+        if app_type == 'workflow':
+            inputs = dict(inputs or {})
+            inputs.setdefault('query', query)
+            return normalize_stream_sync(self.stream_workflow_run(inputs, user, files))
+        data = {
+            "inputs": inputs or {},
+            "query": query,
+            "user": user,
+            "response_mode": "streaming"
+        }
+        if files:
+            data["files"] = files
+        # chat、agent 与 advanced-chat 应用共用聊天接口
+        endpoint = "/completion-messages" if app_type == 'completion' else "/chat-messages"
+        if conversation_id and endpoint == "/chat-messages":
+            data["conversation_id"] = conversation_id
+        dify_logger.info(f"发送流式请求到 {self.api_base}{endpoint}: 用户={user}, 应用类型={app_type}, 文件数量={len(files) if files else 0}")
+        return normalize_stream_sync(self._iter_stream_request(endpoint, data))
+
     def upload_file(self, file_path: str, file_name: str = None) -> str:
         """上传文件到Dify"""
         try:
@@ -107,7 +202,7 @@ class DifyClient:
             with open(file_path, 'rb') as f:
                 files = {'file': (file_name, f, 'application/octet-stream')}
                 dify_logger.info(f"上传文件到Dify: {file_name}")
-                response = requests.post(upload_url, headers=headers, files=files, verify=False, timeout=60)
+                response = get_transport().post(upload_url, headers=headers, files=files, timeout=60)
                 response.raise_for_status()
                 
                 result = response.json()
@@ -131,7 +226,8 @@ class DifyClient:
             dify_logger.info(f"发送请求到: {url}")
             
             start_time = time.time()
-            response = requests.post(url, headers=self.headers, json=data, verify=False)
+            response = get_transport().post(url, headers=self.headers, json=data,
+                                           timeout=settings.DIFY_REQUEST_TIMEOUT)
             elapsed_time = time.time() - start_time
             
             dify_logger.info(f"请求耗时: {elapsed_time:.3f}秒")
@@ -149,73 +245,75 @@ class DifyClient:
             dify_logger.error(f"发送请求失败: {str(e)}")
             raise
 
+    def _open_stream(self, endpoint: str, data: dict):
+        """建立流式连接，返回尚未读取的响应对象"""
+        url = f"{self.api_base}{endpoint}"
+        dify_logger.info(f"发送流式请求到: {url}")
+        
+        start_time = time.time()
+        # 流式响应的读取超时作用于两次数据到达之间
+        response = get_transport().post(url, headers=self.headers, json=data, stream=True,
+                                        timeout=settings.DIFY_STREAM_READ_TIMEOUT)
+        elapsed_time = time.time() - start_time
+        
+        dify_logger.info(f"请求耗时: {elapsed_time:.3f}秒")
+        
+        if response.status_code != 200:
+            error_msg = f"Dify API请求失败: {response.text}"
+            dify_logger.error(error_msg)
+            response.close()
+            raise Exception(error_msg)
+        
+        return response
+
+    def _iter_stream_request(self, endpoint: str, data: dict) -> Generator[Dict[str, Any], None, None]:
+        """发送流式请求，按到达顺序逐块产出解析后的事件"""
+        try:
+            response = self._open_stream(endpoint, data)
+        except Exception as e:
+            dify_logger.error(f"发送流式请求失败: {str(e)}")
+            raise
+        
+        try:
+            dify_logger.info("开始接收流式响应")
+            yield from self._iter_stream_events(response)
+        finally:
+            response.close()
+
     def _send_stream_request(self, endpoint: str, data: dict) -> Dict[str, Any]:
         """发送流式请求"""
         try:
-            url = f"{self.api_base}{endpoint}"
-            dify_logger.info(f"发送流式请求到: {url}")
-            
-            start_time = time.time()
-            response = requests.post(url, headers=self.headers, json=data, stream=True, verify=False)
-            elapsed_time = time.time() - start_time
-            
-            dify_logger.info(f"请求耗时: {elapsed_time:.3f}秒")
-            
-            if response.status_code != 200:
-                error_msg = f"Dify API请求失败: {response.text}"
-                dify_logger.error(error_msg)
-                raise Exception(error_msg)
-            
+            response = self._open_stream(endpoint, data)
             dify_logger.info("开始接收流式响应")
-            return self._handle_stream_response(response)
+            try:
+                return self._handle_stream_response(response)
+            finally:
+                response.close()
             
         except Exception as e:
             dify_logger.error(f"发送流式请求失败: {str(e)}")
             raise
 
+    def _iter_stream_events(self, response) -> Generator[Dict[str, Any], None, None]:
+        """增量解析SSE事件并立即产出，不在内存中累积"""
+        parser = SSEParser(dify_logger)
+        
+        # chunk_size=None 时按数据到达的大小产出，不等待凑满固定长度
+        for event in iter_sse_events(response.iter_content(chunk_size=None), parser):
+            # 每10个块记录一次，避免日志过多
+            if parser.event_count % 10 == 0:
+                dify_logger.debug(f"接收流式响应块 #{parser.event_count}")
+            yield event
+        
+        dify_logger.info(f"流式响应完成，共 {parser.event_count} 个数据块，解析统计: {parser.get_stats()}")
+
     def _handle_stream_response(self, response) -> Dict[str, Any]:
         """处理流式响应，返回字典格式，参考dingtalk-dify-master的实现"""
         try:
-            import sseclient
-            
-            client = sseclient.SSEClient(response)
-            accumulated_data = {"answer": ""}  # 确保answer字段始终存在
-            event_stream = []
-            chunk_count = 0
-            
-            for event in client.events():
-                if event.data.strip():  # 忽略空行
-                    try:
-                        chunk = json.loads(event.data)
-                        event_stream.append(chunk)
-                        
-                        # 合并数据
-                        for key, value in chunk.items():
-                            if key not in accumulated_data:
-                                accumulated_data[key] = value
-                            elif key == "answer":
-                                accumulated_data[key] += value
-                        
-                        chunk_count += 1
-                        
-                        # 每10个块记录一次，避免日志过多
-                        if chunk_count % 10 == 0:
-                            dify_logger.debug(f"接收流式响应块 #{chunk_count}")
-                        
-                    except json.JSONDecodeError as e:
-                        dify_logger.warning(f"解析JSON数据块失败: {str(e)}")
-                        continue
-                    except Exception as e:
-                        dify_logger.warning(f"处理数据块时出错: {str(e)}")
-                        continue
-                        
-            dify_logger.info(f"流式响应完成，共 {chunk_count} 个数据块")
-            
-            return {
-                "event_stream": event_stream,
-                "chunk_count": chunk_count,
-                "accumulated_data": accumulated_data
-            }
+            accumulator = StreamAccumulator()
+            for chunk in self._iter_stream_events(response):
+                accumulator.add(chunk)
+            return accumulator.result()
         except Exception as e:
             dify_logger.error(f"处理流式响应时出错: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Dify流式事件归一化
+
+把不同应用类型的流式事件映射为同一组类型化事件，调用方不再按应用类型解析字典：
+1. chat / completion 的 message，agent 的 agent_message，workflow 的 text_chunk -> DeltaEvent
+2. message_replace -> ReplaceEvent
+3. workflow_started / node_started / node_finished / agent_thought -> ProgressEvent
+4. message_end / workflow_finished 中的用量 -> UsageEvent，结束信息 -> EndEvent
+5. error -> ErrorEvent；ping、tts等与内容无关的事件被忽略
+事件对象使用 __slots__，每个数据块只分配必要的字段
+"""
+
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+
+class StreamEvent:
+    """归一化事件基类"""
+
+    __slots__ = ()
+    kind = 'event'
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class DeltaEvent(StreamEvent):
+    """回复文本的增量"""
+
+    __slots__ = ('text',)
+    kind = 'delta'
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ReplaceEvent(StreamEvent):
+    """用给定文本替换已输出的全部回复（如内容审查替换）"""
+
+    __slots__ = ('text',)
+    kind = 'replace'
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ProgressEvent(StreamEvent):
+    """工作流、节点或工具调用的进度"""
+
+    __slots__ = ('scope', 'id', 'title', 'status', 'elapsed', 'error')
+    kind = 'progress'
+
+    def __init__(self, scope: str, id: str, title: str = "", status: str = 'running',
+                 elapsed: Optional[float] = None, error: Optional[str] = None):
+        """
+        Args:
+            scope: 'workflow'、'node' 或 'tool'
+            id: 工作流运行ID、节点ID或工具调用ID
+            title: 显示名称
+            status: running、succeeded、failed、stopped 或 exception
+            elapsed: 耗时(秒)，结束时提供
+            error: 错误信息
+        """
+        self.scope = scope
+        self.id = id
+        self.title = title
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+
+
+class UsageEvent(StreamEvent):
+    """Token用量"""
+
+    __slots__ = ('prompt_tokens', 'completion_tokens', 'total_tokens', 'latency')
+    kind = 'usage'
+
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0,
+                 latency: Optional[float] = None):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = total_tokens
+        self.latency = latency
+
+
+class EndEvent(StreamEvent):
+    """消息或工作流结束"""
+
+    __slots__ = ('scope', 'status', 'conversation_id', 'message_id', 'outputs', 'elapsed')
+    kind = 'end'
+
+    def __init__(self, scope: str = 'message', status: str = 'succeeded', conversation_id: Optional[str] = None,
+                 message_id: Optional[str] = None, outputs: Optional[Dict[str, Any]] = None,
+                 elapsed: Optional[float] = None):
+        self.scope = scope
+        self.status = status
+        self.conversation_id = conversation_id
+        self.message_id = message_id
+        self.outputs = outputs
+        self.elapsed = elapsed
+
+
+class ErrorEvent(StreamEvent):
+    """流中返回的错误"""
+
+    __slots__ = ('code', 'message', 'status')
+    kind = 'error'
+
+    def __init__(self, message: str, code: Optional[str] = None, status: Optional[int] = None):
+        self.message = message
+        self.code = code
+        self.status = status
+
+
+Events = Tuple[StreamEvent, ...]
+_NONE: Events = ()
+
+
+def _answer_delta(chunk: Dict[str, Any]) -> Events:
+    answer = chunk.get('answer')
+    return (DeltaEvent(answer),) if answer else _NONE
+
+
+def _message_replace(chunk: Dict[str, Any]) -> Events:
+    return (ReplaceEvent(chunk.get('answer') or ""),)
+
+
+def _message_end(chunk: Dict[str, Any]) -> Events:
+    usage = (chunk.get('metadata') or {}).get('usage') or {}
+    end = EndEvent('message', conversation_id=chunk.get('conversation_id'), message_id=chunk.get('message_id'))
+    if not usage:
+        return (end,)
+    return (UsageEvent(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0),
+                       usage.get('total_tokens', 0), usage.get('latency')), end)
+
+
+def _agent_thought(chunk: Dict[str, Any]) -> Events:
+    # 只有工具调用才显示为进度，纯思考内容由 agent_message 输出
+    tool = chunk.get('tool')
+    if not tool:
+        return _NONE
+    status = 'succeeded' if chunk.get('observation') else 'running'
+    return (ProgressEvent('tool', chunk.get('id') or tool, tool, status),)
+
+
+def _workflow_started(chunk: Dict[str, Any]) -> Events:
+    data = chunk.get('data') or {}
+    return (ProgressEvent('workflow', chunk.get('workflow_run_id') or data.get('id') or ""),)
+
+
+def _node_started(chunk: Dict[str, Any]) -> Events:
+    data = chunk.get('data') or {}
+    node_id = data.get('node_id') or data.get('id') or ""
+    return (ProgressEvent('node', node_id, data.get('title') or data.get('node_type') or node_id),)
+
+
+def _node_finished(chunk: Dict[str, Any]) -> Events:
+    data = chunk.get('data') or {}
+    node_id = data.get('node_id') or data.get('id') or ""
+    return (ProgressEvent('node', node_id, data.get('title') or data.get('node_type') or node_id,
+                          data.get('status') or 'succeeded', data.get('elapsed_time'), data.get('error')),)
+
+
+def _text_chunk(chunk: Dict[str, Any]) -> Events:
+    text = (chunk.get('data') or {}).get('text')
+    return (DeltaEvent(text),) if text else _NONE
+
+
+def _workflow_finished(chunk: Dict[str, Any]) -> Events:
+    data = chunk.get('data') or {}
+    status = data.get('status') or 'succeeded'
+    events = []
+    if data.get('total_tokens'):
+        events.append(UsageEvent(total_tokens=data['total_tokens'], latency=data.get('elapsed_time')))
+    if data.get('error'):
+        events.append(ErrorEvent(data['error']))
+    events.append(EndEvent('workflow', status, outputs=data.get('outputs') or {},
+                           elapsed=data.get('elapsed_time')))
+    return tuple(events)
+
+
+def _error(chunk: Dict[str, Any]) -> Events:
+    return (ErrorEvent(chunk.get('message') or "Dify流式响应返回错误", chunk.get('code'), chunk.get('status')),)
+
+
+# Dify事件名 -> 映射函数；未列出的事件被忽略
+EVENT_MAPPERS: Dict[str, Callable[[Dict[str, Any]], Events]] = {
+    'message': _answer_delta,
+    'agent_message': _answer_delta,
+    'message_replace': _message_replace,
+    'message_end': _message_end,
+    'agent_thought': _agent_thought,
+    'workflow_started': _workflow_started,
+    'node_started': _node_started,
+    'node_finished': _node_finished,
+    'text_chunk': _text_chunk,
+    'workflow_finished': _workflow_finished,
+    'error': _error,
+}
+
+
+def normalize_event(chunk: Dict[str, Any]) -> Events:
+    """把一个Dify流式数据块映射为零个或多个归一化事件"""
+    mapper = EVENT_MAPPERS.get(chunk.get('event'))
+    if mapper is not None:
+        return mapper(chunk)
+    # 没有event字段的旧格式数据块只携带answer
+    return _answer_delta(chunk) if 'event' not in chunk else _NONE
+
+
+async def normalize_stream(chunks: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[StreamEvent]:
+    """把异步数据块迭代器转换为归一化事件迭代器"""
+    async for chunk in chunks:
+        for event in normalize_event(chunk):
+            yield event
+
+
+def normalize_stream_sync(chunks: Iterator[Dict[str, Any]]) -> Iterator[StreamEvent]:
+    """把同步数据块迭代器转换为归一化事件迭代器"""
+    for chunk in chunks:
+        yield from normalize_event(chunk)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+问题相似度索引
+
+为回复缓存查找换了说法的相同问题（如"VPN地址是什么"和"vpn 地址是多少"），全部在本地计算，不依赖模型：
+1. 去掉"请问"、"是什么"等不影响问题含义的词，切分为单字和相邻二字的集合
+2. 用MinHash签名近似两个集合的Jaccard相似度
+3. 签名分段(banding)放入LSH桶，只比较至少有一段完全相同的候选，查找耗时与索引大小基本无关
+4. 候选用精确的Jaccard相似度复核，达到阈值才返回
+5. 去掉中性词后两个问题的实义字必须一致，只差一个关键词的问题（"北京/上海办公室的VPN地址"、
+   "打印机怎么连接/断开连接"）字面相似度很高，但不是同一个问题
+问题通常只有几个到十几个字，SimHash的汉明距离在短文本上波动过大，因此使用MinHash
+"""
+
+import re
+import random
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+# 问题末尾不影响语义的标点
+_TRAILING_PUNCTUATION = "?？!！。.～~…,，;；:："
+_WHITESPACE = re.compile(r'\s+')
+# 不影响问题含义的词，长词在前
+QUESTION_FILLERS = (
+    '麻烦问一下', '我想知道', '想问一下', '请问一下', '请问', '请教', '一下', '怎么办', '是怎样',
+    '是什么', '是多少', '是啥', '是哪', '什么', '多少', '怎么样', '怎么', '怎样', '如何',
+    '在哪里', '在哪儿', '在哪', '哪里', '哪儿', '吗', '呢', '啊', '吧', '呀', '的', '了'
+)
+# 同义的写法统一为一种，在去掉不影响含义的词之前替换
+SYNONYMS = (('忘记', '忘'), ('预订', '预定'), ('预约', '预定'), ('丢失', '丢'), ('计算', '算'))
+# 不改变问题所指对象的词，比较实义字时忽略；"公司vpn地址"与"vpn地址"是同一个问题
+NEUTRAL_WORDS = ('流程', '步骤', '方法', '方式', '办法', '公司', '我们', '需要', '可以', '我')
+
+
+def normalize_query(query: str) -> str:
+    """规范化问题文本：全角转半角、统一大小写、去掉空白和末尾标点；中文问题中的空白通常是随意输入的"""
+    text = unicodedata.normalize('NFKC', query or '').lower()
+    return _WHITESPACE.sub('', text).rstrip(_TRAILING_PUNCTUATION)
+
+
+def similarity_text(query: str) -> str:
+    """规范化问题并去掉不影响含义的词"""
+    text = normalize_query(query)
+    for word, replacement in SYNONYMS:
+        if word in text:
+            text = text.replace(word, replacement)
+    for filler in QUESTION_FILLERS:
+        if filler in text:
+            text = text.replace(filler, '')
+    return text
+
+
+def content_chars(text: str) -> FrozenSet[str]:
+    """similarity_text 的结果去掉中性词后的字集合，两个问题只有在该集合相同时才可能是同一个问题"""
+    for word in NEUTRAL_WORDS:
+        if word in text:
+            text = text.replace(word, '')
+    return frozenset(text)
+
+
+def shingles(text: str) -> FrozenSet[str]:
+    """单字和相邻二字的集合；只用二字时语序稍有变化的短问题相似度过低"""
+    items = set(text)
+    items.update(text[i:i + 2] for i in range(len(text) - 1))
+    return frozenset(items)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """两个集合的Jaccard相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """固定种子的MinHash签名，进程重启后签名不变"""
+
+    def __init__(self, num_perm: int = 48, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        # 每个元素只计算一次64位散列，各排列用不同的掩码异或后取最小值，比逐个排列做乘法取模快得多
+        self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+
+    def signature(self, items: FrozenSet[str]) -> Tuple[int, ...]:
+        """计算集合的签名，空集合返回空签名"""
+        if not items:
+            return ()
+        hashes = [int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for item in items]
+        return tuple(min([h ^ mask for h in hashes]) for mask in self._masks)
+
+
+class SimilarityIndex:
+    """MinHash LSH索引：按作用域（应用和输入变量）隔离，条目数有上限"""
+
+    def __init__(self, threshold: float = 0.5, num_perm: int = 48, bands: int = 16, max_entries: int = 1000,
+                 content_guard: bool = True):
+        """
+        初始化索引
+
+        Args:
+            threshold: 返回候选所需的最小Jaccard相似度
+            num_perm: MinHash签名长度
+            bands: 签名分段数，须整除 num_perm；每段行数越少召回越高、候选越多，
+                默认每段3行，相似度0.5的问题成为候选的概率约88%，0.7时超过99%
+            max_entries: 条目数上限，超出时淘汰最久未使用的条目
+            content_guard: 是否要求实义字一致，关闭只用于基准对比
+        """
+        if num_perm % bands:
+            raise ValueError(f"签名长度 {num_perm} 不能被分段数 {bands} 整除")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.content_guard = content_guard
+        self._hasher = MinHasher(num_perm)
+
+        # 键 -> (作用域, 单字和二字集合, 所在的桶, 实义字集合)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[str, FrozenSet[str], List[Tuple], FrozenSet[str]]]" = OrderedDict()
+        # (作用域, 段号, 段内签名) -> 键集合
+        self._buckets: Dict[Tuple, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'lookups': 0,
+            'matches': 0,
+            'candidates': 0,
+            'rejected': 0,
+            'guarded': 0,
+            'evictions': 0
+        }
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[Tuple]:
+        rows = self.rows
+        return [(scope, band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def add(self, key: str, scope: str, query: str):
+        """加入问题，同一键再次加入时替换原有条目"""
+        text = similarity_text(query)
+        items = shingles(text)
+        if not items:
+            return
+        band_keys = self._band_keys(scope, self._hasher.signature(items))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (scope, items, band_keys, content_chars(text))
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def remove(self, key: str):
+        """移除条目"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        """调用方须持有锁"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band_key in entry[2]:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def query(self, scope: str, query: str) -> Optional[Tuple[str, float]]:
+        """
+        查找最相似的问题
+
+        Returns:
+            Optional[Tuple[str, float]]: (键, Jaccard相似度)，没有实义字一致且达到阈值的候选时返回None
+        """
+        text = similarity_text(query)
+        items = shingles(text)
+        if not items:
+            return None
+        content = content_chars(text)
+        band_keys = self._band_keys(scope, self._hasher.signature(items))
+        with self._lock:
+            self._stats['lookups'] += 1
+            candidates = set()
+            for band_key in band_keys:
+                bucket = self._buckets.get(band_key)
+                if bucket:
+                    candidates.update(bucket)
+            self._stats['candidates'] += len(candidates)
+
+            best_key, best_score = None, 0.0
+            guarded = 0
+            for key in candidates:
+                entry = self._entries[key]
+                if self.content_guard and entry[3] != content:
+                    guarded += 1
+                    continue
+                score = jaccard(items, entry[1])
+                if score > best_score:
+                    best_key, best_score = key, score
+            self._stats['guarded'] += guarded
+            if best_key is None or best_score < self.threshold:
+                if candidates:
+                    self._stats['rejected'] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self._stats['matches'] += 1
+        return best_key, best_score
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取索引统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['buckets'] = len(self._buckets)
+        return stats
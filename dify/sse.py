@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+增量SSE解析器
+
+直接处理响应的原始字节块，替代 sseclient + 逐事件 json.loads：
+1. 在同一个缓冲区中查找事件边界，每次输入只压缩一次缓冲区；只使用 \n 换行时按字节查找
+2. 单行 data 事件（Dify的常见格式）直接切出负载，不逐行拆分
+3. 汇总结果时只有出现新字段才逐个合并，不保留事件列表
+4. ping 事件在JSON解码前跳过
+5. 安装了 orjson 时使用其解码器，否则使用标准库 json
+"""
+
+import re
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from utils.logger import dify_logger
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _DecodeError = orjson.JSONDecodeError
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _loads = json.loads
+    _DecodeError = json.JSONDecodeError
+    JSON_BACKEND = "json"
+
+# 事件之间以空行分隔，兼容 \n、\r\n 和 \r 三种换行
+_BOUNDARY = re.compile(rb'\r\n\r\n|\n\n|\r\r')
+_LINE_BREAK = re.compile(rb'\r\n|\n|\r')
+# 边界最长4字节，下次查找从缓冲区末尾回退3字节开始，避免跨块的边界被漏掉
+_BOUNDARY_OVERLAP = 3
+# Dify在 data 中携带的 ping 事件
+_PING_PREFIXES = (b'{"event": "ping"', b'{"event":"ping"')
+
+
+class SSEParser:
+    """按字节块增量解析SSE事件，产出解码后的JSON数据"""
+
+    def __init__(self, logger: logging.Logger = dify_logger):
+        self.logger = logger
+        self._buffer = bytearray()
+        # 缓冲区中尚未查找过边界的起始位置
+        self._scan_from = 0
+        # 是否出现过 \r 换行
+        self._cr = False
+        self.event_count = 0
+        self.ping_count = 0
+        self.error_count = 0
+        self.bytes_received = 0
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """
+        输入一个字节块，返回其中完整事件的解码结果
+
+        Args:
+            data: 响应体的原始字节块，可以在任意位置截断
+        """
+        if not data:
+            return []
+        self.bytes_received += len(data)
+        buffer = self._buffer
+        buffer += data
+        # 只使用 \n 换行时按字节查找边界，出现 \r 后改用正则
+        if not self._cr and b'\r' in data:
+            self._cr = True
+
+        results = []
+        start = 0
+        pos = max(0, self._scan_from - _BOUNDARY_OVERLAP)
+        if self._cr:
+            while True:
+                match = _BOUNDARY.search(buffer, pos)
+                if match is None:
+                    break
+                end = match.start()
+                if end > start:
+                    self._decode_block(buffer, start, end, results)
+                start = pos = match.end()
+        else:
+            find = buffer.find
+            while True:
+                end = find(b'\n\n', pos)
+                if end < 0:
+                    break
+                if end > start:
+                    self._decode_block(buffer, start, end, results)
+                start = pos = end + 2
+
+        if start:
+            del buffer[:start]
+        self._scan_from = len(buffer)
+        return results
+
+    def close(self) -> List[Dict[str, Any]]:
+        """响应结束时处理缓冲区中最后一个没有空行结尾的事件"""
+        results = []
+        buffer = self._buffer
+        if buffer.strip():
+            self._decode_block(buffer, 0, len(buffer), results)
+        buffer.clear()
+        self._scan_from = 0
+        return results
+
+    def _decode_block(self, buffer: bytearray, start: int, end: int, results: List[Dict[str, Any]]):
+        """解析 buffer[start:end] 中的一个事件"""
+        # 常见格式：单行 "data: {...}"，直接切出负载
+        if buffer.startswith(b'data:', start, end) and buffer.find(b'\n', start, end) < 0 \
+                and (not self._cr or buffer.find(b'\r', start, end) < 0):
+            offset = start + 6 if buffer.startswith(b' ', start + 5, end) else start + 5
+            if buffer.startswith(_PING_PREFIXES, offset, end):
+                self.ping_count += 1
+                return
+            payload = buffer[offset:end]
+        else:
+            payload = self._extract_data(buffer[start:end])
+            if payload is None:
+                return
+            if payload.startswith(_PING_PREFIXES):
+                self.ping_count += 1
+                return
+        try:
+            results.append(_loads(payload))
+            self.event_count += 1
+        except _DecodeError as e:
+            self.error_count += 1
+            self.logger.warning(f"解析JSON数据块失败: {str(e)}")
+
+    def _extract_data(self, block: bytearray) -> Optional[bytes]:
+        """逐行取出多行事件的 data 字段，ping、注释和没有 data 的事件返回None"""
+        data_lines = []
+        for line in _LINE_BREAK.split(block):
+            if line.startswith(b'data:'):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(b' ') else value)
+            elif line.startswith(b'event:') and line[6:].strip() == b'ping':
+                self.ping_count += 1
+                return None
+            # 注释行、id 和 retry 字段与内容无关
+        if not data_lines:
+            return None
+        payload = b'\n'.join(data_lines)
+        return payload if payload.strip() else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取解析统计信息"""
+        return {
+            'json_backend': JSON_BACKEND,
+            'events': self.event_count,
+            'pings': self.ping_count,
+            'errors': self.error_count,
+            'bytes': self.bytes_received
+        }
+
+
+class StreamAccumulator:
+    """把流式事件汇总为非流式调用的返回格式，不保留事件列表"""
+
+    def __init__(self):
+        self._answer: List[str] = []
+        # answer 占位，使已知字段的判断不必逐个检查
+        self._fields: Dict[str, Any] = {"answer": None}
+        self.chunk_count = 0
+
+    def add(self, chunk: Dict[str, Any]):
+        """合并一个事件：answer 拼接，其余字段保留首次出现的值"""
+        self.chunk_count += 1
+        answer = chunk.get("answer")
+        if answer:
+            self._answer.append(answer)
+        fields = self._fields
+        # 同类事件的字段集合相同，只有出现新字段时才逐个合并
+        if not chunk.keys() <= fields.keys():
+            for key, value in chunk.items():
+                if key not in fields:
+                    fields[key] = value
+
+    def result(self) -> Dict[str, Any]:
+        """返回 {'chunk_count': 事件数, 'accumulated_data': 汇总后的字段}"""
+        accumulated_data = dict(self._fields)
+        accumulated_data["answer"] = ''.join(self._answer)  # 确保answer字段始终存在
+        return {
+            "chunk_count": self.chunk_count,
+            "accumulated_data": accumulated_data
+        }
+
+
+def iter_sse_events(chunks: Iterable[bytes], parser: Optional[SSEParser] = None) -> Iterator[Dict[str, Any]]:
+    """从同步字节块迭代器中逐个产出事件"""
+    parser = parser or SSEParser()
+    for data in chunks:
+        yield from parser.feed(data)
+    yield from parser.close()
+
+
+async def aiter_sse_events(chunks: AsyncIterator[bytes], parser: Optional[SSEParser] = None) -> AsyncIterator[Dict[str, Any]]:
+    """从异步字节块迭代器中逐个产出事件"""
+    parser = parser or SSEParser()
+    async for data in chunks:
+        for event in parser.feed(data):
+            yield event
+    for event in parser.close():
+        yield event
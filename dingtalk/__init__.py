@@ -1,4 +1,11 @@
 from .auth import DingTalkAuth
 from .client import DingTalkClient
+from .token_manager import TokenManager, get_token_manager
+from .user_directory import UserDirectory, get_user_directory
+from .drive_cache import DriveMetadataCache, get_drive_cache
+from .media_stream import RobotMediaStream
+from .multipart_upload import MultipartUploader
 
-__all__ = ['DingTalkAuth', 'DingTalkClient'] 
+__all__ = ['DingTalkAuth', 'DingTalkClient', 'TokenManager', 'get_token_manager',
+           'UserDirectory', 'get_user_directory', 'DriveMetadataCache', 'get_drive_cache',
+           'RobotMediaStream', 'MultipartUploader'] 
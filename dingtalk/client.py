@@ -1,4 +1,3 @@
-import requests
 import json
 import time
 import ssl
@@ -6,11 +5,11 @@ import sys
 import os
 import urllib3
 from typing import Dict, Any, List, Optional
-from requests.adapters import HTTPAdapter
 from .auth import DingTalkAuth, create_custom_ssl_context
 # 修复导入路径，使用相对导入
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger import dingtalk_logger, log_request, log_response
+from utils.http_transport import get_transport
 
 # 禁用SSL警告
 urllib3.disable_warnings()
@@ -41,32 +40,17 @@ class DingTalkClient:
         
         start_time = time.time()
         try:
-            # 创建会话对象
-            session = requests.Session()
-            session.verify = False
-            
-            # 优化连接池设置
-            adapter = HTTPAdapter(
-                pool_connections=5,  # 连接池连接数
-                pool_maxsize=5,      # 连接池最大连接数
-                max_retries=5,        # 最大重试次数
-                pool_block=False      # 连接池用尽时不阻塞
-            )
-            session.mount('http://', adapter)
-            session.mount('https://', adapter)
-            
             # 增强请求头
             headers_extended = headers.copy()
             headers_extended.update({
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.75 Safari/537.36",
-                "Accept": "*/*",
-                "Connection": "close"
+                "Accept": "*/*"
             })
             
             # 添加重试机制
             for retry in range(5):
                 try:
-                    response = session.post(url, headers=headers_extended, json=data, timeout=30)
+                    response = get_transport().post(url, headers=headers_extended, json=data, timeout=30)
                     if response.status_code == 200:
                         break
                 except Exception as e:
@@ -121,32 +105,17 @@ class DingTalkClient:
         
         start_time = time.time()
         try:
-            # 创建会话对象
-            session = requests.Session()
-            session.verify = False
-            
-            # 优化连接池设置
-            adapter = HTTPAdapter(
-                pool_connections=5,  # 连接池连接数
-                pool_maxsize=5,      # 连接池最大连接数
-                max_retries=5,        # 最大重试次数
-                pool_block=False      # 连接池用尽时不阻塞
-            )
-            session.mount('http://', adapter)
-            session.mount('https://', adapter)
-            
             # 适配各种网络环境的请求头
             headers_extended = headers.copy()
             headers_extended.update({
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.75 Safari/537.36",
-                "Accept": "*/*",
-                "Connection": "close"
+                "Accept": "*/*"
             })
             
             # 增加重试次数和间隔
             for retry in range(5):
                 try:
-                    response = session.post(url, headers=headers_extended, json=data, timeout=30)
+                    response = get_transport().post(url, headers=headers_extended, json=data, timeout=30)
                     if response.status_code == 200:
                         break
                 except Exception as e:
@@ -205,32 +174,17 @@ class DingTalkClient:
         
         start_time = time.time()
         try:
-            # 创建会话对象
-            session = requests.Session()
-            session.verify = False
-            
-            # 优化连接池设置
-            adapter = HTTPAdapter(
-                pool_connections=5,  # 连接池连接数
-                pool_maxsize=5,      # 连接池最大连接数
-                max_retries=5,        # 最大重试次数
-                pool_block=False      # 连接池用尽时不阻塞
-            )
-            session.mount('http://', adapter)
-            session.mount('https://', adapter)
-            
             # 增强请求头
             headers_extended = headers.copy()
             headers_extended.update({
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.75 Safari/537.36",
-                "Accept": "*/*",
-                "Connection": "close"
+                "Accept": "*/*"
             })
             
             # 添加重试机制
             for retry in range(5):
                 try:
-                    response = session.post(url, headers=headers_extended, json=data, timeout=30)
+                    response = get_transport().post(url, headers=headers_extended, json=data, timeout=30)
                     if response.status_code == 200:
                         break
                 except Exception as e:
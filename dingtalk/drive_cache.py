@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+钉钉云盘元数据缓存
+
+按 unionId 和空间缓存云盘元数据，减少上传和下载路径上的串行接口调用：
+1. 工作空间ID，上传时无需每次查询
+2. 按目录的 文件名 -> dentry 索引，由本服务的提交和删除操作实时维护
+3. 预签名下载地址，缓存到过期前的安全时间
+4. 统计各类缓存的命中情况
+"""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config.settings import settings
+from utils.logger import dingtalk_logger
+
+
+class DriveMetadataCache:
+    """钉钉云盘元数据缓存"""
+
+    def __init__(self, space_ttl: float = 86400, index_ttl: float = 600,
+                 url_ttl: float = 900, url_safety_margin: float = 60,
+                 max_entries: int = 10000, logger: logging.Logger = dingtalk_logger):
+        """
+        初始化缓存
+
+        Args:
+            space_ttl: 工作空间ID的有效期(秒)
+            index_ttl: 目录索引的有效期(秒)，过期后重新列举，以感知他人在云盘中的修改
+            url_ttl: 接口未返回有效期时，下载地址的默认有效期(秒)
+            url_safety_margin: 下载地址在过期前多少秒失效，避免拿到即将过期的地址
+            max_entries: 每类缓存的条目数上限，超出时淘汰最久未使用的条目
+            logger: 日志记录器
+        """
+        self.space_ttl = space_ttl
+        self.index_ttl = index_ttl
+        self.url_ttl = url_ttl
+        self.url_safety_margin = url_safety_margin
+        self.max_entries = max_entries
+        self.logger = logger
+
+        # (unionId, 空间类型) -> (过期时间, 空间ID)
+        self._spaces: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        # (unionId, 空间ID, 父目录ID) -> (过期时间, 是否完整, {文件名: dentry})
+        self._indexes: "OrderedDict[Tuple[str, str, str], Tuple[float, bool, Dict[str, Dict[str, Any]]]]" = OrderedDict()
+        # (unionId, 空间ID, 文件ID) -> (过期时间, 下载信息)
+        self._urls: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'space_hits': 0,
+            'space_misses': 0,
+            'dentry_hits': 0,
+            'dentry_misses': 0,
+            'url_hits': 0,
+            'url_misses': 0
+        }
+
+    def _get(self, table: OrderedDict, key: Tuple, stat: str) -> Optional[Tuple]:
+        """读取未过期的条目并更新LRU顺序"""
+        with self._lock:
+            entry = table.get(key)
+            if entry is not None and entry[0] > time.time():
+                table.move_to_end(key)
+                self._stats[f'{stat}_hits'] += 1
+                return entry
+            if entry is not None:
+                del table[key]
+            self._stats[f'{stat}_misses'] += 1
+            return None
+
+    def _put(self, table: OrderedDict, key: Tuple, entry: Tuple):
+        with self._lock:
+            table[key] = entry
+            table.move_to_end(key)
+            while len(table) > self.max_entries:
+                table.popitem(last=False)
+
+    # 工作空间
+
+    def get_space(self, union_id: str, space_type: str = "org") -> Optional[str]:
+        entry = self._get(self._spaces, (union_id, space_type), 'space')
+        return entry[1] if entry else None
+
+    def put_space(self, union_id: str, space_id: str, space_type: str = "org"):
+        self._put(self._spaces, (union_id, space_type), (time.time() + self.space_ttl, space_id))
+
+    def invalidate_space(self, union_id: str, space_type: str = "org"):
+        """空间失效（如接口返回空间不存在）时调用"""
+        with self._lock:
+            self._spaces.pop((union_id, space_type), None)
+
+    # 目录索引
+
+    def lookup_dentry(self, union_id: str, space_id: str, parent_id: str,
+                      name: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        在目录索引中按文件名查找
+
+        Returns:
+            Tuple[bool, Optional[Dict]]: (结果是否可信, dentry)。
+            索引完整时找不到也是可信结果；索引缺失或不完整且未找到时需要调用方列举目录
+        """
+        entry = self._get(self._indexes, (union_id, space_id, parent_id), 'dentry')
+        if entry is None:
+            return False, None
+        _, complete, names = entry
+        dentry = names.get(name)
+        if dentry is not None:
+            return True, dentry
+        return complete, None
+
+    def put_listing(self, union_id: str, space_id: str, parent_id: str,
+                    dentries: Iterable[Dict[str, Any]], complete: bool = True):
+        """用目录列举结果重建索引"""
+        names = {dentry['name']: dentry for dentry in dentries if dentry.get('name')}
+        self._put(self._indexes, (union_id, space_id, parent_id),
+                  (time.time() + self.index_ttl, complete, names))
+
+    def record_commit(self, union_id: str, space_id: str, parent_id: str, dentry: Dict[str, Any]):
+        """提交文件后更新目录索引；同名覆盖时旧文件的下载地址一并失效"""
+        key = (union_id, space_id, parent_id)
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is None:
+                # 尚未列举过的目录先建立不完整的索引，刚上传的文件可直接命中
+                entry = (time.time() + self.index_ttl, False, {})
+                self._indexes[key] = entry
+            if dentry.get('name'):
+                previous = entry[2].get(dentry['name'])
+                entry[2][dentry['name']] = dentry
+                if previous is not None and previous.get('id') != dentry.get('id'):
+                    self._urls.pop((union_id, space_id, str(previous.get('id'))), None)
+            self._urls.pop((union_id, space_id, str(dentry.get('id'))), None)
+
+    def record_delete(self, union_id: str, space_id: str, file_id: str):
+        """删除文件后从所有目录索引中移除，并使下载地址失效"""
+        with self._lock:
+            for (index_union_id, index_space_id, _), (_, _, names) in self._indexes.items():
+                if index_union_id != union_id or index_space_id != space_id:
+                    continue
+                for name, dentry in list(names.items()):
+                    if str(dentry.get('id')) == str(file_id):
+                        del names[name]
+            self._urls.pop((union_id, space_id, str(file_id)), None)
+
+    # 下载地址
+
+    def get_download_info(self, union_id: str, space_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._get(self._urls, (union_id, space_id, str(file_id)), 'url')
+        return entry[1] if entry else None
+
+    def put_download_info(self, union_id: str, space_id: str, file_id: str,
+                          info: Dict[str, Any], expires_in: Optional[float] = None):
+        """
+        缓存下载信息
+
+        Args:
+            info: 下载地址和签名请求头
+            expires_in: 接口返回的有效期(秒)，为空时使用 url_ttl
+        """
+        ttl = (expires_in or self.url_ttl) - self.url_safety_margin
+        if ttl <= 0:
+            return
+        self._put(self._urls, (union_id, space_id, str(file_id)), (time.time() + ttl, info))
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取缓存统计信息"""
+        stats = dict(self._stats)
+        stats['spaces'] = len(self._spaces)
+        stats['indexes'] = len(self._indexes)
+        stats['urls'] = len(self._urls)
+        return stats
+
+
+_cache: Optional[DriveMetadataCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_drive_cache() -> DriveMetadataCache:
+    """获取进程内共享的云盘元数据缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DriveMetadataCache(
+                    space_ttl=settings.DRIVE_SPACE_CACHE_TTL,
+                    index_ttl=settings.DRIVE_INDEX_CACHE_TTL,
+                    url_ttl=settings.DRIVE_URL_CACHE_TTL
+                )
+    return _cache
@@ -5,17 +5,19 @@
 钉钉云盘服务
 
 负责文件上传到钉钉云盘的核心逻辑
-基于钉钉官方Storage 2.0 API实现
+基于钉钉官方Storage 2.0 API实现，工作空间ID、目录索引和下载地址经由元数据缓存复用
 """
 
 import os
 import tempfile
 import logging
-import requests
 import json
-import time
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Union
 from .auth import DingTalkAuth
+from .drive_cache import get_drive_cache
+from .multipart_upload import MultipartUploader
+from config.settings import settings
+from utils.http_transport import get_transport
 
 
 class DingTalkDriveService:
@@ -27,15 +29,25 @@ class DingTalkDriveService:
         self.auth = DingTalkAuth(client_id, client_secret)
         self.logger = logger or logging.getLogger(__name__)
         self.base_url = "https://api.dingtalk.com/v1.0"
+        self.cache = get_drive_cache()
+        self.multipart_threshold = settings.DINGTALK_DRIVE_MULTIPART_THRESHOLD_MB * 1024 * 1024
+        self.multipart = MultipartUploader(
+            self,
+            part_size=settings.DINGTALK_DRIVE_PART_SIZE_MB * 1024 * 1024,
+            concurrency=settings.DINGTALK_DRIVE_PART_CONCURRENCY,
+            max_retries=settings.MAX_RETRIES,
+            logger=self.logger
+        )
     
-    async def upload_file(self, file_name: str, file_size: int, union_id: str, file_content: bytes = None) -> Dict[str, Any]:
+    async def upload_file(self, file_name: str, file_size: int, union_id: str,
+                          file_content: Union[bytes, AsyncIterator[bytes], None] = None) -> Dict[str, Any]:
         """上传文件到钉钉云盘
         
         Args:
             file_name: 文件名
             file_size: 文件大小（字节）
             union_id: 用户unionId
-            file_content: 文件内容（可选，如果不提供则创建占位文件）
+            file_content: 文件内容，可以是字节或异步字节流（可选，如果不提供则创建占位文件）
             
         Returns:
             上传结果字典
@@ -48,11 +60,20 @@ class DingTalkDriveService:
             if not access_token:
                 return {'success': False, 'error': '无法获取访问令牌'}
             
-            # 获取工作空间
+            # 获取工作空间（优先使用缓存）
             space_id = await self._get_workspace(union_id, access_token)
             if not space_id:
                 return {'success': False, 'error': '无法获取工作空间'}
             
+            # 大文件的字节流分片并行上传，单个分片失败只重传该分片
+            if file_content is not None and not isinstance(file_content, (bytes, bytearray)) \
+                    and file_size >= self.multipart_threshold:
+                upload_result = await self.multipart.upload_stream(file_content, file_name, file_size, union_id, space_id)
+                if not upload_result['success']:
+                    return {'success': False, 'error': upload_result['error']}
+                return await self._finish_upload(union_id, space_id, upload_result['upload_key'],
+                                                 file_name, file_size, access_token)
+            
             # 获取文件上传信息
             upload_info = await self._get_upload_info(union_id, space_id, file_name, file_size, access_token)
             if not upload_info:
@@ -63,33 +84,38 @@ class DingTalkDriveService:
                 upload_info['resource_url'], 
                 upload_info['headers'], 
                 file_name, 
-                file_content
+                file_content,
+                file_size
             )
             
             if not upload_result['success']:
                 return {'success': False, 'error': upload_result['error']}
             
-            # 提交文件信息
-            commit_result = await self._commit_file(
-                union_id, space_id, upload_info['upload_key'], 
-                file_name, file_size, access_token
-            )
-            
-            if commit_result['success']:
-                self.logger.info(f"文件上传成功: {file_name}")
-                return {
-                    'success': True, 
-                    'doc_url': commit_result['doc_url'],
-                    'file_id': commit_result['file_id'],
-                    'space_id': space_id
-                }
-            else:
-                return {'success': False, 'error': commit_result['error']}
+            return await self._finish_upload(union_id, space_id, upload_info['upload_key'],
+                                             file_name, file_size, access_token)
                 
         except Exception as e:
             self.logger.error(f"上传文件到钉钉云盘失败: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    async def _finish_upload(self, union_id: str, space_id: str, upload_key: str, file_name: str,
+                             file_size: int, access_token: str) -> Dict[str, Any]:
+        """提交文件信息并更新目录索引"""
+        commit_result = await self._commit_file(union_id, space_id, upload_key, file_name, file_size, access_token)
+        
+        if commit_result['success']:
+            # 提交未指定父目录，文件位于空间根目录
+            self.cache.record_commit(union_id, space_id, "0", commit_result['dentry'])
+            self.logger.info(f"文件上传成功: {file_name}")
+            return {
+                'success': True, 
+                'doc_url': commit_result['doc_url'],
+                'file_id': commit_result['file_id'],
+                'space_id': space_id
+            }
+        else:
+            return {'success': False, 'error': commit_result['error']}
+    
     async def get_file_info(self, file_id: str, space_id: str, union_id: str) -> Dict[str, Any]:
         """获取文件信息"""
         try:
@@ -104,7 +130,7 @@ class DingTalkDriveService:
             }
             params = {"unionId": union_id}
             
-            response = requests.get(url, headers=headers, params=params, timeout=10, verify=False)
+            response = get_transport().get(url, headers=headers, params=params, timeout=10)
             result = response.json()
             
             if response.status_code == 200:
@@ -130,9 +156,10 @@ class DingTalkDriveService:
             }
             data = {"unionId": union_id}
             
-            response = requests.delete(url, headers=headers, json=data, timeout=10, verify=False)
+            response = get_transport().delete(url, headers=headers, json=data, timeout=10)
             
             if response.status_code == 200:
+                self.cache.record_delete(union_id, space_id, file_id)
                 return {'success': True}
             else:
                 result = response.json()
@@ -160,11 +187,11 @@ class DingTalkDriveService:
                 "maxResults": max_results
             }
             
-            response = requests.get(url, headers=headers, params=params, timeout=10, verify=False)
+            response = get_transport().get(url, headers=headers, params=params, timeout=10)
             result = response.json()
             
             if response.status_code == 200:
-                return {'success': True, 'files': result.get('dentries', [])}
+                return {'success': True, 'files': result.get('dentries', []), 'next_token': result.get('nextToken')}
             else:
                 return {'success': False, 'error': f'列出文件失败: {result}'}
                 
@@ -172,6 +199,36 @@ class DingTalkDriveService:
             self.logger.error(f"列出文件失败: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    async def _list_all_files(self, space_id: str, union_id: str, parent_id: str, access_token: str) -> Optional[List[Dict[str, Any]]]:
+        """分页列出目录下的全部文件，并重建该目录的缓存索引"""
+        url = f"{self.base_url}/storage/spaces/{space_id}/files"
+        headers = {
+            "x-acs-dingtalk-access-token": access_token,
+            "Content-Type": "application/json"
+        }
+        params = {
+            "unionId": union_id,
+            "parentId": parent_id,
+            "maxResults": 50
+        }
+        dentries = []
+        
+        while True:
+            response = get_transport().get(url, headers=headers, params=params, timeout=10)
+            result = response.json()
+            if response.status_code != 200:
+                self.logger.error(f"列出文件失败: {result}")
+                return None
+            
+            dentries.extend(result.get('dentries', []))
+            next_token = result.get('nextToken')
+            if not next_token:
+                break
+            params['nextToken'] = next_token
+        
+        self.cache.put_listing(union_id, space_id, parent_id, dentries, complete=True)
+        return dentries
+    
     async def download_file_content(self, file_id: str, space_id: str, union_id: str) -> Optional[bytes]:
         """下载文件内容"""
         try:
@@ -180,18 +237,19 @@ class DingTalkDriveService:
                 self.logger.error("无法获取访问令牌")
                 return None
             
-            # 获取文件下载地址
-            download_url = self.get_file_download_url(file_id, space_id, union_id, access_token)
-            if not download_url:
+            # 获取文件下载地址（未过期时使用缓存）
+            download_info = self._get_download_info(file_id, space_id, union_id, access_token)
+            if not download_info:
                 self.logger.error("无法获取文件下载地址")
                 return None
             
-            # 下载文件内容
+            # 下载文件内容，签名请求头与下载地址一起下发
             headers = {
-                "x-acs-dingtalk-access-token": access_token
+                "x-acs-dingtalk-access-token": access_token,
+                **download_info['headers']
             }
             
-            response = requests.get(download_url, headers=headers, timeout=60, verify=False)
+            response = get_transport().get(download_info['url'], headers=headers, timeout=60)
             if response.status_code == 200:
                 self.logger.info(f"文件内容下载成功: {file_id}")
                 return response.content
@@ -203,20 +261,23 @@ class DingTalkDriveService:
             self.logger.error(f"下载文件内容失败: {str(e)}")
             return None
     
-    async def get_file_by_name(self, file_name: str, space_id: str, union_id: str) -> Optional[Dict[str, Any]]:
-        """根据文件名查找文件"""
+    async def get_file_by_name(self, file_name: str, space_id: str, union_id: str, parent_id: str = "0") -> Optional[Dict[str, Any]]:
+        """根据文件名查找文件，优先查询目录索引缓存"""
         try:
+            trusted, dentry = self.cache.lookup_dentry(union_id, space_id, parent_id, file_name)
+            if trusted:
+                return dentry
+            
             access_token = await self._get_access_token()
             if not access_token:
                 return None
             
-            # 列出文件
-            files_result = await self.list_files(space_id, union_id)
-            if not files_result['success']:
+            # 索引缺失或不完整时列举整个目录
+            dentries = await self._list_all_files(space_id, union_id, parent_id, access_token)
+            if dentries is None:
                 return None
             
-            # 查找匹配的文件
-            for file_info in files_result['files']:
+            for file_info in dentries:
                 if file_info.get('name') == file_name:
                     return file_info
             
@@ -229,13 +290,17 @@ class DingTalkDriveService:
     async def _get_access_token(self) -> Optional[str]:
         """获取钉钉访问令牌"""
         try:
-            return self.auth.get_access_token()
+            return await self.auth.get_access_token_async()
         except Exception as e:
             self.logger.error(f"获取访问令牌失败: {str(e)}")
             return None
     
     async def _get_workspace(self, union_id: str, access_token: str) -> Optional[str]:
-        """获取工作空间ID"""
+        """获取工作空间ID，缓存命中时不调用接口"""
+        space_id = self.cache.get_space(union_id)
+        if space_id:
+            return space_id
+        
         try:
             url = f"{self.base_url}/drive/spaces"
             headers = {
@@ -247,12 +312,13 @@ class DingTalkDriveService:
                 "spaceType": "org"
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
+            response = get_transport().post(url, headers=headers, json=data, timeout=10)
             result = response.json()
             
             if response.status_code == 200 and result.get('spaces'):
                 # 返回第一个工作空间ID
                 space_id = result['spaces'][0]['spaceId']
+                self.cache.put_space(union_id, space_id)
                 self.logger.info(f"获取到工作空间ID: {space_id}")
                 return space_id
             else:
@@ -281,7 +347,7 @@ class DingTalkDriveService:
                 }
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
+            response = get_transport().post(url, headers=headers, json=data, timeout=10)
             result = response.json()
             
             if response.status_code == 200 and result.get('headerSignatureInfo'):
@@ -301,27 +367,25 @@ class DingTalkDriveService:
             self.logger.error(f"获取上传信息异常: {str(e)}")
             return None
     
-    async def _upload_to_resource(self, resource_url: str, headers: Dict[str, str], file_name: str, file_content: bytes = None) -> Dict[str, Any]:
+    async def _upload_to_resource(self, resource_url: str, headers: Dict[str, str], file_name: str,
+                                  file_content: Union[bytes, AsyncIterator[bytes], None] = None,
+                                  file_size: int = 0) -> Dict[str, Any]:
         """上传文件到资源服务器"""
         try:
             # 如果没有提供文件内容，创建一个占位文件
             if file_content is None:
                 file_content = b"File content placeholder for " + file_name.encode('utf-8')
             
-            # 使用PUT方法上传文件
-            session = requests.Session()
-            session.verify = False
-            
-            # 设置请求头
-            for key, value in headers.items():
-                session.headers[key] = value
+            if not isinstance(file_content, (bytes, bytearray)):
+                return await self._stream_to_resource(resource_url, headers, file_name, file_content, file_size)
             
-            # 上传文件
-            response = session.put(
+            # 使用PUT方法上传文件
+            # 上传文件，签名请求头与内容类型一起发送
+            response = get_transport().put(
                 resource_url, 
                 data=file_content, 
                 timeout=60,
-                headers={'Content-Type': 'application/octet-stream'}
+                headers={**headers, 'Content-Type': 'application/octet-stream'}
             )
             
             if response.status_code == 200:
@@ -336,6 +400,21 @@ class DingTalkDriveService:
             self.logger.error(f"上传到资源服务器失败: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    async def _stream_to_resource(self, resource_url: str, headers: Dict[str, str], file_name: str,
+                                  chunks: AsyncIterator[bytes], file_size: int) -> Dict[str, Any]:
+        """把字节流边读边上传到资源服务器，已知大小时声明长度，否则使用分块传输"""
+        put_headers = {**headers, 'Content-Type': 'application/octet-stream'}
+        if file_size:
+            put_headers['Content-Length'] = str(file_size)
+        
+        async with get_transport().async_session().put(resource_url, data=chunks, headers=put_headers) as response:
+            if response.status == 200:
+                self.logger.info(f"文件流式上传到资源服务器成功: {file_name}")
+                return {'success': True}
+            error_msg = f'上传失败，状态码: {response.status}'
+            self.logger.error(f"文件上传到资源服务器失败: {error_msg}, {await response.text()}")
+            return {'success': False, 'error': error_msg}
+    
     async def _commit_file(self, union_id: str, space_id: str, upload_key: str, file_name: str, file_size: int, access_token: str) -> Dict[str, Any]:
         """提交文件信息"""
         try:
@@ -355,7 +434,7 @@ class DingTalkDriveService:
                 }
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
+            response = get_transport().post(url, headers=headers, json=data, timeout=10)
             result = response.json()
             
             if response.status_code == 200 and result.get('dentry'):
@@ -364,7 +443,8 @@ class DingTalkDriveService:
                 commit_result = {
                     'success': True,
                     'doc_url': doc_url,
-                    'file_id': dentry['id']
+                    'file_id': dentry['id'],
+                    'dentry': dentry
                 }
                 self.logger.info(f"文件提交成功: {commit_result}")
                 return commit_result
@@ -379,6 +459,15 @@ class DingTalkDriveService:
     
     def get_file_download_url(self, file_id: str, space_id: str, union_id: str, access_token: str) -> Optional[str]:
         """获取文件下载地址（同步方法）"""
+        download_info = self._get_download_info(file_id, space_id, union_id, access_token)
+        return download_info['url'] if download_info else None
+    
+    def _get_download_info(self, file_id: str, space_id: str, union_id: str, access_token: str) -> Optional[Dict[str, Any]]:
+        """获取下载地址和签名请求头，缓存到地址过期前"""
+        download_info = self.cache.get_download_info(union_id, space_id, file_id)
+        if download_info:
+            return download_info
+        
         try:
             url = f"{self.base_url}/storage/spaces/{space_id}/files/{file_id}/downloadInfos"
             headers = {
@@ -387,14 +476,18 @@ class DingTalkDriveService:
             }
             data = {"unionId": union_id}
             
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
+            response = get_transport().post(url, headers=headers, json=data, timeout=10)
             result = response.json()
             
             if response.status_code == 200 and result.get('headerSignatureInfo'):
                 info = result['headerSignatureInfo']
-                download_url = info['resourceUrls'][0]
-                self.logger.info(f"获取文件下载地址成功: {download_url}")
-                return download_url
+                download_info = {
+                    'url': info['resourceUrls'][0],
+                    'headers': info.get('headers', {})
+                }
+                self.cache.put_download_info(union_id, space_id, file_id, download_info, info.get('expirationSeconds'))
+                self.logger.info(f"获取文件下载地址成功: {download_info['url']}")
+                return download_info
             else:
                 self.logger.error(f"获取文件下载地址失败: {result}")
                 return None
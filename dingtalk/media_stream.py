@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+钉钉机器人消息文件的流式下载
+
+根据消息中的 downloadCode 换取下载地址，按块读取文件内容：
+1. 不把整个文件读入内存，调用方边读边处理
+2. 通过共享传输层的异步连接池下载
+3. 响应头中的文件大小随数据流一起返回，供上传时声明长度
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from utils.logger import dingtalk_logger
+from utils.http_transport import get_transport
+from dingtalk.token_manager import get_token_manager
+
+DOWNLOAD_URL_API = "https://api.dingtalk.com/v1.0/robot/messageFiles/download"
+
+
+class RobotMediaStream:
+    """机器人消息文件的流式下载器"""
+
+    def __init__(self, client_id: str, client_secret: str, chunk_size: int = 64 * 1024,
+                 logger: logging.Logger = dingtalk_logger):
+        """
+        初始化下载器
+
+        Args:
+            client_id: 钉钉应用的ClientID，同时作为robotCode
+            client_secret: 钉钉应用的ClientSecret
+            chunk_size: 每次读取的数据块大小(字节)
+            logger: 日志记录器
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.chunk_size = chunk_size
+        self.logger = logger
+
+    async def get_download_url(self, download_code: str) -> Optional[str]:
+        """用 downloadCode 换取文件下载地址"""
+        try:
+            access_token = await get_token_manager(self.client_id, self.client_secret).get_token_async()
+            headers = {
+                "x-acs-dingtalk-access-token": access_token,
+                "Content-Type": "application/json"
+            }
+            data = {"downloadCode": download_code, "robotCode": self.client_id}
+
+            async with get_transport().async_session().post(DOWNLOAD_URL_API, json=data, headers=headers) as response:
+                result = await response.json(content_type=None)
+                if response.status == 200 and result.get('downloadUrl'):
+                    return result['downloadUrl']
+                self.logger.error(f"获取消息文件下载地址失败: {result}")
+                return None
+
+        except Exception as e:
+            self.logger.error(f"获取消息文件下载地址异常: {str(e)}")
+            return None
+
+    @asynccontextmanager
+    async def open(self, download_code: str) -> AsyncIterator[Tuple[int, AsyncIterator[bytes]]]:
+        """
+        打开消息文件的下载流
+
+        Args:
+            download_code: 消息中的 downloadCode
+
+        Yields:
+            Tuple[int, AsyncIterator[bytes]]: (文件大小，响应未声明时为0, 数据块迭代器)
+
+        Raises:
+            Exception: 无法获取下载地址或下载请求失败
+        """
+        download_url = await self.get_download_url(download_code)
+        if not download_url:
+            raise Exception("无法获取消息文件下载地址")
+
+        async with get_transport().async_session().get(download_url) as response:
+            if response.status != 200:
+                raise Exception(f"消息文件下载失败，状态码: {response.status}")
+            size = response.content_length or 0
+            self.logger.info(f"开始流式下载消息文件: 大小={size}字节, 块大小={self.chunk_size}字节")
+            yield size, response.content.iter_chunked(self.chunk_size)
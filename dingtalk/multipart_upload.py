@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+钉钉云盘分片上传
+
+基于 Storage 2.0 分片上传接口，把大文件拆成固定大小的分片上传：
+1. 多个分片并行上传，并发数有上限
+2. 单个分片失败只重试该分片，重试前重新获取签名
+3. 异步字节流按顺序切片上传，内存中最多保留并发数+1个分片
+"""
+
+import asyncio
+import logging
+import aiohttp
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from utils.http_transport import get_transport
+
+if TYPE_CHECKING:
+    from .drive_service import DingTalkDriveService
+
+# 单次获取分片签名的最大分片数
+SIGN_BATCH_SIZE = 20
+
+
+class MultipartUploader:
+    """钉钉云盘分片上传器"""
+
+    def __init__(self, service: "DingTalkDriveService", part_size: int = 5 * 1024 * 1024,
+                 concurrency: int = 3, max_retries: int = 3, part_timeout: float = 120,
+                 logger: Optional[logging.Logger] = None):
+        """
+        初始化分片上传器
+
+        Args:
+            service: 云盘服务，提供接口地址和访问令牌
+            part_size: 分片大小(字节)
+            concurrency: 并行上传的分片数上限
+            max_retries: 单个分片的最大尝试次数
+            part_timeout: 单个分片的上传超时(秒)
+            logger: 日志记录器
+        """
+        self.service = service
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(1, max_retries)
+        self.part_timeout = aiohttp.ClientTimeout(total=part_timeout)
+        self.logger = logger or service.logger
+
+    def part_count(self, file_size: int) -> int:
+        return max(1, (file_size + self.part_size - 1) // self.part_size)
+
+    # 接口调用
+
+    def _headers(self, access_token: str) -> Dict[str, str]:
+        return {
+            "x-acs-dingtalk-access-token": access_token,
+            "Content-Type": "application/json"
+        }
+
+    async def _init_upload(self, space_id: str, union_id: str, file_name: str, file_size: int,
+                           access_token: str) -> Optional[str]:
+        """初始化分片上传，返回uploadKey"""
+        url = f"{self.service.base_url}/storage/spaces/{space_id}/files/multiPartUploadInfos/init"
+        data = {
+            "option": {
+                "storageDriver": "DINGTALK",
+                "preCheckParam": {"size": file_size, "name": file_name}
+            }
+        }
+        response = get_transport().post(url, headers=self._headers(access_token), params={"unionId": union_id},
+                                        json=data, timeout=10)
+        result = response.json()
+        if response.status_code == 200 and result.get('uploadKey'):
+            return result['uploadKey']
+        self.logger.error(f"初始化分片上传失败: {result}")
+        return None
+
+    async def _get_part_infos(self, space_id: str, union_id: str, upload_key: str,
+                              part_numbers: List[int], access_token: str) -> Dict[int, Dict[str, Any]]:
+        """批量获取分片上传地址和签名请求头"""
+        url = f"{self.service.base_url}/storage/spaces/{space_id}/files/multiPartUploadInfos"
+        infos = {}
+        for start in range(0, len(part_numbers), SIGN_BATCH_SIZE):
+            batch = part_numbers[start:start + SIGN_BATCH_SIZE]
+            data = {"uploadKey": upload_key, "partNumbers": batch}
+            response = get_transport().post(url, headers=self._headers(access_token), params={"unionId": union_id},
+                                            json=data, timeout=10)
+            result = response.json()
+            if response.status_code != 200:
+                raise Exception(f"获取分片上传信息失败: {result}")
+            for info in result.get('multipartHeaderSignatureInfos', []):
+                infos[int(info['partNumber'])] = {
+                    'url': info.get('resourceUrl') or info['resourceUrls'][0],
+                    'headers': info.get('headers', {})
+                }
+        return infos
+
+    async def _put_part(self, space_id: str, union_id: str, upload_key: str, part_number: int,
+                        read_part: Callable[[], Any], signatures: Dict[int, Dict[str, Any]]):
+        """上传单个分片，失败时重新签名后重试"""
+        last_error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                signature = signatures.get(part_number)
+                if signature is None or attempt > 1:
+                    access_token = await self.service._get_access_token()
+                    signature = (await self._get_part_infos(space_id, union_id, upload_key,
+                                                            [part_number], access_token))[part_number]
+                    signatures[part_number] = signature
+
+                data = await read_part()
+                async with get_transport().async_session().put(
+                        signature['url'], data=data,
+                        headers={**signature['headers'], 'Content-Type': 'application/octet-stream'},
+                        timeout=self.part_timeout) as response:
+                    if response.status == 200:
+                        return
+                    raise Exception(f"状态码 {response.status}: {await response.text()}")
+            except Exception as e:
+                last_error = e
+                self.logger.warning(f"分片 {part_number} 上传失败 (重试 {attempt}/{self.max_retries}): {str(e)}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(attempt)
+        raise Exception(f"分片 {part_number} 上传失败: {str(last_error)}")
+
+    async def _run_parts(self, space_id: str, union_id: str, upload_key: str,
+                         parts: AsyncIterable[Tuple[int, Callable]], signatures: Dict[int, Dict[str, Any]],
+                         on_part_done: Optional[Callable[[int], None]] = None):
+        """以有界并发上传分片，任一分片最终失败时取消其余分片"""
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: List[asyncio.Task] = []
+
+        async def upload(part_number: int, read_part):
+            try:
+                await self._put_part(space_id, union_id, upload_key, part_number, read_part, signatures)
+                if on_part_done:
+                    on_part_done(part_number)
+            finally:
+                slots.release()
+
+        try:
+            async for part_number, read_part in parts:
+                await slots.acquire()
+                failed = [task for task in tasks if task.done() and task.exception()]
+                if failed:
+                    slots.release()
+                    raise failed[0].exception()
+                tasks.append(asyncio.create_task(upload(part_number, read_part)))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    # 异步字节流
+
+    async def upload_stream(self, chunks: AsyncIterator[bytes], file_name: str, file_size: int,
+                            union_id: str, space_id: str) -> Dict[str, Any]:
+        """
+        按顺序把字节流切成分片并行上传，失败的分片用保留的数据重传
+
+        Returns:
+            Dict: success 为True时包含 upload_key，用于提交文件
+        """
+        try:
+            access_token = await self.service._get_access_token()
+            upload_key = await self._init_upload(space_id, union_id, file_name, file_size, access_token)
+            if not upload_key:
+                return {'success': False, 'error': '初始化分片上传失败'}
+
+            signatures = await self._get_part_infos(
+                space_id, union_id, upload_key, list(range(1, self.part_count(file_size) + 1)), access_token)
+            await self._run_parts(space_id, union_id, upload_key, self._iter_stream_parts(chunks), signatures)
+            return {'success': True, 'upload_key': upload_key}
+
+        except Exception as e:
+            self.logger.error(f"分片上传失败: {str(e)}")
+            return {'success': False, 'error': str(e)}
+
+    async def _iter_stream_parts(self, chunks: AsyncIterator[bytes]):
+        """把字节流切成固定大小的分片，分片数据保留到上传成功以便重试"""
+        part_number = 0
+        buffer = bytearray()
+
+        def holder(data: bytes):
+            async def read_part() -> bytes:
+                return data
+            return read_part
+
+        async for chunk in chunks:
+            buffer.extend(chunk)
+            while len(buffer) >= self.part_size:
+                part_number += 1
+                yield part_number, holder(bytes(buffer[:self.part_size]))
+                del buffer[:self.part_size]
+        if buffer or part_number == 0:
+            part_number += 1
+            yield part_number, holder(bytes(buffer))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+钉钉访问令牌管理
+
+每个应用凭证只有一个令牌管理器，所有模块共享：
+1. 令牌缓存到 expireIn 指定的过期时间前
+2. 临近过期时在后台提前刷新，调用方继续使用旧令牌，不被阻塞
+3. 并发调用共享同一次进行中的刷新，令牌过期时不会产生请求风暴
+4. 统计刷新次数、耗时和失败情况
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import settings
+from utils.logger import dingtalk_logger
+from utils.http_transport import get_transport
+
+TOKEN_URL = "https://api.dingtalk.com/v1.0/oauth2/accessToken"
+
+
+class TokenManager:
+    """单个应用凭证的访问令牌管理器"""
+
+    def __init__(self, client_id: str, client_secret: str, refresh_ahead: float = 300,
+                 expiry_margin: float = 60, max_retries: int = 3, retry_interval: float = 1,
+                 logger: logging.Logger = dingtalk_logger):
+        """
+        初始化令牌管理器
+
+        Args:
+            client_id: 钉钉应用的ClientID (AppKey)
+            client_secret: 钉钉应用的ClientSecret (AppSecret)
+            refresh_ahead: 距离过期多少秒时开始后台刷新
+            expiry_margin: 距离过期多少秒时视为已过期，必须同步等待刷新
+            max_retries: 单次刷新的最大尝试次数
+            retry_interval: 重试间隔(秒)，按尝试次数线性增长
+            logger: 日志记录器
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_ahead = max(refresh_ahead, expiry_margin)
+        self.expiry_margin = expiry_margin
+        self.max_retries = max(1, max_retries)
+        self.retry_interval = retry_interval
+        self.logger = logger
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        # 同一时刻只允许一次刷新，其他调用方等待其结果
+        self._refresh_lock = threading.Lock()
+        self._background_refreshing = False
+        self._stop_event = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+        self._stats = {
+            'refreshes': 0,
+            'failures': 0,
+            'background_refreshes': 0,
+            'total_latency': 0.0,
+            'last_latency': 0.0,
+            'last_error': None
+        }
+
+    @property
+    def access_token(self) -> Optional[str]:
+        return self._token
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def _is_usable(self, now: float) -> bool:
+        return self._token is not None and now < self._expires_at - self.expiry_margin
+
+    def _needs_refresh_ahead(self, now: float) -> bool:
+        return now >= self._expires_at - self.refresh_ahead
+
+    def get_token(self) -> str:
+        """
+        获取访问令牌
+
+        令牌有效时直接返回缓存；临近过期时返回缓存并在后台刷新；
+        已过期时同步刷新，多个调用方共享同一次刷新。
+
+        Raises:
+            Exception: 令牌不可用且刷新失败
+        """
+        now = time.time()
+        if self._is_usable(now):
+            if self._needs_refresh_ahead(now):
+                self._refresh_in_background()
+            return self._token
+
+        with self._refresh_lock:
+            # 等待锁期间其他调用方可能已完成刷新
+            if self._is_usable(time.time()):
+                return self._token
+            return self._refresh()
+
+    async def get_token_async(self) -> str:
+        """异步获取访问令牌，需要同步刷新时在线程池中等待，不阻塞事件循环"""
+        now = time.time()
+        if self._is_usable(now):
+            if self._needs_refresh_ahead(now):
+                self._refresh_in_background()
+            return self._token
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_token)
+
+    def invalidate(self):
+        """令牌被服务端拒绝时调用，下次获取时强制刷新"""
+        self._expires_at = 0.0
+
+    def _refresh_in_background(self):
+        """在后台线程中提前刷新，已有刷新进行时直接返回"""
+        if self._background_refreshing or not self._refresh_lock.acquire(blocking=False):
+            return
+        self._background_refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+                self._stats['background_refreshes'] += 1
+            except Exception:
+                # 旧令牌仍然有效，失败已记录，下次访问时再试
+                pass
+            finally:
+                self._background_refreshing = False
+                self._refresh_lock.release()
+
+        threading.Thread(target=run, name=f"token-refresh-{self.client_id}", daemon=True).start()
+
+    def _refresh(self) -> str:
+        """调用钉钉接口获取新令牌，调用方必须持有刷新锁"""
+        started_at = time.time()
+        data = {"appKey": self.client_id, "appSecret": self.client_secret}
+        last_error = None
+
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                response = get_transport().post(TOKEN_URL, json=data, timeout=10)
+                if response.status_code != 200:
+                    raise Exception(f"HTTP {response.status_code}: {response.text}")
+
+                result = response.json()
+                self._token = result["accessToken"]
+                self._expires_at = time.time() + float(result.get("expireIn", 7200))
+
+                latency = time.time() - started_at
+                self._stats['refreshes'] += 1
+                self._stats['total_latency'] += latency
+                self._stats['last_latency'] = latency
+                self.logger.info(f"钉钉访问令牌已刷新，耗时 {latency:.3f}秒，有效期 {result.get('expireIn')}秒")
+                return self._token
+            except Exception as e:
+                last_error = e
+                self.logger.warning(f"获取访问令牌失败 (重试 {attempt}/{self.max_retries}): {str(e)}")
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_interval * attempt)
+
+        self._stats['failures'] += 1
+        self._stats['last_error'] = str(last_error)
+        raise Exception(f"获取钉钉访问令牌失败(所有重试失败): {str(last_error)}")
+
+    def start(self):
+        """启动定时刷新线程，即使没有请求也在过期前更新令牌"""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._stop_event.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name=f"token-refresher-{self.client_id}", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        """停止定时刷新线程"""
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            if self._token is None:
+                delay = 0.0
+            else:
+                # 至少间隔1秒，避免有效期异常短时持续刷新
+                delay = max(1.0, self._expires_at - self.refresh_ahead - time.time())
+            if delay and self._stop_event.wait(delay):
+                break
+            try:
+                with self._refresh_lock:
+                    if self._token is None or self._needs_refresh_ahead(time.time()):
+                        self._refresh()
+                        self._stats['background_refreshes'] += 1
+            except Exception:
+                # 失败后稍等再试，避免持续请求
+                if self._stop_event.wait(max(self.retry_interval, 5)):
+                    break
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取刷新统计信息"""
+        stats = dict(self._stats)
+        total_latency = stats.pop('total_latency')
+        stats['avg_latency'] = total_latency / stats['refreshes'] if stats['refreshes'] else 0.0
+        stats['expires_in'] = max(0.0, self._expires_at - time.time()) if self._token else 0.0
+        return stats
+
+
+_managers: Dict[Tuple[str, str], TokenManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(client_id: str, client_secret: str) -> TokenManager:
+    """获取凭证对应的共享令牌管理器"""
+    key = (client_id, client_secret)
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = TokenManager(
+                    client_id,
+                    client_secret,
+                    refresh_ahead=settings.DINGTALK_TOKEN_REFRESH_AHEAD,
+                    max_retries=settings.MAX_RETRIES
+                )
+                _managers[key] = manager
+    return manager
+
+
+def get_token_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有令牌管理器的统计信息"""
+    return {manager.client_id: manager.get_stats() for manager in list(_managers.values())}
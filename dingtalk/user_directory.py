@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+钉钉用户目录缓存
+
+把 staffId 映射到 unionId、姓名和所属部门，热路径上的身份查询直接命中内存：
+1. TTL + LRU 有界缓存，未命中时才调用 user/get 接口
+2. 按部门分页批量预加载，可在启动时或定期执行
+3. 可选的磁盘快照，重启后无需重新预加载
+4. 统计命中、未命中、淘汰和预加载情况
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import settings
+from utils.logger import dingtalk_logger
+from utils.http_transport import get_transport
+from dingtalk.token_manager import get_token_manager
+
+OAPI_BASE = "https://oapi.dingtalk.com"
+# 部门用户列表接口单页上限
+PAGE_SIZE = 100
+
+
+class UserDirectory:
+    """staffId -> 用户身份信息的有界缓存"""
+
+    def __init__(self, client_id: str, client_secret: str, ttl: float = 86400,
+                 max_entries: int = 10000, snapshot_path: Optional[str] = None,
+                 logger: logging.Logger = dingtalk_logger):
+        """
+        初始化用户目录
+
+        Args:
+            client_id: 钉钉应用的ClientID
+            client_secret: 钉钉应用的ClientSecret
+            ttl: 条目有效期(秒)
+            max_entries: 条目数上限，超出时淘汰最久未使用的条目
+            snapshot_path: 磁盘快照路径，为空时不读写快照
+            logger: 日志记录器
+        """
+        self.token_manager = get_token_manager(client_id, client_secret)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.snapshot_path = snapshot_path
+        self.logger = logger
+
+        # staffId -> (写入时间, 用户信息)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._preloader: Optional[threading.Thread] = None
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0,
+            'fetch_failures': 0,
+            'preloaded': 0,
+            'last_preload_at': None,
+            'last_preload_duration': 0.0
+        }
+
+        if snapshot_path:
+            self.load_snapshot()
+
+    @staticmethod
+    def _to_record(user: Dict[str, Any]) -> Dict[str, Any]:
+        """只保留身份相关字段，user/get 与部门列表接口的字段名不同"""
+        departments = user.get('dept_id_list')
+        if departments is None:
+            departments = user.get('department', [])
+        return {
+            'userid': user.get('userid'),
+            'unionid': user.get('unionid'),
+            'name': user.get('name'),
+            'department': list(departments or [])
+        }
+
+    def put(self, staff_id: str, user: Dict[str, Any], cached_at: Optional[float] = None):
+        """写入或覆盖条目"""
+        record = self._to_record(user)
+        with self._lock:
+            self._entries[staff_id] = (cached_at or time.time(), record)
+            self._entries.move_to_end(staff_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get(self, staff_id: str) -> Optional[Dict[str, Any]]:
+        """只查询缓存，不访问网络"""
+        with self._lock:
+            entry = self._entries.get(staff_id)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            cached_at, record = entry
+            if time.time() - cached_at > self.ttl:
+                del self._entries[staff_id]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(staff_id)
+            self._stats['hits'] += 1
+            return record
+
+    def lookup(self, staff_id: str) -> Optional[Dict[str, Any]]:
+        """查询用户信息，缓存未命中时调用 user/get 接口并写入缓存"""
+        record = self.get(staff_id)
+        if record is not None:
+            return record
+
+        user = self._fetch_user(staff_id)
+        if user is None:
+            return None
+        self.put(staff_id, user)
+        return self._to_record(user)
+
+    async def lookup_async(self, staff_id: str) -> Optional[Dict[str, Any]]:
+        """异步查询，只有缓存未命中时才在线程池中访问网络"""
+        record = self.get(staff_id)
+        if record is not None:
+            return record
+        return await asyncio.get_running_loop().run_in_executor(None, self.lookup, staff_id)
+
+    def get_union_id(self, staff_id: str) -> Optional[str]:
+        record = self.lookup(staff_id)
+        return record.get('unionid') if record else None
+
+    async def get_union_id_async(self, staff_id: str) -> Optional[str]:
+        record = await self.lookup_async(staff_id)
+        return record.get('unionid') if record else None
+
+    def _oapi(self, method: str, path: str, **kwargs) -> Optional[Dict[str, Any]]:
+        """调用旧版开放接口，errcode 非0时返回None"""
+        params = kwargs.pop('params', {})
+        params['access_token'] = self.token_manager.get_token()
+        response = get_transport().request(method, f"{OAPI_BASE}{path}", params=params, timeout=10, **kwargs)
+        result = response.json()
+        if result.get('errcode') != 0:
+            self.logger.error(f"调用钉钉接口 {path} 失败: {result}")
+            return None
+        return result
+
+    def _fetch_user(self, staff_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            result = self._oapi('GET', '/user/get', params={'userid': staff_id})
+            if result is None:
+                self._stats['fetch_failures'] += 1
+            return result
+        except Exception as e:
+            self._stats['fetch_failures'] += 1
+            self.logger.error(f"获取用户信息异常: {staff_id}, {str(e)}")
+            return None
+
+    def _list_sub_departments(self, dept_id: int) -> List[int]:
+        result = self._oapi('POST', '/topapi/v2/department/listsubid', json={'dept_id': dept_id})
+        return result.get('result', {}).get('dept_id_list', []) if result else []
+
+    def _list_department_users(self, dept_id: int) -> int:
+        """分页拉取部门直属成员并写入缓存，返回写入数量"""
+        count = 0
+        cursor = 0
+        while True:
+            result = self._oapi('POST', '/topapi/v2/user/list',
+                                json={'dept_id': dept_id, 'cursor': cursor, 'size': PAGE_SIZE})
+            if result is None:
+                break
+            page = result.get('result', {})
+            now = time.time()
+            for user in page.get('list', []):
+                if user.get('userid'):
+                    self.put(user['userid'], user, cached_at=now)
+                    count += 1
+            if not page.get('has_more'):
+                break
+            cursor = page.get('next_cursor')
+        return count
+
+    def preload_departments(self, dept_ids: Iterable[int], recursive: bool = True) -> int:
+        """
+        按部门批量预加载用户
+
+        Args:
+            dept_ids: 部门ID列表，根部门为1
+            recursive: 是否包含所有子部门
+
+        Returns:
+            int: 写入缓存的用户数（多部门成员会重复计数）
+        """
+        started_at = time.time()
+        pending = list(dept_ids)
+        visited = set()
+        count = 0
+
+        while pending and not self._stop_event.is_set():
+            dept_id = pending.pop()
+            if dept_id in visited:
+                continue
+            visited.add(dept_id)
+            try:
+                count += self._list_department_users(dept_id)
+                if recursive:
+                    pending.extend(self._list_sub_departments(dept_id))
+            except Exception as e:
+                self.logger.error(f"预加载部门 {dept_id} 失败: {str(e)}")
+
+        duration = time.time() - started_at
+        self._stats['preloaded'] += count
+        self._stats['last_preload_at'] = started_at
+        self._stats['last_preload_duration'] = duration
+        self.logger.info(f"用户目录预加载完成: {len(visited)} 个部门, {count} 个用户, 耗时 {duration:.3f}秒")
+
+        if self.snapshot_path:
+            self.save_snapshot()
+        return count
+
+    def start_preload(self, dept_ids: Iterable[int], interval: float = 0, recursive: bool = True):
+        """
+        在后台线程中预加载部门用户
+
+        Args:
+            dept_ids: 部门ID列表
+            interval: 重复预加载的间隔(秒)，0表示只在启动时执行一次
+            recursive: 是否包含所有子部门
+        """
+        if self._preloader is not None and self._preloader.is_alive():
+            return
+        dept_ids = list(dept_ids)
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.is_set():
+                self.preload_departments(dept_ids, recursive=recursive)
+                if interval <= 0 or self._stop_event.wait(interval):
+                    break
+
+        self._preloader = threading.Thread(target=run, name="user-directory-preload", daemon=True)
+        self._preloader.start()
+
+    def stop(self):
+        """停止后台预加载"""
+        self._stop_event.set()
+
+    def save_snapshot(self) -> bool:
+        """把未过期的条目写入磁盘快照，先写临时文件再替换，避免写入中途损坏"""
+        if not self.snapshot_path:
+            return False
+        try:
+            with self._lock:
+                entries = [[staff_id, cached_at, record] for staff_id, (cached_at, record) in self._entries.items()]
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'saved_at': time.time(), 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+            self.logger.info(f"用户目录快照已保存: {len(entries)} 个用户")
+            return True
+        except Exception as e:
+            self.logger.error(f"保存用户目录快照失败: {str(e)}")
+            return False
+
+    def load_snapshot(self) -> int:
+        """从磁盘快照恢复未过期的条目，返回恢复数量"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            loaded = 0
+            for staff_id, cached_at, record in data.get('entries', []):
+                if now - cached_at <= self.ttl:
+                    self.put(staff_id, record, cached_at=cached_at)
+                    loaded += 1
+            self.logger.info(f"已从快照恢复 {loaded} 个用户")
+            return loaded
+        except Exception as e:
+            self.logger.error(f"读取用户目录快照失败: {str(e)}")
+            return 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        stats = dict(self._stats)
+        stats['size'] = len(self._entries)
+        return stats
+
+
+_directories: Dict[Tuple[str, str], UserDirectory] = {}
+_directories_lock = threading.Lock()
+
+
+def get_user_directory(client_id: str, client_secret: str) -> UserDirectory:
+    """获取凭证对应的共享用户目录"""
+    key = (client_id, client_secret)
+    directory = _directories.get(key)
+    if directory is None:
+        with _directories_lock:
+            directory = _directories.get(key)
+            if directory is None:
+                directory = UserDirectory(
+                    client_id,
+                    client_secret,
+                    ttl=settings.USER_DIRECTORY_TTL,
+                    max_entries=settings.USER_DIRECTORY_MAX_ENTRIES,
+                    snapshot_path=settings.USER_DIRECTORY_SNAPSHOT or None
+                )
+                _directories[key] = directory
+    return directory
+
+
+def get_user_directories() -> List[UserDirectory]:
+    """获取所有已创建的用户目录"""
+    return list(_directories.values())
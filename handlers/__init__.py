@@ -3,6 +3,7 @@
 
 包含各种消息类型的处理器：
 - ai_card_handler.py: AI卡片处理
+- dify_conversation.py: Dify对话延续
 - file_handler.py: 文件处理
 - message_handler.py: 消息分发处理
 - reply_handler.py: 回复处理
@@ -9,16 +9,19 @@ AI卡片处理器
 
 import asyncio
 import logging
-from typing import Callable, Optional
+from typing import Optional
 from dingtalk_stream import ChatbotMessage, AICardReplier
-from dify.client import DifyClient
+from dify.async_client import AsyncDifyClient
+from config.settings import settings
 from utils.logger import app_logger
+from .card_stream import CardFlushScheduler, CardStreamWriter, CardUpdatePump
+from .dify_conversation import chat_in_conversation, session_key_of, stream_in_conversation
 
 
 class AICardHandler:
     """AI卡片处理器"""
     
-    def __init__(self, dify_client: DifyClient, card_template_id: str, logger: logging.Logger = app_logger):
+    def __init__(self, dify_client: AsyncDifyClient, card_template_id: str, logger: logging.Logger = app_logger):
         self.dify_client = dify_client
         self.card_template_id = card_template_id
         self.logger = logger
@@ -56,120 +59,116 @@ class AICardHandler:
                 "status": "processing"
             }
             
-            # 创建AI卡片
+            # 卡片写入器：追加模式下只发送新增文本，结束或更新失败后全量同步
+            # 卡片实例ID在卡片创建完成后才会设置，此前的增量先缓存在写入器中
+            writer = CardStreamWriter(
+                card_instance,
+                None,
+                content_key="content",
+                append_mode=settings.CARD_APPEND_MODE,
+                logger=self.logger
+            )
+            # 按时间和字节数合并增量，并根据卡片接口延迟自适应调整更新节奏
+            pump = CardUpdatePump(writer, CardFlushScheduler.from_settings(self.logger), self.logger)
+            
+            # 卡片创建与Dify请求并发进行，卡片创建耗时不再计入首字延迟
+            dify_task = asyncio.get_running_loop().create_task(
+                self._call_dify_with_stream(request_content, pump, user_id, session_key_of(incoming_message))
+            )
             try:
-                card_instance_id = await card_instance.async_create_and_deliver_card(
-                    self.card_template_id,
-                    card_data,
-                    callback_type="STREAM",
-                    at_sender=False,
-                    at_all=False,
-                    support_forward=True
-                )
-                self.logger.info(f"AI卡片创建成功: {card_instance_id}")
-            except Exception as e:
-                self.logger.error(f"AI卡片创建失败: {str(e)}")
-                # 回退到普通文本消息
-                return await self._fallback_to_text(dingtalk_client, incoming_message, request_content)
-            
-            # 定义卡片更新回调函数
-            async def update_card_callback(content_value: str):
+                # 创建AI卡片
                 try:
-                    await card_instance.async_streaming(
-                        card_instance_id,
-                        content_key="content",
-                        content_value=content_value,
-                        append=False,
-                        finished=False,
-                        failed=False
+                    card_instance_id = await card_instance.async_create_and_deliver_card(
+                        self.card_template_id,
+                        card_data,
+                        callback_type="STREAM",
+                        at_sender=False,
+                        at_all=False,
+                        support_forward=True
                     )
+                    if not card_instance_id:
+                        raise Exception("未返回卡片实例ID")
+                    self.logger.info(f"AI卡片创建成功: {card_instance_id}")
                 except Exception as e:
-                    self.logger.error(f"AI卡片更新失败: {str(e)}")
-            
-            # 调用Dify API进行流式处理
-            full_content = await self._call_dify_with_stream(
-                request_content, 
-                update_card_callback, 
-                user_id
-            )
-            
-            # 标记卡片完成
-            try:
-                await card_instance.async_streaming(
-                    card_instance_id,
-                    content_key="content",
-                    content_value=full_content,  # 使用完整的最终内容
-                    append=False,
-                    finished=True,
-                    failed=False
-                )
-                self.logger.info("AI卡片处理完成")
-            except Exception as e:
-                self.logger.error(f"标记AI卡片完成失败: {str(e)}")
+                    self.logger.error(f"AI卡片创建失败: {str(e)}")
+                    # 取消进行中的Dify请求，回退到普通文本消息
+                    await self._cancel_task(dify_task)
+                    return await self._fallback_to_text(dingtalk_client, incoming_message, request_content)
+                
+                # 卡片就绪后启动卡片更新任务，先推送已缓存的内容
+                writer.card_instance_id = card_instance_id
+                pump.start()
+                try:
+                    full_content = await dify_task
+                finally:
+                    # 生产者结束后停止卡片更新任务，剩余内容由 writer.finish 全量同步
+                    await pump.close()
+            finally:
+                # 处理被取消或异常退出时，不遗留Dify请求
+                await self._cancel_task(dify_task)
+            
+            self.logger.info(f"卡片更新统计: {pump.get_stats()}")
+            
+            # 全量同步最终内容并标记卡片完成
+            if await writer.finish():
+                self.logger.info(f"AI卡片处理完成，写入统计: {writer.get_stats()}")
+            else:
+                self.logger.error("标记AI卡片完成失败")
                 
         except Exception as e:
             self.logger.error(f"AI卡片处理异常: {str(e)}")
             # 回退到普通文本消息
             await self._fallback_to_text(dingtalk_client, incoming_message, request_content)
     
-    async def _call_dify_with_stream(self, request_content: str, callback: Callable[[str], None], user_id: str):
-        """调用Dify API进行流式处理"""
+    async def _call_dify_with_stream(self, request_content: str, pump: CardUpdatePump, user_id: str,
+                                     session_key: str) -> str:
+        """调用Dify API进行流式处理，增量交给卡片更新任务，返回完整回复内容"""
+        writer = pump.writer
         try:
-            # 调用Dify API
-            response = self.dify_client.chat_completion(
-                query=request_content,
-                user=user_id,
-                stream=True
+            chunk_count = 0
+            
+            # 各应用类型的流式事件归一化为同一组事件：文本增量直接追加，工具和节点进度整体渲染
+            # 数据块到达即处理，只写入缓冲区并唤醒卡片更新任务，不等待卡片接口
+            # 聊天类应用延续会话对应的Dify对话
+            progress = await stream_in_conversation(
+                self.dify_client,
+                session_key,
+                request_content,
+                user_id,
+                pump,
+                app_type="workflow" if settings.DIFY_USE_WORKFLOW else None,
+                logger=self.logger
             )
+            chunk_count = progress.event_count
+            if progress.status == 'failed':
+                raise Exception(progress.error or "Dify流式响应返回错误")
             
-            self.logger.info(f"Dify API响应格式: {type(response)}")
-            self.logger.info(f"Dify API响应键: {list(response.keys()) if isinstance(response, dict) else 'Not a dict'}")
-            
-            full_content = ""
-            length = 0
-            update_threshold = 20  # 每20个字符更新一次
+            self.logger.info(f"事件流长度: {chunk_count}")
             
-            # 处理流式响应
-            event_stream = response.get("event_stream", [])
-            self.logger.info(f"事件流长度: {len(event_stream)}")
-            
-            for i, chunk in enumerate(event_stream):
-                self.logger.debug(f"处理第 {i+1} 个数据块: {chunk}")
-                
-                # 检查是否有answer字段
-                if "answer" in chunk:
-                    answer_chunk = chunk.get("answer", "")
-                    full_content += answer_chunk
-                    self.logger.debug(f"累积内容: {full_content}")
-                    
-                    # 当累积内容长度超过阈值时更新卡片
-                    full_content_length = len(full_content)
-                    if full_content_length - length > update_threshold:
-                        await callback(full_content)
-                        self.logger.info(
-                            f"调用流式更新接口更新内容：current_length: {length}, next_length: {full_content_length}"
-                        )
-                        length = full_content_length
-                else:
-                    self.logger.debug(f"数据块中没有answer字段: {chunk}")
-            
-            # 最终回调 - 确保完整内容被发送
+            full_content = writer.text
             if full_content:
-                await callback(full_content)
                 self.logger.info(
                     f"Request Content: {request_content}\nFull response: {full_content}\nFull response length: {len(full_content)}"
                 )
             else:
                 self.logger.warning("未获取到有效内容")
-                await callback("抱歉，暂时无法生成回复，请稍后再试。")
                 full_content = "抱歉，暂时无法生成回复，请稍后再试。"
+                writer.reset(full_content)
             
             return full_content
                 
         except Exception as e:
             self.logger.error(f"Dify流式调用失败: {str(e)}")
-            await callback("抱歉，处理您的消息时出现了问题，请重试。")
-            return "抱歉，处理您的消息时出现了问题，请重试。"
+            error_content = "抱歉，处理您的消息时出现了问题，请重试。"
+            writer.reset(error_content)
+            return error_content
+    
+    @staticmethod
+    async def _cancel_task(task: asyncio.Task):
+        """取消任务并等待其结束，关闭底层的Dify连接"""
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
     
     async def _fallback_to_text(self, dingtalk_client, incoming_message: ChatbotMessage, request_content: str):
         """回退到普通文本消息"""
@@ -177,10 +176,11 @@ class AICardHandler:
             user_id = incoming_message.sender_staff_id
             
             # 调用Dify API（非流式）
-            response = self.dify_client.chat_completion(
-                query=request_content,
-                user=user_id,
-                stream=False
+            response = await chat_in_conversation(
+                self.dify_client,
+                session_key_of(incoming_message),
+                request_content,
+                user_id
             )
             
             # 获取回复内容
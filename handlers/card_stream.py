@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AI卡片流式更新调度
+
+决定何时以及如何把累积的回复内容推送到AI卡片：
+1. 按时间间隔和累积字节数合并增量，避免大量细碎的卡片更新
+2. 遵守单卡片QPS上限
+3. 根据测得的卡片接口延迟，按AIMD方式自适应调整更新节奏
+4. 追加模式只发送新增文本，仅在结束或更新失败后全量同步
+5. 读取Dify与更新卡片分属两个任务，卡片更新只发送最新状态
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+import aiohttp
+from typing import Dict, Any, List, Optional
+
+from dingtalk_stream import AICardReplier
+from dingtalk_stream.utils import DINGTALK_OPENAPI_ENDPOINT
+
+from config.settings import settings
+from utils.logger import app_logger
+from utils.http_transport import get_transport
+from dingtalk.token_manager import get_token_manager
+
+
+class CardFlushScheduler:
+    """按时间和字节数合并增量的卡片更新调度器"""
+
+    def __init__(self, max_qps: float = 5, initial_interval: float = 0.5,
+                 min_interval: float = 0.2, max_interval: float = 3.0,
+                 max_pending_bytes: int = 512, target_latency: float = 0.5,
+                 increase_factor: float = 2.0, decrease_step: float = 0.05,
+                 logger: logging.Logger = app_logger):
+        """
+        初始化调度器
+
+        Args:
+            max_qps: 单卡片每秒最多更新次数，任何情况下都不会超过
+            initial_interval: 初始更新间隔(秒)
+            min_interval: 更新间隔下限(秒)，实际下限不低于 1/max_qps
+            max_interval: 更新间隔上限(秒)
+            max_pending_bytes: 累积字节数达到该值时不等间隔到期即推送
+            target_latency: 卡片接口目标延迟(秒)，超过时放慢节奏
+            increase_factor: 放慢节奏时间隔的乘数
+            decrease_step: 接口正常时每次缩短的间隔(秒)
+            logger: 日志记录器
+        """
+        self.qps_interval = 1.0 / max_qps if max_qps > 0 else 0.0
+        self.min_interval = max(min_interval, self.qps_interval)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.interval = min(max(initial_interval, self.min_interval), self.max_interval)
+        self.max_pending_bytes = max_pending_bytes
+        self.target_latency = target_latency
+        self.increase_factor = increase_factor
+        self.decrease_step = decrease_step
+        self.logger = logger
+
+        self.pending_bytes = 0
+        self.last_flush_at: Optional[float] = None
+        self.flush_count = 0
+        self.failure_count = 0
+        self.total_latency = 0.0
+
+    @classmethod
+    def from_settings(cls, logger: logging.Logger = app_logger) -> "CardFlushScheduler":
+        """使用全局配置创建调度器"""
+        return cls(
+            max_qps=settings.CARD_UPDATE_MAX_QPS,
+            initial_interval=settings.CARD_UPDATE_INTERVAL,
+            min_interval=settings.CARD_UPDATE_MIN_INTERVAL,
+            max_interval=settings.CARD_UPDATE_MAX_INTERVAL,
+            max_pending_bytes=settings.CARD_UPDATE_MAX_BYTES,
+            target_latency=settings.CARD_UPDATE_TARGET_LATENCY,
+            logger=logger
+        )
+
+    def add(self, text: str):
+        """登记新到达的增量"""
+        self.pending_bytes += len(text.encode('utf-8'))
+
+    def should_flush(self, now: Optional[float] = None) -> bool:
+        """判断当前是否应推送累积内容"""
+        if self.pending_bytes == 0:
+            return False
+        # 首次推送不等待，尽快让用户看到第一个字
+        if self.last_flush_at is None:
+            return True
+
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_flush_at
+        if elapsed < self.qps_interval:
+            return False
+        if elapsed >= self.interval:
+            return True
+        return self.pending_bytes >= self.max_pending_bytes
+
+    def delay_until_due(self, now: Optional[float] = None) -> float:
+        """距离累积内容按时间间隔到期还需等待的秒数"""
+        if self.last_flush_at is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.last_flush_at + self.interval - now)
+
+    def next_flush_delay(self, now: Optional[float] = None) -> float:
+        """在没有新增量的情况下，距离 should_flush 返回True还需等待的秒数"""
+        if self.last_flush_at is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        if self.pending_bytes >= self.max_pending_bytes:
+            return max(0.0, self.last_flush_at + self.qps_interval - now)
+        return self.delay_until_due(now)
+
+    def begin_flush(self, now: Optional[float] = None) -> float:
+        """开始一次推送，返回开始时间，供 finish_flush 计算延迟"""
+        now = time.monotonic() if now is None else now
+        self.last_flush_at = now
+        self.pending_bytes = 0
+        return now
+
+    def finish_flush(self, started_at: float, ok: bool = True, now: Optional[float] = None):
+        """记录一次推送的结果，并按AIMD调整更新间隔"""
+        now = time.monotonic() if now is None else now
+        latency = now - started_at
+        self.flush_count += 1
+        self.total_latency += latency
+
+        if not ok or latency > self.target_latency:
+            if not ok:
+                self.failure_count += 1
+            self.interval = min(self.max_interval, self.interval * self.increase_factor)
+            self.logger.debug(f"卡片更新延迟 {latency:.3f}秒，放慢更新间隔至 {self.interval:.3f}秒")
+        else:
+            self.interval = max(self.min_interval, self.interval - self.decrease_step)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息"""
+        return {
+            'flush_count': self.flush_count,
+            'failure_count': self.failure_count,
+            'avg_latency': self.total_latency / self.flush_count if self.flush_count else 0.0,
+            'interval': self.interval
+        }
+
+
+class DeltaBuffer:
+    """增量文本缓冲区，追加为O(1)，只在需要时拼接"""
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._sent = 0
+        self._length = 0
+        self._joined: Optional[str] = None
+
+    def append(self, text: str):
+        """追加增量"""
+        if text:
+            self._parts.append(text)
+            self._length += len(text)
+            self._joined = None
+
+    def take_pending(self) -> str:
+        """取出尚未发送的增量，并标记为已发送"""
+        pending = "".join(self._parts[self._sent:])
+        self._sent = len(self._parts)
+        return pending
+
+    def mark_all_sent(self):
+        """标记全部内容已发送"""
+        self._sent = len(self._parts)
+
+    def reset(self, text: str = ""):
+        """用给定内容替换缓冲区"""
+        self._parts = [text] if text else []
+        self._sent = 0
+        self._length = len(text)
+        self._joined = text
+
+    def text(self) -> str:
+        """完整内容，拼接结果会被缓存直到下次追加"""
+        if self._joined is None:
+            sent = "".join(self._parts[:self._sent])
+            unsent = self._parts[self._sent:]
+            self._joined = sent + "".join(unsent)
+            # 已发送部分合并为单个分片，后续拼接只需处理新增部分
+            self._parts = ([sent] if sent else []) + unsent
+            self._sent = 1 if sent else 0
+        return self._joined
+
+    def __len__(self) -> int:
+        return self._length
+
+
+class CardStreamWriter:
+    """AI卡片流式写入器，支持只发送增量的追加模式"""
+
+    def __init__(self, card_replier: AICardReplier, card_instance_id: str,
+                 content_key: str = "content", append_mode: bool = True,
+                 timeout: float = 10, logger: logging.Logger = app_logger):
+        """
+        初始化写入器
+
+        Args:
+            card_replier: 已投放卡片的AICardReplier
+            card_instance_id: 卡片实例ID
+            content_key: 卡片模板中流式内容的变量名
+            append_mode: 是否只发送增量；关闭时每次发送完整内容
+            timeout: 单次卡片更新的超时时间(秒)
+            logger: 日志记录器
+        """
+        self.card_replier = card_replier
+        self.card_instance_id = card_instance_id
+        # 与其他钉钉接口共用同一个令牌管理器，不使用SDK自带的同步刷新
+        credential = card_replier.dingtalk_client.credential
+        self.token_manager = get_token_manager(credential.client_id, credential.client_secret)
+        self.content_key = content_key
+        self.append_mode = append_mode
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.logger = logger
+        self.buffer = DeltaBuffer()
+        # 卡片上的内容是否与已发送部分一致；首次更新需要全量覆盖卡片的占位内容
+        self._synced = False
+        # 缓冲区被整体替换的次数，用于识别更新进行期间发生的替换
+        self._generation = 0
+        self.bytes_sent = 0
+        self.full_syncs = 0
+
+    @property
+    def text(self) -> str:
+        """当前累积的完整内容"""
+        return self.buffer.text()
+
+    def add(self, text: str):
+        """追加增量，等待下次 flush 发送"""
+        self.buffer.append(text)
+
+    async def flush(self) -> bool:
+        """发送累积内容：已同步时只发送增量，否则全量同步"""
+        generation = self._generation
+        if self.append_mode and self._synced:
+            delta = self.buffer.take_pending()
+            if not delta:
+                return True
+            ok = await self._put(delta, append=True)
+        else:
+            content = self.buffer.text()
+            self.buffer.mark_all_sent()
+            ok = await self._put(content, append=False)
+            if ok:
+                self.full_syncs += 1
+        # 更新失败后卡片内容状态未知，或期间内容被替换，下次改为全量同步
+        self._synced = ok and generation == self._generation
+        return ok
+
+    def reset(self, content: str):
+        """用给定内容替换缓冲区，下次 flush 全量同步"""
+        self.buffer.reset(content)
+        self._synced = False
+        self._generation += 1
+
+    async def replace(self, content: str) -> bool:
+        """用给定内容全量替换卡片内容"""
+        self.reset(content)
+        return await self.flush()
+
+    async def finish(self) -> bool:
+        """全量同步最终内容并标记完成"""
+        self.buffer.mark_all_sent()
+        return await self._put(self.buffer.text(), append=False, finished=True)
+
+    async def fail(self, message: str) -> bool:
+        """显示错误信息并标记失败"""
+        self.buffer.reset(message)
+        return await self._put(message, append=False, failed=True)
+
+    async def _put(self, content: str, append: bool, finished: bool = False, failed: bool = False) -> bool:
+        """调用卡片流式更新接口，与AICardReplier.async_streaming相同，但失败时返回False"""
+        try:
+            access_token = await self.token_manager.get_token_async()
+        except Exception as e:
+            self.logger.error(f"AI卡片更新失败: 无法获取钉钉访问令牌, {str(e)}")
+            return False
+
+        body = {
+            "outTrackId": self.card_instance_id,
+            "guid": str(uuid.uuid1()),
+            "key": self.content_key,
+            "content": content,
+            "isFull": not append,
+            "isFinalize": finished,
+            "isError": failed,
+        }
+        url = DINGTALK_OPENAPI_ENDPOINT + "/v1.0/card/streaming"
+
+        try:
+            # 复用共享传输层中的长连接，避免每次更新重新握手
+            async with get_transport().async_session().put(
+                url, headers=AICardReplier.get_request_header(access_token), json=body, timeout=self.timeout
+            ) as response:
+                if response.status >= 400:
+                    if response.status == 401:
+                        # 令牌被服务端拒绝，下次更新时强制刷新
+                        self.token_manager.invalidate()
+                    self.logger.error(f"AI卡片更新失败: HTTP {response.status}, {await response.text()}")
+                    return False
+            self.bytes_sent += len(content.encode('utf-8'))
+            return True
+        except Exception as e:
+            self.logger.error(f"AI卡片更新失败: {str(e)}")
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写入统计信息"""
+        return {
+            'append_mode': self.append_mode,
+            'bytes_sent': self.bytes_sent,
+            'full_syncs': self.full_syncs,
+            'content_length': len(self.buffer)
+        }
+
+
+class CardUpdatePump:
+    """卡片更新消费者任务，与读取Dify的生产者通过最新状态缓冲区解耦"""
+
+    def __init__(self, writer: CardStreamWriter, scheduler: CardFlushScheduler,
+                 logger: logging.Logger = app_logger):
+        """
+        初始化卡片更新任务
+
+        Args:
+            writer: 卡片写入器，其缓冲区即生产者与消费者共享的最新状态
+            scheduler: 更新调度器，决定消费者的推送节奏
+            logger: 日志记录器
+        """
+        self.writer = writer
+        self.scheduler = scheduler
+        self.logger = logger
+        self._dirty = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+        self.notify_count = 0
+
+    def start(self):
+        """启动消费者任务"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def push(self, text: str):
+        """生产者写入增量，不等待卡片接口"""
+        self.writer.add(text)
+        self.scheduler.add(text)
+        self.notify_count += 1
+        self._dirty.set()
+
+    def set(self, content: str):
+        """生产者整体替换内容（如工作流进度），下次推送全量同步，中间状态同样被合并"""
+        self.writer.reset(content)
+        # 每次推送都是全量内容，只登记有待推送的变化，由时间间隔决定节奏
+        self.scheduler.pending_bytes += 1
+        self.notify_count += 1
+        self._dirty.set()
+
+    async def _run(self):
+        """按调度器节奏推送最新内容，期间到达的中间状态被合并跳过"""
+        while not self._closed:
+            if not self.scheduler.pending_bytes:
+                await self._dirty.wait()
+                self._dirty.clear()
+                continue
+
+            if not self.scheduler.should_flush():
+                # 等到间隔到期，或有新增量到达时重新判断
+                try:
+                    await asyncio.wait_for(self._dirty.wait(), timeout=self.scheduler.next_flush_delay())
+                except asyncio.TimeoutError:
+                    pass
+                self._dirty.clear()
+                continue
+
+            started_at = self.scheduler.begin_flush()
+            ok = await self.writer.flush()
+            self.scheduler.finish_flush(started_at, ok=ok)
+
+    async def close(self):
+        """停止消费者任务，等待进行中的更新结束；剩余内容由 writer.finish 全量同步"""
+        self._closed = True
+        self._dirty.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                self.logger.error(f"卡片更新任务异常: {str(e)}")
+            self._task = None
+
+    async def cancel(self):
+        """立即取消消费者任务，不等待进行中的更新"""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取生产者与消费者的统计信息"""
+        stats = self.scheduler.get_stats()
+        stats['deltas'] = self.notify_count
+        stats['skipped'] = max(0, self.notify_count - stats['flush_count'])
+        return stats
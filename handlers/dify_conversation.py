@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Dify对话延续
+
+按钉钉会话和发送者保存Dify返回的对话ID，后续消息携带该ID调用Dify：
+1. 会话超时前的追问延续同一个Dify对话，保留上下文
+2. 不再为每条消息在Dify服务端创建新对话
+3. Dify拒绝已保存的对话ID时丢弃该ID，以新对话重试一次
+4. 工作流和文本完成应用没有对话概念，不携带对话ID
+5. 启用回复缓存时，非追问的问题先查缓存（精确匹配，可选相似问题匹配），命中的回复按增量重放到卡片
+6. 缓存回答的一轮不经过Dify：下一条消息按追问判断是否跳过缓存，发给Dify时附带该轮问答作为上下文
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+from dingtalk_stream import ChatbotMessage
+from adapter.session import Session, get_session_manager
+from dify.async_client import AsyncDifyClient
+from dify.answer_cache import AnswerCache, get_answer_cache
+from utils.logger import app_logger
+from .card_stream import CardUpdatePump
+from .workflow_card import WorkflowProgress
+
+# 没有对话概念的应用类型
+_STATELESS_APP_TYPES = ('workflow', 'completion')
+# Dify对话不存在或已删除时的错误信息
+_CONVERSATION_MISSING = 'Conversation Not Exists'
+# 作为上下文附带的缓存回答的最大长度
+_CACHED_CONTEXT_MAX_CHARS = 2000
+
+
+def session_key_of(incoming_message: ChatbotMessage) -> str:
+    """消息所属的会话键"""
+    return get_session_manager().session_key(incoming_message.conversation_id, incoming_message.sender_staff_id)
+
+
+def _cache_app_key(cache: Optional[AnswerCache], dify_client: AsyncDifyClient, app_type: Optional[str],
+                   query: str, session: Optional[Session]) -> str:
+    """可以使用回复缓存时返回应用标识，否则返回空字符串"""
+    if cache is None:
+        return ""
+    # 上一轮由缓存回答时同样处于对话中，追问不能再命中缓存
+    in_conversation = bool(session and (session.dify_conversation_id or session.cached_turn))
+    reason = cache.bypass_reason(query, in_conversation=in_conversation)
+    if reason:
+        cache.bypass(reason)
+        return ""
+    return cache.app_key(dify_client, app_type)
+
+
+def _with_cached_context(query: str, turn: Optional[Dict[str, str]]) -> str:
+    """上一轮由缓存回答时Dify对话中没有该轮记录，把该轮问答作为上下文随本轮问题发送"""
+    if not turn:
+        return query
+    answer = turn['answer']
+    if len(answer) > _CACHED_CONTEXT_MAX_CHARS:
+        answer = answer[:_CACHED_CONTEXT_MAX_CHARS] + "…"
+    return f"上一轮对话：\n问：{turn['query']}\n答：{answer}\n\n当前问题：{query}"
+
+
+async def stream_in_conversation(dify_client: AsyncDifyClient, session_key: str, query: str, user: str,
+                                 pump: Optional[CardUpdatePump] = None, app_type: Optional[str] = None,
+                                 logger: logging.Logger = app_logger) -> WorkflowProgress:
+    """
+    在会话对应的Dify对话中流式调用，事件交给卡片更新任务
+
+    Args:
+        dify_client: 异步Dify客户端
+        session_key: session_key_of 返回的会话键
+        query: 用户输入
+        user: 用户标识
+        pump: 卡片更新任务；为None时只收集结果
+        app_type: 应用类型，默认使用客户端的 app_type
+        logger: 日志记录器
+
+    Returns:
+        WorkflowProgress: 事件处理结果
+    """
+    sessions = get_session_manager()
+    session = None
+    if (app_type or dify_client.app_type) not in _STATELESS_APP_TYPES:
+        session = sessions.get_session(session_key)
+
+    cache = get_answer_cache()
+    app_key = _cache_app_key(cache, dify_client, app_type, query, session)
+    if app_key:
+        answer = cache.lookup(app_key, query)
+        if answer is not None:
+            logger.info(f"回复缓存命中: {query[:50]}")
+            if session is not None:
+                sessions.record_cached_answer(session, query, answer)
+            return await WorkflowProgress(title="").consume(cache.replay(answer), pump, logger)
+
+    turn = None
+    conversation_id = None
+    if session is None:
+        progress = await WorkflowProgress(title="").consume(
+            dify_client.stream_events(query=query, user=user, app_type=app_type), pump, logger
+        )
+    else:
+        sessions.record_dify_request(session)
+        conversation_id = session.dify_conversation_id
+        turn = sessions.take_cached_turn(session)
+        dify_query = _with_cached_context(query, turn)
+        progress = WorkflowProgress(title="")
+        try:
+            await progress.consume(
+                dify_client.stream_events(query=dify_query, user=user, app_type=app_type,
+                                          conversation_id=conversation_id),
+                pump, logger
+            )
+        except Exception as e:
+            # 对话ID被拒绝时请求在产出事件前失败，可以安全地以新对话重试
+            if not conversation_id or progress.event_count or _CONVERSATION_MISSING not in str(e):
+                raise
+            sessions.reset_dify_conversation(session)
+            conversation_id = None
+            progress = await WorkflowProgress(title="").consume(
+                dify_client.stream_events(query=dify_query, user=user, app_type=app_type), pump, logger
+            )
+        sessions.bind_dify_conversation(session, conversation_id, progress.conversation_id)
+
+    # 只缓存新对话中的回复：已有对话中的回复依赖该用户的上下文，附带上下文的回复依赖上一轮问答，
+    # 调用过工具的回复可能依赖实时数据
+    if (app_key and not conversation_id and not turn
+            and progress.status == 'succeeded' and not progress.tool_events):
+        cache.store_answer(app_key, query, progress.answer)
+    return progress
+
+
+async def chat_in_conversation(dify_client: AsyncDifyClient, session_key: str, query: str, user: str,
+                               stream: bool = False) -> Dict[str, Any]:
+    """在会话对应的Dify对话中调用聊天API，返回值与 chat_completion 相同；缓存命中时包含 cached 字段"""
+    sessions = get_session_manager()
+    session = sessions.get_session(session_key)
+
+    cache = get_answer_cache()
+    app_key = _cache_app_key(cache, dify_client, None, query, session)
+    if app_key:
+        answer = cache.lookup(app_key, query)
+        if answer is not None:
+            app_logger.info(f"回复缓存命中: {query[:50]}")
+            sessions.record_cached_answer(session, query, answer)
+            return {"answer": answer, "accumulated_data": {"answer": answer}, "cached": True}
+
+    sessions.record_dify_request(session)
+    conversation_id = session.dify_conversation_id
+    turn = sessions.take_cached_turn(session)
+    dify_query = _with_cached_context(query, turn)
+    try:
+        response = await dify_client.chat_completion(query=dify_query, user=user, stream=stream,
+                                                     conversation_id=conversation_id)
+    except Exception as e:
+        if not conversation_id or _CONVERSATION_MISSING not in str(e):
+            raise
+        sessions.reset_dify_conversation(session)
+        conversation_id = None
+        response = await dify_client.chat_completion(query=dify_query, user=user, stream=stream)
+    # 阻塞模式的对话ID和回复在顶层，流式汇总结果在 accumulated_data 中
+    accumulated = response.get("accumulated_data", {})
+    returned_id = response.get("conversation_id") or accumulated.get("conversation_id")
+    sessions.bind_dify_conversation(session, conversation_id, returned_id)
+
+    if app_key and not conversation_id and not turn:
+        cache.store_answer(app_key, query, response.get("answer") or accumulated.get("answer"))
+    return response
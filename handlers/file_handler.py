@@ -13,30 +13,69 @@ import os
 import tempfile
 import mimetypes
 import logging
-import requests
 import json
 import time
-from typing import Optional, Dict, Any, Tuple
-from dingtalk_stream import ChatbotMessage
-from dify.client import DifyClient
+import asyncio
+from typing import Optional, Dict, Any, Tuple, AsyncIterator, Callable
+from dingtalk_stream import ChatbotMessage, AICardReplier
+from config.settings import settings
+from dify.async_client import AsyncDifyClient
+from dify.events import StreamEvent, normalize_stream
 from utils.logger import app_logger
-from utils.dingtalk_client import get_union_id_with_client
+from utils.stream_fanout import StreamFanout
+from utils.content_index import HashingStream, get_content_index
+from utils.stage_graph import StageGraph
+from dingtalk.drive_service import DingTalkDriveService
+from dingtalk.media_stream import RobotMediaStream
+from dingtalk.user_directory import get_user_directory
+from .card_stream import CardFlushScheduler, CardStreamWriter, CardUpdatePump
+from .workflow_card import WorkflowProgress
+
+
+class DriveLink:
+    """
+    云盘链接的投递状态
+
+    分析进行中时链接并入分析卡片或分析回复；分析已结束、失败或未执行时才单独回复
+    """
+    
+    def __init__(self):
+        self.doc_url: Optional[str] = None
+        # 链接已显示在分析结果中或已单独回复
+        self.delivered = False
+        # 分析进行中时由卡片注册，链接就绪后立即更新卡片
+        self.on_update: Optional[Callable[[str], None]] = None
+    
+    def set(self, doc_url: str):
+        """记录云盘链接，分析卡片已注册时一并更新"""
+        if self.doc_url:
+            return
+        self.doc_url = doc_url
+        if self.on_update and not self.delivered:
+            self.on_update(doc_url)
 
 
 class FileHandler:
     """文件处理器 - 基于钉钉官方API规范"""
     
-    def __init__(self, dify_client: DifyClient, logger: logging.Logger = app_logger):
+    def __init__(self, dify_client: AsyncDifyClient, logger: logging.Logger = app_logger):
         self.dify_client = dify_client
         self.logger = logger
         # 钉钉配置
         self.client_id = os.environ.get("DINGTALK_CLIENT_ID")
         self.client_secret = os.environ.get("DINGTALK_CLIENT_SECRET")
+        self.drive_service = DingTalkDriveService(self.client_id, self.client_secret, self.logger)
+        self.content_index = get_content_index()
+        self.media_stream = RobotMediaStream(self.client_id, self.client_secret,
+                                             chunk_size=settings.MEDIA_STREAM_CHUNK_KB * 1024, logger=self.logger)
         # 文件大小限制 (默认100MB)
         self.max_file_size = int(os.environ.get('MAX_FILE_SIZE_MB', '100')) * 1024 * 1024
         # Dify工作流配置
         self.use_workflow = os.environ.get("DIFY_USE_WORKFLOW", "false").lower() == "true"
         self.workflow_id = os.environ.get("DIFY_WORKFLOW_ID", "")
+        self.upload_to_dify = os.environ.get("UPLOAD_TO_DIFY", "false").lower() == "true"
+        # 工作流进度卡片模板，未配置时以文本消息回复分析结果
+        self.card_template_id = settings.DINGTALK_AI_CARD_TEMPLATE_ID
     
     async def handle_file_message(self, dingtalk_client, incoming_message: ChatbotMessage):
         """处理文件消息 - 钉钉官方规范流程"""
@@ -72,30 +111,77 @@ class FileHandler:
                 dingtalk_client.reply_text("无法获取用户信息，请重试", incoming_message)
                 return
             
-            # 第一步：上传文件到钉钉云盘（钉钉官方规范）
-            upload_result = await self._upload_to_dingtalk_drive(file_name, file_size, union_id)
-            
-            if upload_result['success']:
-                # 文件上传成功，获取钉钉云盘链接
-                doc_url = upload_result['doc_url']
-                file_id = upload_result['file_id']
-                
-                # 回复用户文件上传成功信息
-                upload_reply = f"✅ 文件上传成功！\n\n📁 文件名: {file_name}\n📊 大小: {file_size // 1024}KB\n🔗 钉钉云盘链接: {doc_url}"
-                dingtalk_client.reply_text(upload_reply, incoming_message)
-                
-                # 第二步：发送文件给Dify工作流进行分析
-                await self._process_with_dify_workflow(
-                    file_name, file_size, file_type, union_id, 
-                    file_id, doc_url, dingtalk_client, incoming_message
-                )
-            else:
-                # 文件上传失败，尝试使用文件信息进行处理
-                self.logger.warning(f"文件上传到钉钉云盘失败: {upload_result['error']}")
-                await self._process_with_dify_workflow(
-                    file_name, file_size, file_type, union_id, 
-                    None, None, dingtalk_client, incoming_message
+            # 云盘上传和AI分析互不依赖：Dify文件就绪后立即开始分析，云盘链接就绪后并入分析结果
+            graph = StageGraph(f"文件处理[{file_name}]", self.logger)
+            graph.add_signal('drive')
+            graph.add_signal('dify_file')
+            # 已向用户说明结果（如文件过大）时，流程结束后不再回复通用错误
+            notified = False
+            
+            async def transfer(_):
+                nonlocal notified
+                transfer_result = await self._transfer_file(
+                    file_info, union_id, incoming_message.sender_staff_id,
+                    on_drive=lambda result: graph.resolve('drive', result),
+                    on_dify=lambda dify_file_id: graph.resolve('dify_file', dify_file_id)
                 )
+                if transfer_result['size'] > self.max_file_size:
+                    dingtalk_client.reply_text(
+                        f"文件过大，当前文件大小: {transfer_result['size'] // (1024*1024)}MB，最大支持: {self.max_file_size // (1024*1024)}MB", 
+                        incoming_message
+                    )
+                    notified = True
+                    graph.fail('drive', ValueError('文件过大'))
+                    graph.fail('dify_file', ValueError('文件过大'))
+                    return transfer_result
+                graph.resolve('drive', transfer_result['upload'])
+                graph.resolve('dify_file', transfer_result['dify_file_id'])
+                return transfer_result
+            
+            drive_link = DriveLink()
+            analysis_done = False
+            
+            def send_drive_link():
+                """分析结果中没有显示链接时单独回复"""
+                if drive_link.doc_url and not drive_link.delivered:
+                    drive_link.delivered = True
+                    upload_reply = f"✅ 文件上传成功！\n\n📁 文件名: {file_name}\n🔗 钉钉云盘链接: {drive_link.doc_url}"
+                    dingtalk_client.reply_text(upload_reply, incoming_message)
+            
+            async def reply_drive_link(deps):
+                upload_result = deps['drive']
+                if not upload_result['success']:
+                    self.logger.warning(f"文件上传到钉钉云盘失败: {upload_result['error']}")
+                    return
+                # 分析进行中时链接并入分析结果，分析已结束时单独回复
+                drive_link.set(upload_result['doc_url'])
+                if analysis_done:
+                    send_drive_link()
+            
+            async def analyze(deps):
+                nonlocal analysis_done
+                # 分析开始时云盘已完成则链接同时作为工作流输入
+                upload_result = graph.result('drive') or {}
+                try:
+                    await self._process_with_dify_workflow(
+                        file_name, file_size, file_type, union_id, 
+                        upload_result.get('file_id'), upload_result.get('doc_url'),
+                        dingtalk_client, incoming_message, deps['dify_file'], drive_link
+                    )
+                finally:
+                    analysis_done = True
+                    send_drive_link()
+            
+            # 转发失败时未提供的信号随之失败，下游阶段被跳过而不是一直等待
+            graph.add('transfer', transfer, provides=['drive', 'dify_file'])
+            graph.add('drive_reply', reply_drive_link, deps=['drive'])
+            graph.add('analysis', analyze, deps=['dify_file'])
+            results = await graph.run(timeout=settings.FILE_PROCESS_TIMEOUT)
+            # 分析阶段内部的错误已回复用户；被跳过或超时取消时在这里回复
+            if isinstance(results['analysis'], BaseException) and not notified:
+                dingtalk_client.reply_text("文件处理时发生错误，请重试", incoming_message)
+            # 分析未执行时云盘链接仍需回复
+            send_drive_link()
                 
         except Exception as e:
             self.logger.error(f"处理文件消息异常: {str(e)}")
@@ -171,17 +257,15 @@ class FileHandler:
         try:
             if hasattr(incoming_message, 'sender_staff_id'):
                 if self.client_id and self.client_secret:
-                    self.logger.info("使用钉钉客户端获取unionId")
-                    union_id = get_union_id_with_client(
-                        incoming_message.sender_staff_id, 
-                        self.client_id, 
-                        self.client_secret
-                    )
+                    self.logger.info("从用户目录获取unionId")
+                    # 用户目录命中时不访问网络
+                    directory = get_user_directory(self.client_id, self.client_secret)
+                    union_id = await directory.get_union_id_async(incoming_message.sender_staff_id)
                     if union_id:
                         self.logger.info(f"获取到unionId: {union_id}")
                         return union_id
                     else:
-                        self.logger.error("钉钉客户端获取unionId失败")
+                        self.logger.error("用户目录获取unionId失败")
                 else:
                     self.logger.error("钉钉配置不完整，无法获取unionId")
             
@@ -191,213 +275,182 @@ class FileHandler:
             self.logger.error(f"获取用户unionId失败: {str(e)}")
             return None
     
-    async def _upload_to_dingtalk_drive(self, file_name: str, file_size: int, union_id: str) -> Dict[str, Any]:
-        """上传文件到钉钉云盘 - 钉钉官方Storage 2.0 API"""
-        try:
-            # 获取访问令牌
-            access_token = await self._get_access_token()
-            if not access_token:
-                return {'success': False, 'error': '无法获取访问令牌'}
-            
-            # 获取工作空间
-            space_id = await self._get_workspace(union_id, access_token)
-            if not space_id:
-                return {'success': False, 'error': '无法获取工作空间'}
-            
-            # 获取文件上传信息
-            upload_info = await self._get_upload_info(union_id, space_id, file_name, file_size, access_token)
-            if not upload_info:
-                return {'success': False, 'error': '无法获取上传信息'}
-            
-            # 上传文件到资源服务器
-            upload_result = await self._upload_to_resource(
-                upload_info['resource_url'], 
-                upload_info['headers'], 
-                file_name, 
-                file_size
-            )
-            
-            if not upload_result['success']:
-                return {'success': False, 'error': upload_result['error']}
-            
-            # 提交文件信息
-            commit_result = await self._commit_file(
-                union_id, space_id, upload_info['upload_key'], 
-                file_name, file_size, access_token
-            )
-            
-            if commit_result['success']:
-                return {
-                    'success': True, 
-                    'doc_url': commit_result['doc_url'],
-                    'file_id': commit_result['file_id']
-                }
-            else:
-                return {'success': False, 'error': commit_result['error']}
-                
-        except Exception as e:
-            self.logger.error(f"上传文件到钉钉云盘失败: {str(e)}")
-            return {'success': False, 'error': str(e)}
+    async def _upload_to_dingtalk_drive(self, file_name: str, file_size: int, union_id: str,
+                                        file_content: Optional[AsyncIterator[bytes]] = None) -> Dict[str, Any]:
+        """上传文件到钉钉云盘 - 钉钉官方Storage 2.0 API
+        
+        由云盘服务完成上传，工作空间ID命中缓存时只需获取上传信息和提交两次接口调用
+        """
+        return await self.drive_service.upload_file(file_name, file_size, union_id, file_content)
     
-    async def _get_access_token(self) -> Optional[str]:
-        """获取钉钉访问令牌 - 钉钉官方OAuth2.0"""
+    async def _transfer_file(self, file_info: Dict[str, Any], union_id: str, user_id: str,
+                             on_drive: Optional[Callable[[Dict[str, Any]], None]] = None,
+                             on_dify: Optional[Callable[[Optional[str]], None]] = None) -> Dict[str, Any]:
+        """
+        流式转发消息文件：下载的同一份字节流同时上传到钉钉云盘和Dify
+        
+        内存占用只有几个数据块，与文件大小无关。同一内容已上传过且远端仍有效时直接复用，
+        只补传失效的目标
+        
+        Args:
+            on_drive: 云盘上传完成时立即调用，不等待Dify上传
+            on_dify: Dify上传完成时立即调用，不等待云盘上传
+        
+        Returns:
+            Dict: upload 为云盘上传结果，dify_file_id 为Dify文件ID，size 为实际文件大小
+        """
+        file_name = file_info['name']
+        file_size = file_info['size']
+        download_code = file_info.get('downloadCode')
+        alias = self._content_alias(file_info)
+        
+        reused = await self._reuse_uploaded(alias, union_id) if alias else {}
+        upload_result = reused.get('upload')
+        dify_file_id = reused.get('dify_file_id')
+        file_size = reused.get('size') or file_size
+        need_drive = upload_result is None
+        need_dify = self.upload_to_dify and dify_file_id is None
+        if not need_drive and not need_dify:
+            self.logger.info(f"文件内容已上传过，直接复用: {file_name}")
+            return {'upload': upload_result, 'dify_file_id': dify_file_id, 'size': file_size}
+        
+        if not download_code:
+            self.logger.warning(f"消息中没有downloadCode，无法读取文件内容: {file_name}")
+            # 没有内容可上传到Dify，分析不等待云盘上传
+            if on_dify:
+                on_dify(dify_file_id)
+            if need_drive:
+                upload_result = await self._upload_to_dingtalk_drive(file_name, file_size, union_id)
+            return {'upload': upload_result, 'dify_file_id': dify_file_id, 'size': file_size}
+        
         try:
-            from dingtalk.auth import DingTalkAuth
-            auth = DingTalkAuth(self.client_id, self.client_secret)
-            return auth.get_access_token()
-        except Exception as e:
-            self.logger.error(f"获取访问令牌失败: {str(e)}")
-            return None
-    
-    async def _get_workspace(self, union_id: str, access_token: str) -> Optional[str]:
-        """获取工作空间ID - 钉钉官方API"""
-        try:
-            url = "https://api.dingtalk.com/v1.0/drive/spaces"
-            headers = {
-                "x-acs-dingtalk-access-token": access_token,
-                "Content-Type": "application/json"
-            }
-            data = {
-                "unionId": union_id,
-                "spaceType": "org"  # 钉钉官方规范
-            }
-            
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
-            result = response.json()
-            
-            if response.status_code == 200 and result.get('spaces'):
-                # 返回第一个工作空间ID
-                space_id = result['spaces'][0]['spaceId']
-                self.logger.info(f"获取到工作空间ID: {space_id}")
-                return space_id
-            else:
-                self.logger.error(f"获取工作空间失败: {result}")
-                return None
+            async with self.media_stream.open(download_code) as (content_length, chunks):
+                file_size = content_length or file_size
+                if file_size > self.max_file_size:
+                    return {'upload': {'success': False, 'error': '文件过大'}, 'dify_file_id': None, 'size': file_size}
                 
-        except Exception as e:
-            self.logger.error(f"获取工作空间异常: {str(e)}")
-            return None
-    
-    async def _get_upload_info(self, union_id: str, space_id: str, file_name: str, file_size: int, access_token: str) -> Optional[Dict[str, Any]]:
-        """获取文件上传信息 - 钉钉官方Storage 2.0 API"""
-        try:
-            url = f"https://api.dingtalk.com/v1.0/storage/spaces/{space_id}/files/uploadInfos"
-            headers = {
-                "x-acs-dingtalk-access-token": access_token,
-                "Content-Type": "application/json"
-            }
-            data = {
-                "unionId": union_id,
-                "protocol": "HEADER_SIGNATURE",  # 钉钉官方固定协议
-                "option": {
-                    "storageDriver": "DINGTALK",  # 钉钉官方存储驱动
-                    "size": file_size,
-                    "name": file_name
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
-            result = response.json()
-            
-            if response.status_code == 200 and result.get('headerSignatureInfo'):
-                info = result['headerSignatureInfo']
-                upload_info = {
-                    'resource_url': info['resourceUrls'][0],
-                    'headers': info['headers'],
-                    'upload_key': result['uploadKey']
-                }
-                self.logger.info(f"获取上传信息成功: {upload_info}")
-                return upload_info
-            else:
-                self.logger.error(f"获取上传信息失败: {result}")
-                return None
+                # 不需要上传的目标立即放行下游
+                if not need_drive and on_drive:
+                    on_drive(upload_result)
+                if not need_dify and on_dify:
+                    on_dify(dify_file_id)
                 
-        except Exception as e:
-            self.logger.error(f"获取上传信息异常: {str(e)}")
-            return None
-    
-    async def _upload_to_resource(self, resource_url: str, headers: Dict[str, str], file_name: str, file_size: int) -> Dict[str, Any]:
-        """上传文件到资源服务器 - 钉钉官方规范"""
-        try:
-            # 创建占位文件内容（钉钉官方规范）
-            file_content = b"File content placeholder for " + file_name.encode('utf-8')
-            
-            # 使用PUT方法上传文件（钉钉官方要求）
-            session = requests.Session()
-            session.verify = False
-            
-            # 设置请求头
-            for key, value in headers.items():
-                session.headers[key] = value
-            
-            # 上传文件
-            response = session.put(
-                resource_url, 
-                data=file_content, 
-                timeout=60,  # 钉钉官方推荐超时
-                headers={'Content-Type': 'application/octet-stream'}
-            )
-            
-            if response.status_code == 200:
-                self.logger.info(f"文件上传到资源服务器成功: {file_name}")
-                return {'success': True}
-            else:
-                error_msg = f'上传失败，状态码: {response.status_code}'
-                self.logger.error(f"文件上传到资源服务器失败: {error_msg}")
-                return {'success': False, 'error': error_msg}
+                targets = []
+                consumers = []
+                async def upload_drive(stream):
+                    result = await self._upload_to_dingtalk_drive(file_name, file_size, union_id, stream)
+                    if on_drive:
+                        on_drive(result)
+                    return result
+                
+                async def upload_dify(stream):
+                    content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+                    dify_file_id = await self.dify_client.upload_stream(stream, file_name, user_id, content_type)
+                    if on_dify:
+                        on_dify(dify_file_id)
+                    return dify_file_id
+                
+                if need_drive:
+                    targets.append('drive')
+                    consumers.append(upload_drive)
+                if need_dify:
+                    targets.append('dify')
+                    consumers.append(upload_dify)
                 
+                # 摘要在数据流经时计算，不额外读取文件
+                hashing = HashingStream(self._limit_size(chunks))
+                fanout = StreamFanout(hashing, settings.MEDIA_STREAM_BUFFER_CHUNKS, self.logger)
+                results = dict(zip(targets, await fanout.run(*consumers)))
+                self.logger.info(f"文件流式转发完成: {file_name}, {fanout.get_stats()}")
         except Exception as e:
-            self.logger.error(f"上传到资源服务器失败: {str(e)}")
-            return {'success': False, 'error': str(e)}
+            self.logger.error(f"流式转发文件失败: {str(e)}")
+            return {'upload': upload_result or {'success': False, 'error': str(e)}, 'dify_file_id': dify_file_id, 'size': file_size}
+        
+        if need_drive:
+            upload_result = results['drive']
+            if isinstance(upload_result, BaseException):
+                upload_result = {'success': False, 'error': str(upload_result)}
+        if need_dify and isinstance(results['dify'], str):
+            dify_file_id = results['dify']
+        
+        if hashing.digest:
+            drive = {key: upload_result[key] for key in ('file_id', 'space_id', 'doc_url')} if upload_result.get('success') else None
+            self.content_index.record(
+                hashing.digest, hashing.size,
+                aliases=[alias] if alias else (),
+                dify_file_id=dify_file_id,
+                union_id=union_id,
+                drive=drive
+            )
+        return {'upload': upload_result, 'dify_file_id': dify_file_id, 'size': file_size}
     
-    async def _commit_file(self, union_id: str, space_id: str, upload_key: str, file_name: str, file_size: int, access_token: str) -> Dict[str, Any]:
-        """提交文件信息 - 钉钉官方Storage 2.0 API"""
-        try:
-            url = f"https://api.dingtalk.com/v1.0/storage/spaces/{space_id}/files/commit"
-            headers = {
-                "x-acs-dingtalk-access-token": access_token,
-                "Content-Type": "application/json"
-            }
-            data = {
-                "unionId": union_id,
-                "uploadKey": upload_key,
-                "name": file_name,
-                "option": {
-                    "size": file_size,
-                    "conflictStrategy": "OVERWRITE",  # 钉钉官方冲突处理策略
-                    "convertToOnlineDoc": False  # 钉钉官方在线文档转换选项
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=data, timeout=10, verify=False)
-            result = response.json()
-            
-            if response.status_code == 200 and result.get('dentry'):
-                dentry = result['dentry']
-                # 钉钉官方文档链接格式
-                doc_url = f"https://alidocs.dingtalk.com/i/nodes/{dentry['uuid']}"
-                commit_result = {
-                    'success': True,
-                    'doc_url': doc_url,
-                    'file_id': dentry['id']
-                }
-                self.logger.info(f"文件提交成功: {commit_result}")
-                return commit_result
+    @staticmethod
+    def _content_alias(file_info: Dict[str, Any]) -> Optional[str]:
+        """消息中的 spaceId:fileId 在转发时保持不变，用作内容索引的别名"""
+        if file_info.get('spaceId') and file_info.get('fileId'):
+            return f"{file_info['spaceId']}:{file_info['fileId']}"
+        return None
+    
+    async def _reuse_uploaded(self, alias: str, union_id: str) -> Dict[str, Any]:
+        """
+        查询内容索引并确认远端标识仍然有效
+        
+        Returns:
+            Dict: 仍然有效的 upload（云盘结果）和 dify_file_id，以及 size；未命中时为空
+        """
+        digest, record = self.content_index.lookup_alias(alias)
+        if record is None:
+            return {}
+        
+        reused: Dict[str, Any] = {'size': record['size']}
+        drive = record['drive'].get(union_id)
+        if drive:
+            info = await self.drive_service.get_file_info(drive['file_id'], drive['space_id'], union_id)
+            if info['success']:
+                reused['upload'] = dict(drive, success=True)
             else:
-                error_msg = f'提交文件失败: {result}'
-                self.logger.error(error_msg)
-                return {'success': False, 'error': error_msg}
-                
-        except Exception as e:
-            self.logger.error(f"提交文件异常: {str(e)}")
-            return {'success': False, 'error': str(e)}
+                self.logger.info(f"云盘中的文件已失效，重新上传: {drive['file_id']}")
+                self.content_index.invalidate(digest, 'drive', union_id)
+        
+        if self.upload_to_dify and record['dify_file_id']:
+            if await self.dify_client.file_exists(record['dify_file_id']):
+                reused['dify_file_id'] = record['dify_file_id']
+            else:
+                self.logger.info(f"Dify中的文件已失效，重新上传: {record['dify_file_id']}")
+                self.content_index.invalidate(digest, 'dify')
+        return reused
+    
+    async def _limit_size(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """响应未声明大小时在读取过程中检查文件大小上限"""
+        received = 0
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > self.max_file_size:
+                raise Exception(f"文件超过大小上限 {self.max_file_size // (1024*1024)}MB")
+            yield chunk
     
     async def _process_with_dify_workflow(self, file_name: str, file_size: int, file_type: str, 
                                         union_id: str, file_id: str, doc_url: str, 
-                                        dingtalk_client, incoming_message: ChatbotMessage):
-        """使用Dify工作流处理文件 - 优化的工作流集成"""
+                                        dingtalk_client, incoming_message: ChatbotMessage,
+                                        dify_file_id: Optional[str] = None,
+                                        drive_link: Optional[DriveLink] = None):
+        """使用Dify工作流处理文件 - 优化的工作流集成
+        
+        drive_link 为分析期间可能就绪的云盘链接，就绪后显示在分析卡片或分析回复中
+        """
+        drive_link = drive_link or DriveLink()
+        if doc_url:
+            drive_link.set(doc_url)
         try:
             user_id = incoming_message.sender_staff_id
+            # 已流式上传到Dify的文件作为本地文件传给工作流
+            files = None
+            if dify_file_id:
+                files = [{
+                    "type": self._get_dify_file_type(file_type),
+                    "transfer_method": "local_file",
+                    "upload_file_id": dify_file_id
+                }]
             
             # 构建Dify工作流输入参数
             workflow_inputs = {
@@ -420,39 +473,31 @@ class FileHandler:
             
             self.logger.info(f"发送文件到Dify工作流分析: {file_name}")
             
-            # 调用Dify工作流API
-            if self.use_workflow and self.workflow_id:
-                # 使用指定工作流ID
-                response = self.dify_client.workflow_run(
-                    inputs=workflow_inputs,
-                    user=user_id,
-                    stream=False
-                )
-                self.logger.info(f"Dify工作流执行成功: {file_name}")
-            else:
-                # 使用默认工作流或聊天API
-                response = self.dify_client.workflow_run(
-                    inputs=workflow_inputs,
-                    user=user_id,
-                    stream=False
-                )
-                self.logger.info(f"Dify API调用成功: {file_name}")
+            # 流式执行工作流，节点进度和输出到达即显示在AI卡片中
+            progress = WorkflowProgress(title="文件分析")
+            events = normalize_stream(self.dify_client.stream_workflow_run(
+                inputs=workflow_inputs,
+                user=user_id,
+                files=files
+            ))
+            if await self._run_workflow_with_card(events, progress, dingtalk_client, incoming_message, drive_link):
+                self.logger.info(f"文件 {file_name} 的AI分析已在卡片中完成")
+                return
+            
+            if progress.status == 'failed':
+                raise Exception(progress.error or "工作流执行失败")
+            self.logger.info(f"Dify工作流执行成功: {file_name}")
             
             # 获取分析结果
-            answer = response.get("answer", "文件分析完成")
-            conversation_id = response.get("conversation_id", "")
-            message_id = response.get("message_id", "")
+            answer = progress.answer or "文件分析完成"
             
             # 构建AI分析回复
             ai_reply = f"🤖 AI分析结果\n\n📁 文件名: {file_name}\n📊 文件大小: {file_size // 1024}KB\n📝 文件类型: {file_type}\n\n💡 分析结果:\n{answer}"
             
-            # 如果有钉钉云盘链接，添加到回复中
-            if doc_url:
-                ai_reply += f"\n\n🔗 钉钉云盘链接: {doc_url}"
-            
-            # 如果有会话ID，添加到回复中
-            if conversation_id:
-                ai_reply += f"\n\n💬 会话ID: {conversation_id}"
+            # 分析期间云盘链接已就绪时添加到回复中
+            if drive_link.doc_url:
+                ai_reply += f"\n\n🔗 钉钉云盘链接: {drive_link.doc_url}"
+                drive_link.delivered = True
             
             # 回复用户AI分析结果
             dingtalk_client.reply_text(ai_reply, incoming_message)
@@ -464,6 +509,96 @@ class FileHandler:
             error_reply = f"❌ AI分析文件时发生错误\n\n📁 文件名: {file_name}\n⚠️ 错误信息: {str(e)}\n\n请稍后重试或联系管理员"
             dingtalk_client.reply_text(error_reply, incoming_message)
     
+    async def _run_workflow_with_card(self, events: AsyncIterator[StreamEvent], progress: WorkflowProgress,
+                                      dingtalk_client, incoming_message: ChatbotMessage,
+                                      drive_link: DriveLink) -> bool:
+        """
+        消费工作流事件并实时更新AI卡片
+        
+        卡片创建与工作流执行并发进行；未配置卡片模板或卡片创建失败时仍读完事件流，
+        由调用方以文本消息回复结果。执行期间就绪的云盘链接显示在卡片末尾
+        
+        Returns:
+            bool: 结果是否已显示在卡片中
+        """
+        actual_client = dingtalk_client.dingtalk_client if hasattr(dingtalk_client, 'dingtalk_client') else dingtalk_client
+        card_instance = AICardReplier(actual_client, incoming_message)
+        # 进度内容会整体变化，每次推送全量内容
+        writer = CardStreamWriter(card_instance, None, content_key="content", append_mode=False, logger=self.logger)
+        pump = CardUpdatePump(writer, CardFlushScheduler.from_settings(self.logger), self.logger)
+        consume_task = asyncio.get_running_loop().create_task(progress.consume(events, pump, self.logger))
+        
+        def show_drive_link(doc_url: str):
+            progress.footer = f"🔗 钉钉云盘链接: {doc_url}"
+            # 只有文本增量时按增量推送，链接在结束时随全量内容同步
+            if not progress.plain:
+                pump.set(progress.render())
+        
+        if drive_link.doc_url:
+            show_drive_link(drive_link.doc_url)
+        drive_link.on_update = show_drive_link
+        try:
+            card_instance_id = None
+            if self.card_template_id:
+                try:
+                    card_instance_id = await card_instance.async_create_and_deliver_card(
+                        self.card_template_id,
+                        {"content": "正在启动工作流...", "status": "processing"},
+                        callback_type="STREAM",
+                        at_sender=False,
+                        at_all=False,
+                        support_forward=True
+                    )
+                except Exception as e:
+                    self.logger.error(f"AI卡片创建失败: {str(e)}")
+            if not card_instance_id:
+                await consume_task
+                return False
+            
+            # 卡片就绪后启动卡片更新任务，先推送已缓存的进度
+            writer.card_instance_id = card_instance_id
+            pump.start()
+            try:
+                await consume_task
+            except Exception as e:
+                self.logger.error(f"Dify工作流流式执行失败: {str(e)}")
+                await pump.cancel()
+                if await writer.fail(f"{progress.render()}\n\n❌ AI分析时发生错误: {str(e)}") and progress.footer:
+                    drive_link.delivered = True
+                return True
+            finally:
+                await pump.close()
+        finally:
+            # 卡片结束后就绪的链接由调用方单独回复
+            drive_link.on_update = None
+            # 处理被取消或异常退出时，不遗留Dify请求
+            if not consume_task.done():
+                consume_task.cancel()
+            await asyncio.gather(consume_task, return_exceptions=True)
+        
+        self.logger.info(f"卡片更新统计: {pump.get_stats()}")
+        if progress.status == 'failed':
+            ok = await writer.fail(progress.render())
+        else:
+            if progress.footer:
+                # 最后一次推送后才就绪的链接随最终内容同步
+                writer.reset(progress.render())
+            ok = await writer.finish()
+        if not ok:
+            self.logger.error("标记AI卡片完成失败")
+        elif progress.footer:
+            drive_link.delivered = True
+        return True
+    
+    @staticmethod
+    def _get_dify_file_type(file_type: str) -> str:
+        """把本地文件类型映射为Dify的文件类型"""
+        if file_type in {'document', 'spreadsheet', 'text'}:
+            return 'document'
+        if file_type in {'image', 'audio', 'video'}:
+            return file_type
+        return 'custom'
+    
     def _is_text_file(self, file_name: str) -> bool:
         """判断是否为文本文件"""
         text_extensions = {'.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv', '.log'}
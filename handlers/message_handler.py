@@ -10,8 +10,9 @@
 import asyncio
 import logging
 from dingtalk_stream import ChatbotMessage, AckMessage
-from dify.client import DifyClient
+from dify.async_client import AsyncDifyClient
 from utils.logger import app_logger
+from utils.dedup import MessageDeduplicator
 from .ai_card_handler import AICardHandler
 from .file_handler import FileHandler
 from .reply_handler import ReplyHandler
@@ -20,10 +21,13 @@ from .reply_handler import ReplyHandler
 class MessageHandler:
     """消息处理器"""
     
-    def __init__(self, dify_client: DifyClient, card_template_id: str, logger: logging.Logger = app_logger):
+    def __init__(self, dify_client: AsyncDifyClient, card_template_id: str, logger: logging.Logger = app_logger,
+                 deduplicator: MessageDeduplicator = None):
         self.dify_client = dify_client
         self.card_template_id = card_template_id
         self.logger = logger
+        # 单独使用本处理器时按msgId去重；由UnifiedCardBotHandler调用时已在入口去重
+        self.deduplicator = deduplicator
         
         # 初始化各个处理器
         self.ai_card_handler = AICardHandler(dify_client, card_template_id, logger)
@@ -35,6 +39,9 @@ class MessageHandler:
         try:
             self.logger.info(f"收到消息：{incoming_message}")
             
+            if self.deduplicator and self.deduplicator.is_duplicate(incoming_message.message_id):
+                return AckMessage.STATUS_OK, "duplicate"
+            
             # 根据消息类型分发处理
             if incoming_message.message_type == "text":
                 # 文本消息 - 使用AI卡片处理
@@ -60,6 +67,8 @@ class MessageHandler:
             
         except Exception as e:
             self.logger.error(f"处理消息异常: {str(e)}")
+            if self.deduplicator:
+                self.deduplicator.forget(incoming_message.message_id)
             self.reply_handler.reply_error(
                 dingtalk_client, f"处理消息时发生错误: {str(e)}", incoming_message
             )
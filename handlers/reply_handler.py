@@ -10,14 +10,15 @@
 import logging
 from typing import Optional
 from dingtalk_stream import ChatbotMessage
-from dify.client import DifyClient
+from dify.async_client import AsyncDifyClient
 from utils.logger import app_logger
+from .dify_conversation import chat_in_conversation, session_key_of
 
 
 class ReplyHandler:
     """回复处理器"""
     
-    def __init__(self, dify_client: DifyClient = None, logger: logging.Logger = app_logger):
+    def __init__(self, dify_client: AsyncDifyClient = None, logger: logging.Logger = app_logger):
         self.dify_client = dify_client
         self.logger = logger
     
@@ -86,10 +87,11 @@ class ReplyHandler:
                 
                 # 调用Dify API
                 if self.dify_client:
-                    response = self.dify_client.chat_completion(
-                        query=query,
-                        user=user_id,
-                        stream=False
+                    response = await chat_in_conversation(
+                        self.dify_client,
+                        session_key_of(incoming_message),
+                        query,
+                        user_id
                     )
                     
                     # 获取回复内容
@@ -118,10 +120,11 @@ class ReplyHandler:
                 
                 # 调用Dify API
                 if self.dify_client:
-                    response = self.dify_client.chat_completion(
-                        query=query,
-                        user=user_id,
-                        stream=False
+                    response = await chat_in_conversation(
+                        self.dify_client,
+                        session_key_of(incoming_message),
+                        query,
+                        user_id
                     )
                     
                     # 获取回复内容
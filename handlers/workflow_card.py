@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+工作流进度卡片
+
+把Dify归一化事件流渲染为AI卡片内容，各应用类型共用：
+1. 工作流、节点和工具调用的进度显示为进度列表
+2. 文本增量追加到输出区，节点进度与输出一起整体渲染
+3. 没有进度信息的聊天回复只显示文本，按增量推送
+4. 渲染结果交给卡片更新任务，与聊天回复共用同一套合并与限速节奏
+5. 工作流结束时未流式输出文本，从 outputs 中取最终结果
+6. 可附加显示在卡片末尾的信息，如分析过程中就绪的云盘链接
+"""
+
+import json
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from dify.events import DeltaEvent, EndEvent, ErrorEvent, ProgressEvent, ReplaceEvent, StreamEvent, UsageEvent
+from utils.logger import app_logger
+from .card_stream import CardUpdatePump
+
+# 节点状态 -> 显示图标
+STATUS_ICONS = {
+    'running': '⏳',
+    'succeeded': '✅',
+    'failed': '❌',
+    'stopped': '⏹️',
+    'exception': '⚠️'
+}
+
+# 优先作为最终结果显示的输出变量
+OUTPUT_KEYS = ('text', 'answer', 'result', 'output')
+
+
+class WorkflowProgress:
+    """根据归一化事件维护进度状态并渲染卡片内容"""
+
+    def __init__(self, title: str = "工作流", max_nodes: int = 8):
+        """
+        初始化进度状态
+
+        Args:
+            title: 卡片标题
+            max_nodes: 最多显示的节点数，超出时只显示最近的节点
+        """
+        self.title = title
+        self.max_nodes = max_nodes
+        self.workflow_run_id: Optional[str] = None
+        self.status = 'pending'
+        self.started_at: Optional[float] = None
+        self.elapsed: Optional[float] = None
+        self.error: Optional[str] = None
+        self.outputs: Dict[str, Any] = {}
+        self.conversation_id: Optional[str] = None
+        self.usage: Optional[UsageEvent] = None
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+        self._chunks: List[str] = []
+        self.event_count = 0
+        # 工具调用进度事件数，调用过工具的回复可能依赖实时数据
+        self.tool_events = 0
+        # 显示在卡片末尾的附加信息
+        self.footer = ""
+
+    @property
+    def text(self) -> str:
+        """已流式输出的文本"""
+        return ''.join(self._chunks)
+
+    @property
+    def answer(self) -> str:
+        """最终结果：优先使用流式文本，其次是工作流输出"""
+        text = self.text
+        if text:
+            return text
+        for key in OUTPUT_KEYS:
+            value = self.outputs.get(key)
+            if isinstance(value, str) and value:
+                return value
+        if self.outputs:
+            return json.dumps(self.outputs, ensure_ascii=False, indent=2)
+        return ""
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed', 'stopped')
+
+    @property
+    def plain(self) -> bool:
+        """没有工作流或工具进度时只显示回复文本，如普通聊天应用"""
+        return self.started_at is None and not self._nodes and not self.error
+
+    def feed(self, event: StreamEvent) -> bool:
+        """
+        处理一个归一化事件
+
+        Returns:
+            bool: 卡片内容是否需要更新
+        """
+        self.event_count += 1
+
+        if isinstance(event, DeltaEvent):
+            self._chunks.append(event.text)
+            return True
+
+        if isinstance(event, ProgressEvent):
+            if event.scope == 'workflow':
+                self.workflow_run_id = event.id
+                self.status = 'running'
+                self.started_at = time.time()
+                return True
+            if event.scope == 'tool':
+                self.tool_events += 1
+            node = self._nodes.setdefault(event.id, {'title': event.title or event.id})
+            node['status'] = event.status
+            node['elapsed'] = event.elapsed
+            if event.error:
+                node['error'] = event.error
+            return True
+
+        if isinstance(event, ReplaceEvent):
+            self._chunks = [event.text]
+            return True
+
+        if isinstance(event, UsageEvent):
+            self.usage = event
+            return False
+
+        if isinstance(event, EndEvent):
+            self.conversation_id = event.conversation_id or self.conversation_id
+            if event.scope == 'workflow':
+                self.status = event.status
+                self.elapsed = event.elapsed
+                self.outputs = event.outputs or {}
+            elif not self.finished:
+                self.status = 'succeeded'
+            return True
+
+        if isinstance(event, ErrorEvent):
+            self.status = 'failed'
+            self.error = event.message
+            return True
+
+        return False
+
+    def render(self) -> str:
+        """渲染为卡片Markdown内容"""
+        if self.plain:
+            return f"{self.answer}\n\n{self.footer}" if self.footer else self.answer
+        if self.finished:
+            icon = STATUS_ICONS.get(self.status, '✅')
+            elapsed = self.elapsed
+            state = "已完成" if self.status == 'succeeded' else "执行失败"
+        else:
+            icon = STATUS_ICONS['running']
+            elapsed = time.time() - self.started_at if self.started_at else None
+            state = "运行中" if self.started_at or self._nodes else "等待开始"
+        header = f"**{icon} {self.title}{state}**"
+        if elapsed is not None:
+            header += f" · {elapsed:.1f}秒"
+        lines = [header, ""]
+
+        nodes = list(self._nodes.values())
+        if len(nodes) > self.max_nodes:
+            lines.append(f"- … 已完成 {len(nodes) - self.max_nodes} 个节点")
+            nodes = nodes[-self.max_nodes:]
+        for node in nodes:
+            line = f"- {STATUS_ICONS.get(node.get('status'), '•')} {node['title']}"
+            if node.get('elapsed') is not None:
+                line += f" ({node['elapsed']:.1f}秒)"
+            if node.get('error'):
+                line += f": {node['error']}"
+            lines.append(line)
+
+        if self.error:
+            lines.extend(["", f"⚠️ {self.error}"])
+
+        answer = self.answer if self.finished else self.text
+        if answer:
+            lines.extend(["", "---", "", answer])
+        if self.footer:
+            lines.extend(["", self.footer])
+        return '\n'.join(lines)
+
+    async def consume(self, events: AsyncIterator[StreamEvent], pump: Optional[CardUpdatePump] = None,
+                      logger: logging.Logger = app_logger) -> "WorkflowProgress":
+        """
+        读取归一化事件流，内容变化时交给卡片更新任务
+
+        只有回复文本时按增量推送，与聊天回复相同；出现进度或替换后改为整体渲染
+
+        Args:
+            events: stream_events 或 normalize_stream 返回的事件迭代器
+            pump: 卡片更新任务；为None时只收集结果
+            logger: 日志记录器
+        """
+        async for event in events:
+            if not self.feed(event) or pump is None:
+                continue
+            if self.plain and isinstance(event, DeltaEvent):
+                pump.push(event.text)
+            elif not self.plain or isinstance(event, ReplaceEvent):
+                pump.set(self.render())
+        if pump is not None and not self.plain:
+            pump.set(self.render())
+        usage = self.usage.total_tokens if self.usage else 0
+        logger.info(f"Dify事件处理完成: 事件数={self.event_count}, 节点数={len(self._nodes)}, 状态={self.status}, tokens={usage}")
+        return self
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""内容索引测试"""
+
+import unittest
+
+from utils.content_index import ContentIndex
+
+
+class ContentIndexTest(unittest.TestCase):
+
+    def test_forwarded_alias_reuses_record(self):
+        index = ContentIndex()
+        index.record('sha256:a', 10, aliases=['space:1'], dify_file_id='dify-1',
+                     union_id='u1', drive={'file_id': 'f1'})
+
+        digest, record = index.lookup_alias('space:1')
+        self.assertEqual(digest, 'sha256:a')
+        self.assertEqual(record['dify_file_id'], 'dify-1')
+        self.assertEqual(record['drive'], {'u1': {'file_id': 'f1'}})
+        self.assertEqual(index.lookup_alias('space:2'), (None, None))
+
+    def test_same_content_under_new_alias_merges_entry(self):
+        """重新发送的同一文件别名不同，上传后合并到已有条目"""
+        index = ContentIndex()
+        index.record('sha256:a', 10, aliases=['space:1'], dify_file_id='dify-1')
+        index.record('sha256:a', 10, aliases=['space:2'], union_id='u2', drive={'file_id': 'f2'})
+
+        _, record = index.lookup_alias('space:1')
+        self.assertEqual(record['dify_file_id'], 'dify-1')
+        self.assertEqual(record['drive'], {'u2': {'file_id': 'f2'}})
+        self.assertEqual(index.get_stats()['entries'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
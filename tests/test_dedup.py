@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""消息去重测试"""
+
+import unittest
+
+from utils.dedup import TTLSet
+
+
+class TTLSetTest(unittest.TestCase):
+
+    def test_burst_in_one_bucket_respects_max_entries(self):
+        """同一时间桶内的突发也不超过条目数上限，淘汰最早加入的键"""
+        seen = TTLSet(ttl=600, bucket_count=10, max_entries=100)
+        for i in range(1000):
+            self.assertTrue(seen.add(f"msg-{i}", now=1000.0))
+            self.assertLessEqual(len(seen), 100)
+        self.assertEqual(seen.evictions, 900)
+        self.assertFalse(seen.add("msg-999", now=1000.0))
+        self.assertTrue(seen.add("msg-0", now=1000.0))
+
+    def test_expired_buckets_are_dropped(self):
+        seen = TTLSet(ttl=60, bucket_count=6, max_entries=100)
+        seen.add("old", now=0.0)
+        seen.add("new", now=70.0)
+        self.assertFalse(seen.add("new", now=71.0))
+        self.assertTrue(seen.add("old", now=71.0))
+        self.assertEqual(seen.evictions, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
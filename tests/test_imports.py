@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""各包单独导入测试：在新进程中导入，避免已加载的模块掩盖循环导入"""
+
+import os
+import sys
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImportTest(unittest.TestCase):
+
+    def assert_imports(self, statement: str):
+        result = subprocess.run([sys.executable, '-c', statement], cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, f"{statement}\n{result.stderr}")
+
+    def test_dingtalk_first(self):
+        self.assert_imports("import dingtalk")
+
+    def test_dingtalk_auth_first(self):
+        self.assert_imports("from dingtalk.auth import DingTalkAuth")
+
+    def test_other_packages_first(self):
+        for package in ('utils', 'dify', 'adapter', 'handlers'):
+            with self.subTest(package=package):
+                self.assert_imports(f"import {package}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""相似问题索引测试"""
+
+import unittest
+
+from dify.query_similarity import SimilarityIndex
+
+
+class SimilarityIndexTest(unittest.TestCase):
+
+    def _index(self, content_guard=True):
+        index = SimilarityIndex(threshold=0.5, content_guard=content_guard)
+        index.add('vpn-bj', 'app', '北京办公室的VPN地址是什么')
+        index.add('printer', 'app', '打印机怎么连接')
+        return index
+
+    def setUp(self):
+        self.index = self._index()
+
+    def test_rephrased_question_matches(self):
+        self.assertEqual(self.index.query('app', '北京办公室vpn地址是多少')[0], 'vpn-bj')
+        self.assertEqual(self.index.query('app', '如何连接打印机')[0], 'printer')
+
+    def test_question_differing_in_key_word_does_not_match(self):
+        """只差一个关键词的问题字面相似度超过阈值，但不是同一个问题"""
+        unguarded = self._index(content_guard=False)
+        self.assertEqual(unguarded.query('app', '打印机怎么断开连接')[0], 'printer')
+
+        self.assertIsNone(self.index.query('app', '打印机怎么断开连接'))
+        self.assertIsNone(self.index.query('app', '上海办公室的VPN地址是什么'))
+        self.assertEqual(self.index.get_stats()['guarded'], 1)
+
+    def test_scopes_are_isolated(self):
+        self.assertIsNone(self.index.query('other-app', '北京办公室的VPN地址是什么'))
+
+
+if __name__ == '__main__':
+    unittest.main()
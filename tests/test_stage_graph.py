@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""阶段依赖图测试"""
+
+import asyncio
+import unittest
+
+from utils.stage_graph import StageGraph, StageSkipped
+
+
+class StageGraphTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_failed_producer_fails_unresolved_signals(self):
+        """提供信号的阶段失败时，等待信号的阶段被跳过而不是挂起"""
+        graph = StageGraph("test")
+        graph.add_signal('drive')
+        graph.add_signal('dify_file')
+
+        async def transfer(_):
+            graph.resolve('dify_file', 'file-1')
+            raise RuntimeError("上传失败")
+
+        async def consume(deps):
+            return deps
+
+        graph.add('transfer', transfer, provides=['drive', 'dify_file'])
+        graph.add('drive_reply', consume, deps=['drive'])
+        graph.add('analysis', consume, deps=['dify_file'])
+        results = await asyncio.wait_for(graph.run(), 3)
+
+        self.assertIsInstance(results['transfer'], RuntimeError)
+        self.assertIsInstance(results['drive'], RuntimeError)
+        self.assertIsInstance(results['drive_reply'], StageSkipped)
+        self.assertEqual(results['dify_file'], 'file-1')
+        self.assertEqual(results['analysis'], {'dify_file': 'file-1'})
+
+    async def test_producer_finishing_without_resolving_fails_signal(self):
+        graph = StageGraph("test")
+        graph.add_signal('drive')
+
+        async def transfer(_):
+            return None
+
+        async def consume(deps):
+            return deps
+
+        graph.add('transfer', transfer, provides=['drive'])
+        graph.add('drive_reply', consume, deps=['drive'])
+        results = await asyncio.wait_for(graph.run(), 3)
+
+        self.assertIsInstance(results['drive'], StageSkipped)
+        self.assertIsInstance(results['drive_reply'], StageSkipped)
+
+    async def test_timeout_cancels_pending_stages(self):
+        graph = StageGraph("test")
+        graph.add_signal('drive')
+
+        async def consume(deps):
+            return deps
+
+        graph.add('drive_reply', consume, deps=['drive'])
+        results = await asyncio.wait_for(graph.run(timeout=0.1), 3)
+
+        self.assertIsInstance(results['drive'], StageSkipped)
+        self.assertIsInstance(results['drive_reply'], StageSkipped)
+
+
+if __name__ == '__main__':
+    unittest.main()
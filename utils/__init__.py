@@ -1,8 +1,20 @@
 from .logger import app_logger, dingtalk_logger, dify_logger, setup_logger
 from .ssl_utils import SSLUtils
 from .dingtalk_client import DingTalkClient, get_union_id_with_client, get_user_info_with_client
+from .task_registry import BackgroundTaskRegistry
+from .dedup import TTLSet, MessageDeduplicator
+from .http_transport import HTTPTransport, get_transport
+from .stream_fanout import StreamFanout
+from .content_index import ContentIndex, HashingStream, get_content_index
+from .stage_graph import StageGraph, StageSkipped
+from .conversation_scheduler import ConversationScheduler
+from .state_store import StateStore, SQLiteStateStore, get_state_store
 
 __all__ = [
     'app_logger', 'dingtalk_logger', 'dify_logger', 'setup_logger', 
-    'SSLUtils', 'DingTalkClient', 'get_union_id_with_client', 'get_user_info_with_client'
+    'SSLUtils', 'DingTalkClient', 'get_union_id_with_client', 'get_user_info_with_client',
+    'BackgroundTaskRegistry', 'TTLSet', 'MessageDeduplicator', 'HTTPTransport', 'get_transport',
+    'StreamFanout', 'ContentIndex', 'HashingStream', 'get_content_index',
+    'StageGraph', 'StageSkipped', 'ConversationScheduler',
+    'StateStore', 'SQLiteStateStore', 'get_state_store'
 ] 
\ No newline at end of file
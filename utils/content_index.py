@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内容寻址的上传索引
+
+同一个文件被转发到多个群时，复用已上传到Dify和钉钉云盘的结果：
+1. 摘要 -> 各上传目标的远端标识（Dify文件ID、按unionId区分的云盘dentry）
+2. 别名（消息中的 spaceId:fileId）-> 摘要，转发的消息别名不变，不下载即可命中
+3. 摘要在文件流经时增量计算，不额外读取文件；算出摘要时上传已经完成，
+   所以只在记录时合并同一内容的条目，不按摘要跳过上传。内容相同但重新发送的文件
+   别名不同，仍会完整上传一次
+4. TTL + LRU 有界，远端标识失效时按目标单独作废
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from config.settings import settings
+
+
+class HashingStream:
+    """在字节流经过时计算摘要和长度"""
+
+    def __init__(self, chunks: AsyncIterator[bytes], algorithm: str = "sha256"):
+        self.chunks = chunks
+        self._hash = hashlib.new(algorithm)
+        self.size = 0
+        self.completed = False
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[bytes]:
+        async for chunk in self.chunks:
+            self._hash.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+        self.completed = True
+
+    @property
+    def digest(self) -> Optional[str]:
+        """只有完整读完的流才有摘要"""
+        return f"{self._hash.name}:{self._hash.hexdigest()}" if self.completed else None
+
+
+class ContentIndex:
+    """内容摘要 -> 远端上传结果的有界索引"""
+
+    def __init__(self, ttl: float = 604800, max_entries: int = 10000):
+        """
+        初始化索引
+
+        Args:
+            ttl: 条目有效期(秒)，应短于远端文件的保留时间
+            max_entries: 摘要条目数上限，超出时淘汰最久未使用的条目
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # 摘要 -> (写入时间, {'size': int, 'dify_file_id': str, 'drive': {unionId: dentry信息}})
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # 别名 -> 摘要
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'alias_hits': 0,
+            'alias_misses': 0,
+            'records': 0,
+            'invalidations': 0,
+            'evictions': 0
+        }
+
+    def _get_entry(self, digest: str) -> Optional[Dict[str, Any]]:
+        """调用方须持有锁"""
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return entry[1]
+
+    def lookup_alias(self, alias: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """按别名查询，返回 (摘要, 条目)"""
+        with self._lock:
+            digest = self._aliases.get(alias)
+            record = self._get_entry(digest) if digest else None
+            if record is None:
+                self._aliases.pop(alias, None)
+                self._stats['alias_misses'] += 1
+                return None, None
+            self._aliases.move_to_end(alias)
+            self._stats['alias_hits'] += 1
+            return digest, dict(record, drive=dict(record['drive']))
+
+    def record(self, digest: str, size: int, aliases: Iterable[str] = (),
+               dify_file_id: Optional[str] = None, union_id: Optional[str] = None,
+               drive: Optional[Dict[str, Any]] = None):
+        """
+        记录上传结果，已有条目时合并
+
+        Args:
+            digest: 内容摘要
+            size: 文件大小
+            aliases: 指向该内容的别名
+            dify_file_id: Dify文件ID
+            union_id: 云盘上传所属用户
+            drive: 云盘上传结果（file_id、space_id、doc_url）
+        """
+        with self._lock:
+            record = self._get_entry(digest) or {'size': size, 'dify_file_id': None, 'drive': {}}
+            if dify_file_id:
+                record['dify_file_id'] = dify_file_id
+            if union_id and drive:
+                record['drive'][union_id] = drive
+            self._entries[digest] = (time.time(), record)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+            for alias in aliases:
+                self._aliases[alias] = digest
+                self._aliases.move_to_end(alias)
+            # 别名只指向摘要，数量与摘要条目保持同一量级
+            while len(self._aliases) > self.max_entries * 2:
+                self._aliases.popitem(last=False)
+            self._stats['records'] += 1
+
+    def invalidate(self, digest: str, target: str, union_id: Optional[str] = None):
+        """
+        远端标识已失效时作废对应目标
+
+        Args:
+            digest: 内容摘要
+            target: 'dify' 或 'drive'
+            union_id: target 为 'drive' 时的用户
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return
+            record = entry[1]
+            if target == 'dify':
+                record['dify_file_id'] = None
+            elif target == 'drive':
+                record['drive'].pop(union_id, None)
+            self._stats['invalidations'] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取索引统计信息"""
+        stats = dict(self._stats)
+        stats['entries'] = len(self._entries)
+        stats['aliases'] = len(self._aliases)
+        return stats
+
+
+_index: Optional[ContentIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_content_index() -> ContentIndex:
+    """获取进程内共享的内容索引"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ContentIndex(
+                    ttl=settings.CONTENT_INDEX_TTL,
+                    max_entries=settings.CONTENT_INDEX_MAX_ENTRIES
+                )
+    return _index
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按会话串行的任务调度器
+
+同一会话的消息严格按到达顺序逐条处理，不同会话之间并行：
+1. 每个会话一个FIFO队列，同一时刻最多只有一条消息在处理
+2. 有界的工作协程池在有待处理消息的会话之间轮转，单个繁忙会话不会占满所有工作协程
+3. 单会话排队长度有上限，超出时拒绝新消息
+4. 按会话ID散列到固定数量的分片，统计各分片的队列深度和排队等待时间
+5. 关闭时停止接收新消息并等待已排队的消息处理完成
+"""
+
+import time
+import zlib
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from utils.logger import app_logger
+
+
+class _Job:
+    __slots__ = ('name', 'coro_factory', 'future', 'enqueued_at', 'shard')
+
+    def __init__(self, name: str, coro_factory: Callable[[], Awaitable[Any]],
+                 future: asyncio.Future, shard: int):
+        self.name = name
+        self.coro_factory = coro_factory
+        self.future = future
+        self.enqueued_at = time.time()
+        self.shard = shard
+
+
+class ConversationScheduler:
+    """会话内FIFO、会话间并行的有界调度器"""
+
+    def __init__(self, max_workers: int = 50, max_pending_per_conversation: int = 20,
+                 task_timeout: float = 300, shard_count: int = 16,
+                 logger: logging.Logger = app_logger):
+        """
+        初始化调度器
+
+        Args:
+            max_workers: 同时处理的会话数上限
+            max_pending_per_conversation: 单个会话排队(含处理中)的消息数上限
+            task_timeout: 单条消息的最长处理时间(秒)，不包括排队时间
+            shard_count: 统计分片数
+            logger: 日志记录器
+        """
+        self.max_workers = max_workers
+        self.max_pending_per_conversation = max_pending_per_conversation
+        self.task_timeout = task_timeout
+        self.shard_count = max(1, shard_count)
+        self.logger = logger
+
+        # 会话ID -> 待处理消息；会话在字典中时，恰好在就绪队列中或正被一个工作协程处理
+        self._conversations: Dict[str, Deque[_Job]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._closing = False
+        self._running = 0
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'cancelled': 0,
+            'rejected': 0
+        }
+        self._shards = [self._new_shard_stats() for _ in range(self.shard_count)]
+
+    @staticmethod
+    def _new_shard_stats() -> Dict[str, Any]:
+        return {
+            'depth': 0,
+            'max_depth': 0,
+            'submitted': 0,
+            'started': 0,
+            'completed': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'run_total': 0.0
+        }
+
+    @property
+    def closing(self) -> bool:
+        """是否已停止接收新消息"""
+        return self._closing
+
+    def shard_of(self, conversation_id: str) -> int:
+        """会话所属的统计分片，使用稳定散列，重启后保持一致"""
+        return zlib.crc32(conversation_id.encode('utf-8')) % self.shard_count
+
+    def _ensure_workers(self):
+        """在当前事件循环中按需创建就绪队列和工作协程"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._ready = asyncio.Queue()
+            self._idle = asyncio.Event()
+            self._workers = set()
+        while len(self._workers) < self.max_workers:
+            worker = loop.create_task(self._worker(), name=f"conversation-worker-{len(self._workers)}")
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+    def submit(self, conversation_id: str, name: str,
+               coro_factory: Callable[[], Awaitable[Any]]) -> Optional[asyncio.Future]:
+        """
+        提交消息处理任务
+
+        Args:
+            conversation_id: 会话ID，同一会话的任务按提交顺序逐个执行
+            name: 任务名称，用于日志
+            coro_factory: 返回协程的工厂函数，轮到该任务时才会调用
+
+        Returns:
+            Optional[asyncio.Future]: 任务完成时得到协程的返回值，失败或超时为None；
+                调度器关闭或会话排队已满时返回None
+        """
+        if self._closing:
+            self._stats['rejected'] += 1
+            self.logger.warning(f"会话调度器正在关闭，拒绝任务: {name}")
+            return None
+
+        pending = self._conversations.get(conversation_id)
+        if pending is not None and len(pending) >= self.max_pending_per_conversation:
+            self._stats['rejected'] += 1
+            self.logger.warning(f"会话 {conversation_id} 排队消息已达上限({self.max_pending_per_conversation})，拒绝任务: {name}")
+            return None
+
+        self._ensure_workers()
+        shard = self.shard_of(conversation_id)
+        job = _Job(name, coro_factory, self._loop.create_future(), shard)
+        if pending is None:
+            pending = self._conversations[conversation_id] = deque()
+            self._ready.put_nowait(conversation_id)
+        pending.append(job)
+        self._idle.clear()
+
+        self._stats['submitted'] += 1
+        shard_stats = self._shards[shard]
+        shard_stats['submitted'] += 1
+        shard_stats['depth'] += 1
+        shard_stats['max_depth'] = max(shard_stats['max_depth'], shard_stats['depth'])
+        return job.future
+
+    async def _worker(self):
+        """取出一个就绪会话，处理其队首消息；会话仍有消息时放回就绪队列末尾"""
+        while True:
+            conversation_id = await self._ready.get()
+            pending = self._conversations[conversation_id]
+            job = pending[0]
+            try:
+                await self._run(job)
+            finally:
+                pending.popleft()
+                self._shards[job.shard]['depth'] -= 1
+                if pending:
+                    self._ready.put_nowait(conversation_id)
+                else:
+                    del self._conversations[conversation_id]
+                    if not self._conversations:
+                        self._idle.set()
+
+    async def _run(self, job: _Job):
+        """执行任务并记录结果，异常不影响同一会话的后续消息"""
+        shard_stats = self._shards[job.shard]
+        started_at = time.time()
+        wait_time = started_at - job.enqueued_at
+        shard_stats['started'] += 1
+        shard_stats['wait_total'] += wait_time
+        shard_stats['wait_max'] = max(shard_stats['wait_max'], wait_time)
+        if wait_time > 1:
+            self.logger.info(f"任务 {job.name} 排队 {wait_time:.3f}秒后开始执行")
+
+        self._running += 1
+        result = None
+        try:
+            result = await asyncio.wait_for(job.coro_factory(), timeout=self.task_timeout)
+            self._stats['completed'] += 1
+        except asyncio.TimeoutError:
+            self._stats['timed_out'] += 1
+            self.logger.error(f"任务 {job.name} 超时({self.task_timeout}秒)，已取消")
+        except asyncio.CancelledError:
+            self._stats['cancelled'] += 1
+            self.logger.warning(f"任务 {job.name} 被取消")
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self._stats['failed'] += 1
+            self.logger.exception(f"任务 {job.name} 执行异常: {str(e)}")
+        finally:
+            self._running -= 1
+            shard_stats['completed'] += 1
+            shard_stats['run_total'] += time.time() - started_at
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def drain(self, timeout: float = 30) -> bool:
+        """
+        停止接收新消息，并等待已排队的消息处理完成
+
+        Args:
+            timeout: 最长等待时间(秒)，超时后取消剩余任务
+
+        Returns:
+            bool: 所有消息是否在超时前处理完成
+        """
+        self._closing = True
+        if not self._workers:
+            return True
+
+        finished = True
+        if self._conversations:
+            queued = sum(len(pending) for pending in self._conversations.values())
+            self.logger.info(f"等待 {len(self._conversations)} 个会话的 {queued} 条消息处理完成，最长 {timeout} 秒")
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+                self.logger.info("所有会话消息已处理完成")
+            except asyncio.TimeoutError:
+                finished = False
+                self.logger.warning(f"仍有 {len(self._conversations)} 个会话的消息未处理完成，正在取消")
+
+        workers = list(self._workers)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # 未轮到的消息不再执行
+        for pending in self._conversations.values():
+            for job in pending:
+                job.future.cancel()
+        self._conversations.clear()
+        return finished
+
+    def get_shard_stats(self) -> List[Dict[str, Any]]:
+        """获取各分片的队列深度、排队等待时间和处理时间"""
+        shards = []
+        for index, shard in enumerate(self._shards):
+            started = shard['started']
+            shards.append({
+                'shard': index,
+                'depth': shard['depth'],
+                'max_depth': shard['max_depth'],
+                'submitted': shard['submitted'],
+                'completed': shard['completed'],
+                'avg_wait': round(shard['wait_total'] / started, 3) if started else 0.0,
+                'max_wait': round(shard['wait_max'], 3),
+                'avg_run': round(shard['run_total'] / shard['completed'], 3) if shard['completed'] else 0.0
+            })
+        return shards
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息，分片只列出处理过消息的分片"""
+        stats = dict(self._stats)
+        stats['conversations'] = len(self._conversations)
+        stats['running'] = self._running
+        stats['queued'] = sum(len(pending) for pending in self._conversations.values()) - self._running
+        stats['workers'] = len(self._workers)
+        stats['shards'] = [shard for shard in self.get_shard_stats() if shard['submitted']]
+        return stats
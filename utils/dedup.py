@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+消息去重模块
+
+钉钉在处理缓慢或连接重连时会重复投递同一条回调，
+本模块按msgId去重，在任何网络I/O之前丢弃重复消息：
+1. 按时间分桶的TTL集合，插入和查询均为O(1)
+2. 整桶过期，无需逐条扫描
+3. 条目数上限始终有效：超出时提前淘汰最旧的桶，突发全部落在当前桶时淘汰桶内最早的键
+4. 统计命中、未命中和淘汰次数
+"""
+
+import time
+import threading
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from utils.logger import app_logger
+
+
+class TTLSet:
+    """按时间分桶的TTL集合"""
+
+    def __init__(self, ttl: float = 600, bucket_count: int = 10, max_entries: int = 100000):
+        """
+        初始化TTL集合
+
+        Args:
+            ttl: 条目存活时间(秒)，实际存活时间在 ttl 与 ttl + ttl/bucket_count 之间
+            bucket_count: 时间桶数量
+            max_entries: 条目数上限
+        """
+        self.ttl = ttl
+        self.bucket_count = bucket_count
+        self.bucket_width = ttl / bucket_count
+        self.max_entries = max_entries
+        # 键 -> 所在桶序号
+        self._index: Dict[str, int] = {}
+        # (桶序号, 桶内键)，按时间从旧到新排列
+        self._buckets: Deque[Tuple[int, Deque[str]]] = deque()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _current_bucket(self, now: float) -> int:
+        return int(now // self.bucket_width)
+
+    def _expire(self, current: int):
+        """淘汰过期的桶和超出容量的最旧桶"""
+        oldest_live = current - self.bucket_count
+        while self._buckets:
+            over_capacity = len(self._index) > self.max_entries
+            if self._buckets[0][0] > oldest_live and not over_capacity:
+                break
+            seq, keys = self._buckets[0]
+            expired = seq <= oldest_live
+            if not expired and len(self._buckets) == 1:
+                # 只剩当前桶时逐个淘汰桶内最早加入的键，不整桶清空
+                while keys and len(self._index) > self.max_entries:
+                    key = keys.popleft()
+                    if self._index.get(key) == seq:
+                        del self._index[key]
+                        self.evictions += 1
+                if not keys:
+                    self._buckets.popleft()
+                break
+            self._buckets.popleft()
+            for key in keys:
+                # 键可能已被重新加入更新的桶，只删除仍指向本桶的索引
+                if self._index.get(key) == seq:
+                    del self._index[key]
+                    if not expired:
+                        self.evictions += 1
+
+    def add(self, key: str, now: Optional[float] = None) -> bool:
+        """
+        加入键
+
+        Returns:
+            bool: 键是新加入的返回True，已存在（命中）返回False
+        """
+        now = time.time() if now is None else now
+        current = self._current_bucket(now)
+        with self._lock:
+            self._expire(current)
+
+            if key in self._index:
+                self.hits += 1
+                return False
+
+            self.misses += 1
+            if not self._buckets or self._buckets[-1][0] != current:
+                self._buckets.append((current, deque()))
+            self._buckets[-1][1].append(key)
+            self._index[key] = current
+            if len(self._index) > self.max_entries:
+                self._expire(current)
+            return True
+
+    def discard(self, key: str):
+        """移除键，桶内残留的键在整桶过期时一并清理"""
+        with self._lock:
+            self._index.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        current = self._current_bucket(time.time())
+        with self._lock:
+            seq = self._index.get(key)
+            return seq is not None and seq > current - self.bucket_count
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取统计信息"""
+        return {
+            'size': len(self._index),
+            'buckets': len(self._buckets),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class MessageDeduplicator:
+    """按msgId去重的入站消息过滤器"""
+
+    def __init__(self, ttl: float = 600, max_entries: int = 100000,
+                 logger: logging.Logger = app_logger):
+        """
+        初始化消息去重器
+
+        Args:
+            ttl: msgId保留时间(秒)，应覆盖钉钉的重投窗口
+            max_entries: 保留的msgId数量上限
+            logger: 日志记录器
+        """
+        self.seen = TTLSet(ttl=ttl, max_entries=max_entries)
+        self.logger = logger
+
+    def is_duplicate(self, message_id: str) -> bool:
+        """检查并登记msgId，重复投递返回True"""
+        if not message_id:
+            return False
+        if self.seen.add(message_id):
+            return False
+        self.logger.info(f"丢弃重复投递的消息 {message_id}，累计命中 {self.seen.hits} 次")
+        return True
+
+    def forget(self, message_id: str):
+        """处理失败时移除msgId，允许钉钉重投的消息再次处理"""
+        if message_id:
+            self.seen.discard(message_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取去重统计信息"""
+        return self.seen.get_stats()
@@ -11,10 +11,11 @@
 """
 
 import os
-import requests
 from typing import Optional, Dict, Any
 import logging
 
+from utils.http_transport import get_transport
+
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
@@ -32,8 +33,14 @@ class DingTalkClient:
         """
         self.app_key = app_key
         self.app_secret = app_secret
-        self.access_token = None
-        self._token_expires_at = 0
+        # dingtalk 包在导入时依赖 utils，在这里导入以免 utils 包初始化时形成循环导入
+        from dingtalk.token_manager import get_token_manager
+        # 同一凭证共享令牌管理器，不再每个客户端各自获取令牌
+        self.token_manager = get_token_manager(app_key, app_secret)
+        
+    @property
+    def access_token(self) -> Optional[str]:
+        return self.token_manager.access_token
         
     def get_access_token(self) -> Optional[str]:
         """
@@ -43,37 +50,11 @@ class DingTalkClient:
             Optional[str]: 访问令牌，失败时返回None
         """
         try:
-            # 使用钉钉API获取访问令牌
-            url = "https://oapi.dingtalk.com/gettoken"
-            params = {
-                "appkey": self.app_key,
-                "appsecret": self.app_secret
-            }
-            
-            response = requests.get(url, params=params, timeout=10, verify=False)
-            result = response.json()
-            logger.debug(f"获取访问令牌响应: {result}")
-            
-            if result.get("errcode") == 0 and 'access_token' in result:
-                self.access_token = result['access_token']
-                # 设置令牌过期时间（钉钉令牌有效期为2小时）
-                import time
-                self._token_expires_at = time.time() + 7200  # 2小时
-                logger.info("✅ 成功获取钉钉访问令牌")
-                return self.access_token
-            else:
-                logger.error(f"获取访问令牌失败: {result}")
-                return None
+            return self.token_manager.get_token()
         except Exception as e:
             logger.error(f"获取访问令牌异常: {e}")
             return None
     
-    def _is_token_valid(self) -> bool:
-        """检查访问令牌是否有效"""
-        import time
-        return (self.access_token is not None and 
-                time.time() < self._token_expires_at)
-    
     def get_user_info(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
         获取用户信息
@@ -85,20 +66,19 @@ class DingTalkClient:
             Optional[Dict[str, Any]]: 用户信息，失败时返回None
         """
         try:
-            # 检查并获取访问令牌
-            if not self._is_token_valid():
-                self.access_token = self.get_access_token()
-                if not self.access_token:
-                    return None
+            # 获取访问令牌，有效期内直接使用缓存
+            access_token = self.get_access_token()
+            if not access_token:
+                return None
             
             # 使用钉钉API获取用户信息
             url = "https://oapi.dingtalk.com/user/get"
             params = {
-                "access_token": self.access_token,
+                "access_token": access_token,
                 "userid": user_id
             }
             
-            response = requests.get(url, params=params, timeout=10, verify=False)
+            response = get_transport().get(url, params=params, timeout=10)
             result = response.json()
             logger.debug(f"获取用户信息响应: {result}")
             
@@ -148,20 +128,19 @@ class DingTalkClient:
             Optional[Dict[str, Any]]: 用户信息，失败时返回None
         """
         try:
-            # 检查并获取访问令牌
-            if not self._is_token_valid():
-                self.access_token = self.get_access_token()
-                if not self.access_token:
-                    return None
+            # 获取访问令牌，有效期内直接使用缓存
+            access_token = self.get_access_token()
+            if not access_token:
+                return None
             
             # 使用钉钉API根据unionId获取用户信息
             url = "https://oapi.dingtalk.com/user/getbyunionid"
             params = {
-                "access_token": self.access_token,
+                "access_token": access_token,
                 "unionid": union_id
             }
             
-            response = requests.get(url, params=params, timeout=10, verify=False)
+            response = get_transport().get(url, params=params, timeout=10)
             result = response.json()
             logger.debug(f"根据unionId获取用户信息响应: {result}")
             
@@ -190,8 +169,9 @@ def get_union_id_with_client(user_id: str, app_key: str, app_secret: str) -> Opt
         Optional[str]: 用户unionId，失败时返回None
     """
     try:
-        client = DingTalkClient(app_key, app_secret)
-        return client.get_user_union_id(user_id)
+        # 优先命中共享用户目录，未命中时才调用钉钉接口
+        from dingtalk.user_directory import get_user_directory
+        return get_user_directory(app_key, app_secret).get_union_id(user_id)
     except Exception as e:
         logger.error(f"使用钉钉客户端获取unionId失败: {e}")
         return None
@@ -210,8 +190,9 @@ def get_user_info_with_client(user_id: str, app_key: str, app_secret: str) -> Op
         Optional[Dict[str, Any]]: 用户信息，失败时返回None
     """
     try:
-        client = DingTalkClient(app_key, app_secret)
-        return client.get_user_info(user_id)
+        # 返回用户目录中缓存的身份字段: userid、unionid、name、department
+        from dingtalk.user_directory import get_user_directory
+        return get_user_directory(app_key, app_secret).lookup(user_id)
     except Exception as e:
         logger.error(f"使用钉钉客户端获取用户信息失败: {e}")
         return None
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共享HTTP传输层
+
+所有对外HTTP调用（钉钉开放平台、钉钉资源服务器、Dify）统一经过本模块：
+1. 按主机划分的长连接池，复用TCP连接和TLS会话，不再每次请求重新握手
+2. 同步请求基于requests，异步请求基于aiohttp，连接池大小和超时统一配置
+3. 仅对建立连接失败自动重试，不会重复提交已发出的请求
+4. 按主机统计请求数、失败数和平均耗时，并暴露连接池占用情况
+"""
+
+import time
+import asyncio
+import threading
+import logging
+import urllib3
+import aiohttp
+import requests
+from urllib.parse import urlsplit
+from typing import Any, Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config.settings import settings
+from utils.logger import app_logger
+
+
+class HTTPTransport:
+    """按主机划分连接池的共享HTTP传输层"""
+
+    def __init__(self, pool_maxsize: int = 20, max_retries: int = 3,
+                 connect_timeout: float = 5, read_timeout: float = 30,
+                 async_pool_size: int = 100, keepalive_timeout: float = 30,
+                 verify: bool = False, logger: logging.Logger = app_logger):
+        """
+        初始化传输层
+
+        Args:
+            pool_maxsize: 每个主机保持的长连接数上限
+            max_retries: 建立连接失败时的重试次数
+            connect_timeout: 建立连接超时(秒)
+            read_timeout: 默认读取超时(秒)，调用方可按请求覆盖
+            async_pool_size: 异步连接池总连接数上限
+            keepalive_timeout: 异步连接池空闲连接保活时间(秒)
+            verify: 是否校验服务端证书
+            logger: 日志记录器
+        """
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.async_pool_size = async_pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.verify = verify
+        self.logger = logger
+
+        # 主机 -> requests会话，每个会话挂载独立的连接池
+        self._sessions: Dict[str, requests.Session] = {}
+        # 名称 -> (aiohttp会话, 所属事件循环)
+        self._async_sessions: Dict[str, Tuple[aiohttp.ClientSession, asyncio.AbstractEventLoop]] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+        if not verify:
+            urllib3.disable_warnings()
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _create_session(self, host: str) -> requests.Session:
+        """为主机创建带长连接池的会话"""
+        # 只重试连接阶段的失败，已发出的请求不重复提交
+        retry = Retry(total=self.max_retries, connect=self.max_retries, read=0, status=0,
+                      backoff_factor=0.5, allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=False
+        )
+        session = requests.Session()
+        session.verify = self.verify
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.logger.info(f"创建HTTP连接池: {host}, 最大连接数={self.pool_maxsize}")
+        return session
+
+    def session(self, url: str) -> requests.Session:
+        """获取目标主机的共享会话"""
+        host = self._host_key(url)
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = self._create_session(host)
+                    self._sessions[host] = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        发送同步请求
+
+        Args:
+            method: HTTP方法
+            url: 请求地址
+            **kwargs: 透传给requests；timeout 为单个数字时视为读取超时
+
+        Returns:
+            requests.Response: 响应对象
+        """
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+
+        host = self._host_key(url)
+        started_at = time.time()
+        try:
+            response = self.session(url).request(method, url, timeout=timeout, **kwargs)
+            self._record(host, time.time() - started_at, response.status_code >= 500)
+            return response
+        except Exception:
+            self._record(host, time.time() - started_at, True)
+            raise
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def async_session(self, name: str = "default", limit: Optional[int] = None, limit_per_host: int = 0,
+                      keepalive_timeout: Optional[float] = None) -> aiohttp.ClientSession:
+        """
+        获取异步共享会话，在当前事件循环中按需创建
+
+        Args:
+            name: 会话名称，需要独立连接数上限的调用方（如Dify）使用各自的会话
+            limit: 总连接数上限，默认使用 async_pool_size
+            limit_per_host: 单主机连接数上限，0表示不限制
+            keepalive_timeout: 空闲连接保活时间(秒)，默认使用 keepalive_timeout
+        """
+        loop = asyncio.get_running_loop()
+        entry = self._async_sessions.get(name)
+        # 钉钉SDK断线重连时会新建事件循环，旧循环上的连接池不能复用
+        if entry is not None and not entry[0].closed and entry[1] is loop:
+            return entry[0]
+
+        connector = aiohttp.TCPConnector(
+            limit=limit or self.async_pool_size,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout or self.keepalive_timeout,
+            ssl=None if self.verify else False
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.read_timeout)
+        )
+        self._async_sessions[name] = (session, loop)
+        self.logger.info(f"创建异步HTTP连接池: {name}, 总连接数={connector.limit}, 单主机连接数={limit_per_host}")
+        return session
+
+    async def close_async(self, name: Optional[str] = None):
+        """关闭当前事件循环中的异步会话，name为空时关闭全部"""
+        names = [name] if name else list(self._async_sessions)
+        for key in names:
+            entry = self._async_sessions.pop(key, None)
+            if entry is not None and not entry[0].closed:
+                await entry[0].close()
+
+    def close(self):
+        """关闭所有同步会话"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def _record(self, host: str, elapsed: float, failed: bool):
+        with self._lock:
+            stats = self._stats.setdefault(host, {'requests': 0, 'errors': 0, 'total_time': 0.0})
+            stats['requests'] += 1
+            stats['total_time'] += elapsed
+            if failed:
+                stats['errors'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取按主机统计的请求与连接池信息"""
+        with self._lock:
+            hosts = {}
+            for host, stats in self._stats.items():
+                count = stats['requests']
+                hosts[host] = {
+                    'requests': count,
+                    'errors': stats['errors'],
+                    'avg_latency': stats['total_time'] / count if count else 0.0
+                }
+            for host, session in self._sessions.items():
+                pool_info = hosts.setdefault(host, {'requests': 0, 'errors': 0, 'avg_latency': 0.0})
+                adapter = session.get_adapter(host)
+                pools = adapter.poolmanager.pools
+                pool_info['pools'] = len(pools)
+                # 已建立过的连接数与当前空闲可复用的连接数
+                host_pools = [pools[key] for key in pools.keys()]
+                pool_info['connections'] = sum(pool.num_connections for pool in host_pools)
+                # 连接池队列中用None占位，只统计真实连接
+                pool_info['idle'] = sum(
+                    sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                    for pool in host_pools if pool.pool is not None
+                )
+
+        async_pools = {}
+        for name, (session, _) in self._async_sessions.items():
+            connector = session.connector
+            async_pools[name] = {
+                'closed': session.closed,
+                'limit': connector.limit if connector else 0,
+                'limit_per_host': connector.limit_per_host if connector else 0
+            }
+        return {'hosts': hosts, 'async_pools': async_pools}
+
+
+_transport: Optional[HTTPTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HTTPTransport:
+    """获取进程内共享的传输层实例"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HTTPTransport(
+                    pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                    max_retries=settings.MAX_RETRIES,
+                    connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+                    read_timeout=settings.REQUESTS_TIMEOUT,
+                    async_pool_size=settings.HTTP_ASYNC_POOL_SIZE,
+                    keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+                    verify=settings.SSL_VERIFY
+                )
+    return _transport
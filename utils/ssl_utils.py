@@ -8,7 +8,7 @@ SSL工具模块
 1. SSL配置修复
 2. SSL连接检查
 3. 环境变量设置
-4. 连接池优化
+4. 共享连接池初始化
 """
 
 import os
@@ -24,6 +24,8 @@ from pathlib import Path
 from typing import Dict, Any, Optional
 import logging
 
+from utils.http_transport import get_transport
+
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
@@ -106,26 +108,13 @@ class SSLUtils:
             except Exception as e:
                 logger.warning(f"⚠️ 无法修改requests库设置: {str(e)}")
             
-            # 6. 修改requests默认连接池设置
+            # 6. 初始化共享连接池，所有对外请求复用长连接
             try:
-                # 降低最大连接数并禁用长连接
-                adapter = requests.adapters.HTTPAdapter(
-                    pool_connections=10,  # 连接池连接数
-                    pool_maxsize=10,      # 连接池最大连接数
-                    max_retries=5,        # 最大重试次数
-                    pool_block=False      # 连接池用尽时不阻塞
-                )
-                # 应用适配器到所有连接
-                session = requests.Session()
-                session.mount('http://', adapter)
-                session.mount('https://', adapter)
-                session.verify = False
-                # 将这个session设为默认
-                requests.Session = lambda: session
+                get_transport()
                 results['connection_pool_optimized'] = True
-                logger.info("✅ 已优化requests连接池设置")
+                logger.info("✅ 已初始化共享HTTP连接池")
             except Exception as e:
-                logger.warning(f"⚠️ 无法修改requests连接池设置: {str(e)}")
+                logger.warning(f"⚠️ 无法初始化共享HTTP连接池: {str(e)}")
             
             # 7. 测试连接
             logger.info("正在测试钉钉API连接...")
@@ -134,12 +123,9 @@ class SSLUtils:
                 # 使用自定义的headers
                 headers = {
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.75 Safari/537.36",
-                    "Accept": "*/*",
-                    "Connection": "close"  # 明确禁用keep-alive
+                    "Accept": "*/*"
                 }
-                session = requests.Session()
-                session.verify = False
-                response = session.get(url, headers=headers, timeout=5)
+                response = get_transport().get(url, headers=headers, timeout=5)
                 if response.status_code < 500:  # 允许401等权限错误
                     results['connection_test_passed'] = True
                     logger.info(f"✅ 连接测试成功! 状态码: {response.status_code}")
@@ -218,7 +204,7 @@ class SSLUtils:
                 
                 # 测试连接
                 url = "https://api.dingtalk.com/v1.0/oauth2/accessToken"
-                response = requests.get(url, timeout=5, verify=False)
+                response = get_transport().get(url, timeout=5)
                 results['dingtalk_connection'] = {
                     'status_code': response.status_code,
                     'server': response.headers.get('server', 'Unknown'),
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+阶段依赖图
+
+把一次处理流程拆成有依赖关系的阶段，依赖就绪的阶段立即并行执行：
+1. 普通阶段是协程函数，参数为已完成依赖的结果
+2. 信号阶段没有函数，由其他阶段在中途调用 resolve 提供结果，用于提前放行下游；
+   负责提供信号的阶段结束时仍未提供的信号视为失败，等待信号的阶段不会挂起
+3. 依赖失败的阶段被跳过，失败原因沿依赖传递
+4. 记录每个阶段的开始时间、耗时和状态
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from utils.logger import app_logger
+
+
+class StageSkipped(Exception):
+    """依赖阶段失败，本阶段未执行"""
+
+
+class _Stage:
+    def __init__(self, name: str, func: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]],
+                 deps: List[str], provides: List[str]):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.provides = provides
+        self.future: Optional[asyncio.Future] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.status = 'pending'
+
+
+class StageGraph:
+    """按依赖关系并行执行的阶段图"""
+
+    def __init__(self, name: str = "pipeline", logger: logging.Logger = app_logger):
+        self.name = name
+        self.logger = logger
+        self._stages: Dict[str, _Stage] = {}
+        self._started_at: Optional[float] = None
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Awaitable[Any]], deps: Iterable[str] = (),
+            provides: Iterable[str] = ()):
+        """
+        添加阶段
+
+        Args:
+            name: 阶段名称
+            func: 协程函数，参数为 {依赖名称: 依赖结果}
+            deps: 依赖的阶段名称
+            provides: 由本阶段 resolve 的信号阶段；本阶段结束、失败或被跳过时仍未提供的信号随之失败
+        """
+        self._stages[name] = _Stage(name, func, list(deps), list(provides))
+
+    def add_signal(self, name: str):
+        """添加信号阶段，结果由 resolve 或 fail 提供"""
+        self._stages[name] = _Stage(name, None, [], [])
+
+    def resolve(self, name: str, value: Any = None):
+        """提供信号阶段的结果，重复调用时忽略"""
+        stage = self._stages[name]
+        if not stage.future.done():
+            stage.finished_at = time.time()
+            stage.status = 'done'
+            stage.future.set_result(value)
+
+    def fail(self, name: str, error: BaseException):
+        """让信号阶段失败，下游阶段将被跳过"""
+        stage = self._stages[name]
+        if not stage.future.done():
+            stage.finished_at = time.time()
+            stage.status = 'failed'
+            stage.future.set_exception(error)
+
+    def done(self, name: str) -> bool:
+        """阶段是否已成功完成"""
+        stage = self._stages[name]
+        return stage.future is not None and stage.future.done() and stage.status == 'done'
+
+    def result(self, name: str) -> Any:
+        """已完成阶段的结果，未完成或失败时为None"""
+        return self._stages[name].future.result() if self.done(name) else None
+
+    def _release_signals(self, stage: _Stage, error: BaseException):
+        """让阶段负责但未提供结果的信号失败"""
+        for name in stage.provides:
+            self.fail(name, error)
+
+    async def _run_stage(self, stage: _Stage):
+        deps = {}
+        try:
+            for dep in stage.deps:
+                # 取消本阶段时不能连带取消其他阶段共享的依赖结果
+                deps[dep] = await asyncio.shield(self._stages[dep].future)
+        except asyncio.CancelledError:
+            stage.status = 'cancelled'
+            error = StageSkipped(f"{stage.name}: 已取消")
+            stage.future.set_exception(error)
+            self._release_signals(stage, error)
+            raise
+        except Exception as e:
+            stage.status = 'skipped'
+            error = e if isinstance(e, StageSkipped) else StageSkipped(f"{dep}: {str(e)}")
+            stage.future.set_exception(error)
+            self._release_signals(stage, error)
+            return
+
+        stage.started_at = time.time()
+        stage.status = 'running'
+        try:
+            result = await stage.func(deps)
+        except asyncio.CancelledError:
+            stage.status = 'cancelled'
+            stage.finished_at = time.time()
+            stage.future.set_exception(StageSkipped(f"{stage.name}: 已取消"))
+            self._release_signals(stage, StageSkipped(f"{stage.name}: 已取消"))
+            raise
+        except Exception as e:
+            stage.status = 'failed'
+            stage.finished_at = time.time()
+            self.logger.error(f"{self.name} 阶段 {stage.name} 失败: {str(e)}")
+            stage.future.set_exception(e)
+            self._release_signals(stage, e)
+            return
+        stage.status = 'done'
+        stage.finished_at = time.time()
+        stage.future.set_result(result)
+        self._release_signals(stage, StageSkipped(f"{stage.name}: 结束时未提供结果"))
+
+    async def run(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        执行所有阶段，直到全部完成、失败或被跳过
+
+        Args:
+            timeout: 整体超时(秒)，超时后取消未完成的阶段
+
+        Returns:
+            Dict[str, Any]: 阶段名称 -> 结果，失败或跳过的阶段为异常对象
+        """
+        loop = asyncio.get_running_loop()
+        self._started_at = time.time()
+        for stage in self._stages.values():
+            stage.future = loop.create_future()
+            if stage.func is None:
+                stage.started_at = self._started_at
+                stage.status = 'waiting'
+
+        tasks = [asyncio.create_task(self._run_stage(stage))
+                 for stage in self._stages.values() if stage.func is not None]
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{self.name} 执行超时，取消未完成的阶段")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 没有被提供结果的信号阶段视为失败
+            for stage in self._stages.values():
+                if not stage.future.done():
+                    self.fail(stage.name, StageSkipped(f"{stage.name}: 未完成"))
+                # 未被等待的异常不输出警告
+                stage.future.exception()
+
+        results = {}
+        for name, stage in self._stages.items():
+            error = stage.future.exception()
+            results[name] = error if error is not None else stage.future.result()
+        self.logger.info(f"{self.name} 阶段耗时: {self.get_timings()}")
+        return results
+
+    def get_timings(self) -> Dict[str, Dict[str, Any]]:
+        """获取各阶段相对流程开始的起止时间(秒)和状态"""
+        timings = {}
+        for name, stage in self._stages.items():
+            timing = {'status': stage.status}
+            if stage.started_at is not None and self._started_at is not None:
+                timing['start'] = round(stage.started_at - self._started_at, 3)
+            if stage.finished_at is not None and stage.started_at is not None:
+                timing['duration'] = round(stage.finished_at - stage.started_at, 3)
+            timings[name] = timing
+        return timings
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+状态持久化存储
+
+按命名空间保存会话等进程内状态，重启后可以恢复：
+1. StateStore 定义存储接口，默认实现不做持久化
+2. SQLiteStateStore 使用WAL模式的本地SQLite数据库
+3. 写入先合并到内存中的待写表，由后台线程按批次写入，消息处理路径上没有同步写盘
+4. 读取时先查待写表，再按主键查询，只在首次访问某个键时读盘
+5. 后台线程定期删除过期记录并截断WAL文件
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from config.settings import settings
+from utils.logger import app_logger
+
+# 待写表中表示删除的值
+_DELETED = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at) WHERE expires_at IS NOT NULL;
+"""
+
+
+class StateStore:
+    """状态存储接口，本实现不做持久化，读取总是未命中"""
+
+    backend = "none"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """读取未过期的值，不存在时返回None"""
+        return None
+
+    def put(self, namespace: str, key: str, value: Any, expires_at: Optional[float] = None):
+        """写入可JSON序列化的值，expires_at 为过期时间戳，为None时不过期"""
+
+    def delete(self, namespace: str, key: str):
+        """删除值"""
+
+    def clear_namespace(self, namespace: str) -> int:
+        """删除命名空间中的全部值，返回删除数量"""
+        return 0
+
+    def flush(self) -> int:
+        """写入所有待写记录，返回写入数量"""
+        return 0
+
+    def compact(self) -> int:
+        """删除过期记录，返回删除数量"""
+        return 0
+
+    def start(self):
+        """启动后台写入"""
+
+    def close(self):
+        """写入剩余记录并释放资源"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储统计信息"""
+        return {'backend': self.backend}
+
+
+class SQLiteStateStore(StateStore):
+    """写后批量落盘的SQLite状态存储"""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 500,
+                 compact_interval: float = 3600, logger: logging.Logger = app_logger):
+        """
+        初始化SQLite状态存储
+
+        Args:
+            path: 数据库文件路径
+            flush_interval: 后台写入间隔(秒)
+            batch_size: 待写记录达到该数量时立即写入
+            compact_interval: 删除过期记录的间隔(秒)
+            logger: 日志记录器
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_interval = compact_interval
+        self.logger = logger
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 写入连接只由后台线程和关闭流程使用；读取使用独立连接，WAL模式下读写互不阻塞
+        self._writer = self._connect()
+        self._writer.executescript(_SCHEMA)
+        self._reader = self._connect()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+        # (命名空间, 键) -> (值或_DELETED, 过期时间)；同一键的多次写入只保留最后一次
+        self._pending: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+        # 正在写入的批次，写入完成前读取仍需可见
+        self._flushing: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._writer_thread: Optional[threading.Thread] = None
+        self._stats = {
+            'reads': 0,
+            'read_hits': 0,
+            'writes': 0,
+            'coalesced': 0,
+            'flushes': 0,
+            'flushed_rows': 0,
+            'flush_errors': 0,
+            'last_flush_duration': 0.0,
+            'compacted_rows': 0
+        }
+        self.logger.info(f"状态存储已打开: {path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下 NORMAL 只在检查点时同步，断电最多丢失最近提交的事务
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        item = (namespace, key)
+        with self._lock:
+            self._stats['reads'] += 1
+            pending = self._pending.get(item) or self._flushing.get(item)
+            if pending is not None:
+                value, expires_at = pending
+                if value is _DELETED or (expires_at is not None and expires_at <= time.time()):
+                    return None
+                self._stats['read_hits'] += 1
+                return value
+
+        try:
+            with self._read_lock:
+                row = self._reader.execute(
+                    "SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?", item
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"读取状态失败: {namespace}/{key}, {str(e)}")
+            return None
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        with self._lock:
+            self._stats['read_hits'] += 1
+        return json.loads(row[0])
+
+    def put(self, namespace: str, key: str, value: Any, expires_at: Optional[float] = None):
+        self._stage(namespace, key, value, expires_at)
+
+    def delete(self, namespace: str, key: str):
+        self._stage(namespace, key, _DELETED, None)
+
+    def clear_namespace(self, namespace: str) -> int:
+        """同步删除，用于显式失效等管理操作，不在消息处理路径上调用"""
+        with self._write_lock:
+            with self._lock:
+                for item in [item for item in self._pending if item[0] == namespace]:
+                    del self._pending[item]
+            try:
+                removed = self._writer.execute("DELETE FROM state WHERE namespace = ?", (namespace,)).rowcount
+            except sqlite3.Error as e:
+                self.logger.error(f"清空状态命名空间失败: {namespace}, {str(e)}")
+                return 0
+        self.logger.info(f"清空状态命名空间 {namespace}: {removed} 条记录")
+        return removed
+
+    def _stage(self, namespace: str, key: str, value: Any, expires_at: Optional[float]):
+        """加入待写表，达到批次大小时唤醒后台线程"""
+        with self._lock:
+            if (namespace, key) in self._pending:
+                self._stats['coalesced'] += 1
+            self._pending[(namespace, key)] = (value, expires_at)
+            self._stats['writes'] += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._flushing = self._pending
+                self._pending = {}
+
+            start_time = time.time()
+            upserts = []
+            deletes = []
+            for (namespace, key), (value, expires_at) in batch.items():
+                if value is _DELETED:
+                    deletes.append((namespace, key))
+                else:
+                    upserts.append((namespace, key, json.dumps(value, ensure_ascii=False), expires_at, start_time))
+            try:
+                self._writer.execute("BEGIN")
+                if upserts:
+                    self._writer.executemany(
+                        "INSERT OR REPLACE INTO state (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        upserts
+                    )
+                if deletes:
+                    self._writer.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+                self._writer.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self._writer.in_transaction:
+                    self._writer.execute("ROLLBACK")
+                # 放回待写表，不覆盖期间的新写入
+                with self._lock:
+                    for item, entry in batch.items():
+                        self._pending.setdefault(item, entry)
+                    self._flushing = {}
+                    self._stats['flush_errors'] += 1
+                self.logger.error(f"写入状态失败: {str(e)}")
+                return 0
+
+            with self._lock:
+                self._flushing = {}
+                self._stats['flushes'] += 1
+                self._stats['flushed_rows'] += len(batch)
+                self._stats['last_flush_duration'] = round(time.time() - start_time, 4)
+            self.logger.debug(f"写入 {len(batch)} 条状态记录，耗时 {time.time() - start_time:.3f}秒")
+            return len(batch)
+
+    def compact(self) -> int:
+        try:
+            with self._write_lock:
+                cursor = self._writer.execute(
+                    "DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+                )
+                removed = cursor.rowcount
+                self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            self.logger.error(f"清理过期状态失败: {str(e)}")
+            return 0
+        with self._lock:
+            self._stats['compacted_rows'] += removed
+        if removed:
+            self.logger.info(f"清理了 {removed} 条过期状态记录")
+        return removed
+
+    def start(self):
+        """启动后台写入线程，启动时先清理一次过期记录"""
+        if self._writer_thread is not None and self._writer_thread.is_alive():
+            return
+        self._stop_event.clear()
+
+        def run():
+            self.compact()
+            next_compact = time.time() + self.compact_interval
+            while not self._stop_event.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                try:
+                    self.flush()
+                    if time.time() >= next_compact:
+                        self.compact()
+                        next_compact = time.time() + self.compact_interval
+                except Exception as e:
+                    self.logger.error(f"状态存储后台任务失败: {str(e)}")
+
+        self._writer_thread = threading.Thread(target=run, name="state-store-writer", daemon=True)
+        self._writer_thread.start()
+
+    def close(self):
+        """停止后台线程，写入剩余记录并关闭数据库"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._writer_thread is not None:
+            self._writer_thread.join(timeout=10)
+        self.flush()
+        with self._write_lock, self._read_lock:
+            self._reader.close()
+            self._writer.close()
+        self.logger.info(f"状态存储已关闭: {self.path}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['backend'] = self.backend
+        return stats
+
+
+_store: Optional[StateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    """获取进程内共享的状态存储；未配置 STATE_STORE_PATH 时不做持久化"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = StateStore()
+                if settings.STATE_STORE_PATH:
+                    try:
+                        store = SQLiteStateStore(
+                            settings.STATE_STORE_PATH,
+                            flush_interval=settings.STATE_STORE_FLUSH_INTERVAL,
+                            batch_size=settings.STATE_STORE_BATCH_SIZE,
+                            compact_interval=settings.STATE_STORE_COMPACT_INTERVAL
+                        )
+                        store.start()
+                    except (sqlite3.Error, OSError) as e:
+                        app_logger.error(f"打开状态存储失败，状态不做持久化: {str(e)}")
+                _store = store
+    return _store
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+字节流分发
+
+把一个异步字节流同时分发给多个消费者，例如边下载边上传到钉钉云盘和Dify：
+1. 每个消费者一个有界队列，内存占用只与缓冲块数有关，与文件大小无关
+2. 最慢的消费者决定读取速度，源数据不会在内存中堆积
+3. 某个消费者失败或提前结束时自动脱离，不影响其他消费者
+4. 所有消费者都脱离后停止读取源数据
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from utils.logger import app_logger
+
+# 流结束标记
+_EOF = object()
+
+
+class _SourceError:
+    """源数据读取失败，传递给各消费者"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class FanoutBranch:
+    """单个消费者看到的字节流"""
+
+    def __init__(self, index: int, max_buffered_chunks: int):
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered_chunks)
+        self.detached = False
+        self.bytes_consumed = 0
+
+    def detach(self):
+        """消费者不再读取，清空队列以免阻塞源数据读取"""
+        self.detached = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[bytes]:
+        while True:
+            item = await self.queue.get()
+            if item is _EOF:
+                return
+            if isinstance(item, _SourceError):
+                raise item.error
+            self.bytes_consumed += len(item)
+            yield item
+
+
+class StreamFanout:
+    """把一个异步字节流分发给多个消费者"""
+
+    def __init__(self, source: AsyncIterator[bytes], max_buffered_chunks: int = 4,
+                 logger: logging.Logger = app_logger):
+        """
+        初始化分发器
+
+        Args:
+            source: 源字节流
+            max_buffered_chunks: 每个消费者最多缓冲的数据块数
+            logger: 日志记录器
+        """
+        self.source = source
+        self.max_buffered_chunks = max(1, max_buffered_chunks)
+        self.logger = logger
+        self.bytes_read = 0
+        self._branches: List[FanoutBranch] = []
+
+    async def _pump(self):
+        """读取源数据并依次放入各消费者的队列"""
+        end_item: Any = _EOF
+        try:
+            async for chunk in self.source:
+                live = [branch for branch in self._branches if not branch.detached]
+                if not live:
+                    self.logger.info("所有消费者已结束，停止读取源数据")
+                    break
+                self.bytes_read += len(chunk)
+                for branch in live:
+                    await branch.queue.put(chunk)
+        except Exception as e:
+            self.logger.error(f"读取源数据失败: {str(e)}")
+            end_item = _SourceError(e)
+        finally:
+            for branch in self._branches:
+                if not branch.detached:
+                    await branch.queue.put(end_item)
+
+    async def _consume(self, branch: FanoutBranch, consumer: Callable[[FanoutBranch], Awaitable[Any]]) -> Any:
+        try:
+            return await consumer(branch)
+        finally:
+            branch.detach()
+
+    async def run(self, *consumers: Callable[[AsyncIterator[bytes]], Awaitable[Any]]) -> List[Any]:
+        """
+        运行分发，直到源数据读完且所有消费者结束
+
+        Args:
+            *consumers: 消费者函数，参数为该消费者的字节流
+
+        Returns:
+            List[Any]: 各消费者的返回值，失败的消费者对应位置为异常对象
+        """
+        self._branches = [FanoutBranch(index, self.max_buffered_chunks) for index in range(len(consumers))]
+        pump_task = asyncio.create_task(self._pump())
+        try:
+            results = await asyncio.gather(
+                *(self._consume(branch, consumer) for branch, consumer in zip(self._branches, consumers)),
+                return_exceptions=True
+            )
+        finally:
+            # 消费者全部结束后源数据不再需要
+            if not pump_task.done():
+                pump_task.cancel()
+            await asyncio.gather(pump_task, return_exceptions=True)
+        return results
+
+    def get_stats(self) -> dict:
+        """获取分发统计信息"""
+        return {
+            'bytes_read': self.bytes_read,
+            'branches': [
+                {'bytes_consumed': branch.bytes_consumed, 'detached': branch.detached}
+                for branch in self._branches
+            ]
+        }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+后台任务注册表
+
+用于快速ACK模式：回调消息校验通过后立即应答钉钉，
+实际处理交给受监管的后台任务执行，包括：
+1. 有界并发，超出上限的任务排队等待
+2. 单任务超时，超时自动取消
+3. 异常统一记录，不影响其他任务
+4. 关闭时停止接收新任务并等待已有任务完成
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from utils.logger import app_logger
+
+
+class BackgroundTaskRegistry:
+    """受监管的后台任务注册表"""
+
+    def __init__(self, max_concurrency: int = 100, task_timeout: float = 300,
+                 logger: logging.Logger = app_logger):
+        """
+        初始化后台任务注册表
+
+        Args:
+            max_concurrency: 同时运行的任务数上限
+            task_timeout: 单个任务的最长运行时间(秒)，不包括排队时间
+            logger: 日志记录器
+        """
+        self.max_concurrency = max_concurrency
+        self.task_timeout = task_timeout
+        self.logger = logger
+        self._tasks: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+        self._running = 0
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'cancelled': 0,
+            'rejected': 0
+        }
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """在当前事件循环中按需创建并发信号量"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @property
+    def closing(self) -> bool:
+        """是否已停止接收新任务"""
+        return self._closing
+
+    def spawn(self, name: str, coro_factory: Callable[[], Awaitable[Any]]) -> Optional[asyncio.Task]:
+        """
+        提交后台任务
+
+        Args:
+            name: 任务名称，用于日志
+            coro_factory: 返回协程的工厂函数，获得并发名额后才会调用
+
+        Returns:
+            Optional[asyncio.Task]: 创建的任务，注册表关闭时返回None
+        """
+        if self._closing:
+            self._stats['rejected'] += 1
+            self.logger.warning(f"后台任务注册表正在关闭，拒绝任务: {name}")
+            return None
+
+        self._stats['submitted'] += 1
+        task = asyncio.get_running_loop().create_task(self._run(name, coro_factory), name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, name: str, coro_factory: Callable[[], Awaitable[Any]]):
+        """获取并发名额后执行任务，并记录结果"""
+        enqueued_at = time.time()
+        async with self._get_semaphore():
+            wait_time = time.time() - enqueued_at
+            if wait_time > 1:
+                self.logger.info(f"后台任务 {name} 排队 {wait_time:.3f}秒后开始执行")
+
+            self._running += 1
+            started_at = time.time()
+            try:
+                result = await asyncio.wait_for(coro_factory(), timeout=self.task_timeout)
+                self._stats['completed'] += 1
+                self.logger.debug(f"后台任务 {name} 完成，耗时 {time.time() - started_at:.3f}秒")
+                return result
+            except asyncio.TimeoutError:
+                self._stats['timed_out'] += 1
+                self.logger.error(f"后台任务 {name} 超时({self.task_timeout}秒)，已取消")
+            except asyncio.CancelledError:
+                self._stats['cancelled'] += 1
+                self.logger.warning(f"后台任务 {name} 被取消")
+                raise
+            except Exception as e:
+                self._stats['failed'] += 1
+                self.logger.exception(f"后台任务 {name} 执行异常: {str(e)}")
+            finally:
+                self._running -= 1
+
+    async def drain(self, timeout: float = 30) -> bool:
+        """
+        停止接收新任务，并等待已有任务完成
+
+        Args:
+            timeout: 最长等待时间(秒)，超时后取消剩余任务
+
+        Returns:
+            bool: 所有任务是否在超时前正常结束
+        """
+        self._closing = True
+        pending = set(self._tasks)
+        if not pending:
+            return True
+
+        self.logger.info(f"等待 {len(pending)} 个后台任务完成，最长 {timeout} 秒")
+        done, pending = await asyncio.wait(pending, timeout=timeout)
+
+        if pending:
+            self.logger.warning(f"仍有 {len(pending)} 个后台任务未完成，正在取消")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            return False
+
+        self.logger.info("所有后台任务已完成")
+        return True
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取任务统计信息"""
+        stats = dict(self._stats)
+        stats['active'] = len(self._tasks)
+        stats['running'] = self._running
+        stats['queued'] = len(self._tasks) - self._running
+        return stats